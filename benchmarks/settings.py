@@ -0,0 +1,26 @@
+"""
+Settings of the benchmark suite, those of the test suite with the
+database picked from the environment:
+
+    - ``NOTIFY_BENCH_DB=sqlite`` (default) uses an in-memory SQLite database.
+    - ``NOTIFY_BENCH_DB=postgresql`` uses a local PostgreSQL server, see the
+      ``NOTIFY_BENCH_PG_*`` variables below. The benchmarks run in a
+      temporary test database.
+"""
+import os
+
+from notify.tests.test_settings import *  # noqa
+
+if os.environ.get('NOTIFY_BENCH_DB', 'sqlite') == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('NOTIFY_BENCH_PG_NAME', 'notify_bench'),
+            'USER': os.environ.get('NOTIFY_BENCH_PG_USER', 'postgres'),
+            'PASSWORD': os.environ.get('NOTIFY_BENCH_PG_PASSWORD', ''),
+            'HOST': os.environ.get('NOTIFY_BENCH_PG_HOST', 'localhost'),
+            'PORT': os.environ.get('NOTIFY_BENCH_PG_PORT', '5432'),
+        }
+    }
+
+ALLOWED_HOSTS = ['testserver']
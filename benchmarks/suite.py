@@ -0,0 +1,163 @@
+"""
+Benchmarks of the hot paths of ``django-notify-x``.
+
+Each benchmark is a function decorated with ``@benchmark``, called once per
+parameter set. It prepares its data and returns the callable to measure.
+Every run happens in a transaction which is rolled back afterwards, so
+benchmarks do not see each other's data.
+"""
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group, Permission
+from django.contrib.contenttypes.models import ContentType
+from django.template import RequestContext, Template
+from django.test import Client, RequestFactory
+
+from notify.models import Notification
+from notify.signals import notify
+
+User = get_user_model()
+
+# [(name, function, params_factory), ...]
+BENCHMARKS = []
+
+
+def benchmark(params=None):
+    """
+    Registers a benchmark.
+
+    :param params: Callable taking the list of sizes of the run and
+                   returning the list of parameter dictionaries to run
+                   the benchmark with, a single run without parameters
+                   when omitted.
+    """
+    def decorator(func):
+        BENCHMARKS.append((func.__name__, func,
+                           params or (lambda sizes: [{}])))
+        return func
+    return decorator
+
+
+def create_users(count, prefix='bench'):
+    User.objects.bulk_create(
+        [User(username='{}-{}'.format(prefix, i),
+              email='{}-{}@example.com'.format(prefix, i))
+         for i in range(count)])
+    return User.objects.filter(username__startswith=prefix + '-')
+
+
+def create_notifications(recipient, count, **fields):
+    Notification.objects.bulk_create(
+        [Notification(recipient=recipient, actor_text='Joe',
+                      verb='followed you', **fields)
+         for i in range(count)])
+
+
+@benchmark()
+def notify_single():
+    recipient, actor = create_users(2)
+
+    def run():
+        notify.send(User, recipient=recipient, actor=actor,
+                    verb='followed you')
+    return run
+
+
+@benchmark(lambda sizes: [{'recipients': n} for n in sizes])
+def notify_fan_out(recipients):
+    actor = User.objects.create(username='actor')
+    recipient_list = create_users(recipients)
+
+    def run():
+        notify.send(User, recipient_list=recipient_list, actor=actor,
+                    target=actor, verb='uploaded a video')
+    return run
+
+
+@benchmark(lambda sizes: [{'content_types': n,
+                           'notifications': min(max(sizes), 1000)}
+                          for n in (1, 2, 4)])
+def prefetch_relations(content_types, notifications):
+    recipient = create_users(1, 'recipient')[0]
+    groups = [Group.objects.create(name='group-{}'.format(i))
+              for i in range(10)]
+    pools = [list(create_users(10)), groups,
+             list(Permission.objects.all()[:10]),
+             list(ContentType.objects.all()[:10])][:content_types]
+    objects = [obj for pool in pools for obj in pool]
+
+    Notification.objects.bulk_create([
+        Notification(recipient=recipient, verb='followed you',
+                     actor_content_object=objects[i % len(objects)],
+                     target_content_object=objects[-i % len(objects)])
+        for i in range(notifications)])
+
+    def run():
+        for nf in Notification.objects.all().prefetch():
+            nf.actor, nf.target
+    return run
+
+
+def logged_in_client():
+    user = create_users(1, 'poller')[0]
+    client = Client()
+    client.force_login(user)
+    return user, client
+
+
+@benchmark(lambda sizes: [{'new_notifications': n} for n in (0, 20, 100)])
+def notification_update(new_notifications):
+    user, client = logged_in_client()
+    create_notifications(user, 1)
+    flag = user.notifications.get().id
+    create_notifications(user, new_notifications)
+    url = '/api/update/?flag={}'.format(flag)
+
+    def run():
+        client.get(url)
+    return run
+
+
+@benchmark()
+def notification_update_not_modified():
+    user, client = logged_in_client()
+    create_notifications(user, 20)
+    url = '/api/update/?flag={}'.format(user.notifications.earliest('id').id)
+    etag = client.get(url)['ETag']
+
+    def run():
+        client.get(url, HTTP_IF_NONE_MATCH=etag)
+    return run
+
+
+@benchmark(lambda sizes: [{'notifications': min(max(sizes), 1000)}])
+def user_notifications_tag(notifications):
+    user = create_users(1, 'reader')[0]
+    create_notifications(user, notifications)
+    template = Template('{% load notification_tags %}'
+                        '{% user_notifications %}')
+    request = RequestFactory().get('/')
+    request.user = user
+
+    def run():
+        template.render(RequestContext(request, {}))
+    return run
+
+
+@benchmark(lambda sizes: [{'notifications': n} for n in sizes])
+def read_all(notifications):
+    user = create_users(1, 'reader')[0]
+    create_notifications(user, notifications)
+
+    def run():
+        Notification.objects.read_all(user)
+    return run
+
+
+@benchmark(lambda sizes: [{'notifications': n} for n in sizes])
+def delete_all(notifications):
+    user = create_users(1, 'reader')[0]
+    create_notifications(user, notifications)
+
+    def run():
+        Notification.objects.delete_all(user)
+    return run
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Notification
+from .models import Notification, NotificationJob
 
 
 @admin.register(Notification)
@@ -29,3 +29,9 @@ class NotificationAdmin(admin.ModelAdmin):
             ('Other details',
                 {'fields': ('extra', 'read', 'deleted')}),
         )
+
+
+@admin.register(NotificationJob)
+class NotificationJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'created', 'progress', 'attempts', 'locked_until')
+    readonly_fields = ('created', )
@@ -0,0 +1,175 @@
+"""
+Aggregation of similar notifications.
+
+Notifications sent with ``aggregate=True`` are collapsed per recipient:
+all notifications with the same ``verb``, ``nf_type`` and target sent
+within the same ``NOTIFY_AGGREGATE_WINDOW`` share an ``aggregate_key``,
+and only the first of them inserts a row. The following ones replace that
+row with an updated copy, its ``extra`` holds:
+
+    - ``aggregate_count``: Number of notifications collapsed into the row.
+    - ``recent_actors``: Up to ``NOTIFY_AGGREGATE_MAX_ACTORS`` of the most
+      recent actors, newest first, as ``{'text': ..., 'url': ...}``.
+
+The actor fields and ``created`` of the row are those of the latest
+notification, and an aggregate which was read or deleted becomes unread
+again. The copy gets a new ID, so that clients polling or streaming the
+notifications above their latest ID receive the updated aggregate.
+
+Rows are unique per ``(recipient, aggregate_key)``. Senders lock the
+existing aggregates of their recipients with ``SELECT ... FOR UPDATE`` and
+retry when a parallel sender inserted a missing one first. Senders which
+waited for the lock of a replaced row do not see the copy and always
+retry once, so there is no limit on the number of retries: each of them
+follows a sender which delivered.
+"""
+import hashlib
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.utils.encoding import force_bytes, force_text
+
+from . import counters, events
+from .utils import invalidate_fragments
+
+
+def make_key(verb, nf_type, target=None, target_text=None, now=None):
+    """
+    Builds the aggregate key of a notification.
+
+    :param verb: Verb of the notification.
+    :param nf_type: Type of the notification.
+    :param target: Target object, if any.
+    :param target_text: Anonymous target, used when there is no target object.
+    :param now: Timestamp (in seconds) of the notification.
+
+    :return: Hexadecimal key.
+    """
+    from django.contrib.contenttypes.models import ContentType
+
+    if target is not None:
+        target_id = '{}:{}'.format(
+            ContentType.objects.get_for_model(target).pk, target.pk)
+    else:
+        target_id = target_text or ''
+
+    window = getattr(settings, 'NOTIFY_AGGREGATE_WINDOW', 3600)
+    bucket = int((time.time() if now is None else now) // window)
+    key = u'|'.join([verb, nf_type, target_id, str(bucket)])
+    return hashlib.sha1(force_bytes(key)).hexdigest()
+
+
+def actor_entry(actor=None, actor_text=None, actor_url=None):
+    """
+    JSON serializable representation of an actor, kept in
+    ``recent_actors``.
+    """
+    if actor is not None:
+        try:
+            url = actor.get_absolute_url()
+        except AttributeError:
+            url = actor_url
+        return {'text': force_text(actor), 'url': url}
+    return {'text': actor_text, 'url': actor_url}
+
+
+def merge_extra(extra, new_extra):
+    """
+    Merges the ``extra`` of a new notification into the ``extra`` of an
+    existing aggregate.
+
+    :return: New ``extra`` of the aggregate.
+    """
+    max_actors = getattr(settings, 'NOTIFY_AGGREGATE_MAX_ACTORS', 5)
+    merged = dict(extra or {})
+    new_extra = dict(new_extra or {})
+
+    count = merged.get('aggregate_count', 1)
+    actors = new_extra.pop('recent_actors', [])
+    actors += [actor for actor in merged.get('recent_actors', [])
+               if actor not in actors]
+
+    merged.update(new_extra)
+    merged['aggregate_count'] = count + new_extra.get('aggregate_count', 1)
+    merged['recent_actors'] = actors[:max_actors]
+    return merged
+
+
+class _Conflict(Exception):
+    """
+    Raised when a parallel sender inserted an aggregate which was missing.
+    """
+
+
+def deliver(recipient_ids, fields):
+    """
+    Creates or updates the aggregates of one batch of recipients, see
+    ``notify.signals.deliver_batch``.
+
+    :param recipient_ids: List of user IDs.
+    :param fields: Keyword arguments of the ``Notification`` objects,
+                   including ``aggregate_key``.
+
+    :return: Number of notifications delivered.
+    """
+    recipient_ids = list(set(recipient_ids))
+    while True:
+        try:
+            with transaction.atomic():
+                return _deliver(recipient_ids, fields)
+        except _Conflict:
+            # The aggregates inserted by the parallel sender are locked and
+            # updated on the next attempt.
+            pass
+
+
+def _deliver(recipient_ids, fields):
+    from .models import Notification
+
+    key = fields['aggregate_key']
+    existing = Notification.objects.select_for_update().filter(
+        recipient_id__in=recipient_ids, aggregate_key=key)
+
+    deltas = Counter()
+    bumped = []
+    for nf in existing:
+        # ``read`` accounts for the read watermark, the copy is above it.
+        if nf.read or nf.deleted:
+            deltas[nf.recipient_id] += 1
+        extra = merge_extra(nf.extra, fields.get('extra'))
+        for name, value in fields.items():
+            setattr(nf, name, value)
+        nf.extra = extra
+        nf.read = nf.deleted = False
+        nf.created = timezone.now()
+        bumped.append(nf)
+
+    if bumped:
+        old_ids = [nf.id for nf in bumped]
+        Notification.objects.filter(id__in=old_ids).delete()
+        invalidate_fragments(old_ids)
+        for nf in bumped:
+            nf.pk = None
+
+    found = set(nf.recipient_id for nf in bumped)
+    missing = [recipient_id for recipient_id in recipient_ids
+               if recipient_id not in found]
+    try:
+        with transaction.atomic():
+            Notification.objects.bulk_create(
+                bumped + [Notification(recipient_id=recipient_id, **fields)
+                          for recipient_id in missing])
+    except IntegrityError:
+        # Other integrity errors, e.g. unknown recipients, are not retried.
+        if not Notification.objects.filter(
+                recipient_id__in=missing, aggregate_key=key).exists():
+            raise
+        raise _Conflict()
+
+    deltas.update(missing)
+    counters.adjust(deltas)
+    events.publish(recipient_ids)
+    return len(recipient_ids)
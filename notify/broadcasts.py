@@ -0,0 +1,183 @@
+"""
+Broadcast notifications.
+
+A broadcast is a single notification row without recipient, sent with
+``notify.send(..., broadcast=True)`` and shown to every user when
+``NOTIFY_BROADCASTS`` is enabled. The read and deleted states of a user
+are only stored in ``BroadcastState`` once the user marks or deletes the
+broadcast, so a broadcast costs one row whatever the number of users.
+
+    - ``Notification.objects.for_user(user)`` returns the notifications of
+      the user merged with the broadcasts sent after the user joined
+      (``date_joined``, when the user model has one).
+    - On such querysets ``active()``, ``deleted()``, ``unread()`` and
+      ``read()`` interpret the states of the user, and loaded broadcasts
+      get their ``read`` and ``deleted`` attributes from them (see
+      ``attach()``), so templates and ``as_json()`` need no change.
+    - ``mark_as_read()``, ``mark_as_unread()``, ``soft_delete()`` and
+      ``restore()`` of a broadcast loaded with ``for_user()`` write the
+      state of that user.
+    - Unread counters only cover the notifications of the user, unread
+      broadcasts are counted on the fly, see ``unread_count()``.
+"""
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+
+
+def broadcast_enabled():
+    """
+    Whether broadcasts are merged into the notifications of users.
+    """
+    return getattr(settings, 'NOTIFY_BROADCASTS', False)
+
+
+def _user_id(user):
+    return getattr(user, 'pk', user)
+
+
+def state_ids(user, *args, **kwargs):
+    """
+    :param user: User instance or ID.
+
+    :return: Subquery of the IDs of the broadcasts whose state for the
+             user matches the supplied filters.
+    """
+    from .models import BroadcastState
+
+    return BroadcastState.objects.filter(
+        *args, user=_user_id(user), **kwargs).values('notification')
+
+
+def visible_q(user):
+    """
+    :param user: User instance or ID.
+
+    :return: ``Q`` object matching the broadcasts shown to the user,
+             including the ones the user deleted.
+    """
+    q = Q(recipient__isnull=True, deleted=False)
+    date_joined = getattr(user, 'date_joined', None)
+    if date_joined:
+        q &= Q(created__gte=date_joined)
+    return q
+
+
+def feed_q(user):
+    """
+    :param user: User instance or ID.
+
+    :return: ``Q`` object matching the notifications and the broadcasts of
+             the user.
+    """
+    return Q(recipient=_user_id(user)) | visible_q(user)
+
+
+def attach(notifications, user):
+    """
+    Sets the ``read`` and ``deleted`` attributes of loaded broadcasts
+    from the states of the user, with a single query.
+
+    :param notifications: List of ``Notification`` instances.
+    :param user: User instance or ID.
+    """
+    from .models import BroadcastState
+
+    broadcasts = [nf for nf in notifications if nf.recipient_id is None]
+    if not broadcasts:
+        return
+    states = dict(
+        (notification_id, (read, deleted))
+        for notification_id, read, deleted in BroadcastState.objects.filter(
+            user=_user_id(user), notification__in=broadcasts).values_list(
+            'notification', 'read', 'deleted'))
+    for nf in broadcasts:
+        nf.broadcast_user_id = _user_id(user)
+        nf.read, nf.deleted = states.get(nf.id, (False, False))
+
+
+def set_state(notification, field, value):
+    """
+    Changes the state of a broadcast for the user it was loaded for.
+
+    :param notification: Broadcast loaded with ``for_user()``.
+    :param field: ``read`` or ``deleted``.
+    :param value: New value of the state.
+
+    :return: Whether the state changed.
+    """
+    from .models import BroadcastState
+
+    user_id = getattr(notification, 'broadcast_user_id', None)
+    if user_id is None:
+        raise ValueError("Broadcasts must be loaded with "
+                         "Notification.objects.for_user() to change their "
+                         "state.")
+
+    states = BroadcastState.objects.filter(user=user_id,
+                                           notification=notification.pk)
+    changed = states.exclude(**{field: value}).update(**{field: value})
+    if not changed and value and not states.exists():
+        try:
+            with transaction.atomic():
+                BroadcastState.objects.create(
+                    user_id=user_id, notification_id=notification.pk,
+                    **{field: value})
+            changed = 1
+        except IntegrityError:
+            # Created concurrently.
+            changed = states.exclude(**{field: value}).update(
+                **{field: value})
+    setattr(notification, field, value)
+    return bool(changed)
+
+
+def set_all(user, field, value, attempts=3):
+    """
+    Changes the state of every broadcast of a user, for ``read_all()``,
+    ``unread_all()``, ``delete_all()`` and ``active_all()``. Writes one
+    state per broadcast which has none yet.
+
+    :param user: User instance or ID.
+    :param field: ``read`` or ``deleted``.
+    :param value: New value of the states.
+    :param attempts: Number of tries when states are created concurrently.
+    """
+    from .models import BroadcastState, Notification
+
+    states = BroadcastState.objects.filter(user=_user_id(user))
+    if not value:
+        states.filter(**{field: True}).update(**{field: False})
+        return
+
+    ids = list(Notification.objects.filter(visible_q(user)).exclude(
+        id__in=state_ids(user, **{field: True})).values_list('id', flat=True))
+    for attempt in range(attempts):
+        try:
+            with transaction.atomic():
+                states.filter(notification__in=ids).update(**{field: True})
+                existing = set(states.filter(
+                    notification__in=ids).values_list(
+                    'notification', flat=True))
+                BroadcastState.objects.bulk_create([
+                    BroadcastState(user_id=_user_id(user),
+                                   notification_id=notification_id,
+                                   **{field: True})
+                    for notification_id in ids
+                    if notification_id not in existing])
+            return
+        except IntegrityError:
+            if attempt == attempts - 1:
+                raise
+
+
+def unread_count(user):
+    """
+    :param user: User instance or ID.
+
+    :return: Number of unread broadcasts of the user.
+    """
+    from .models import Notification
+
+    return Notification.objects.filter(visible_q(user)).exclude(
+        id__in=state_ids(user, Q(read=True) | Q(deleted=True))).count()
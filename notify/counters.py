@@ -0,0 +1,205 @@
+"""
+Per-user unread counters.
+
+When ``NOTIFY_UNREAD_COUNTER`` is enabled, the number of unread
+notifications of every user is kept in ``NotificationCounter`` and
+updated along with every write which changes it, so reading it costs a
+single primary key lookup instead of a ``COUNT()``.
+
+Counters are created lazily from the notification table, writes to
+users without a counter row are ignored. ``manage.py
+notify_rebuild_counters`` recomputes them from scratch.
+"""
+from collections import Counter
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Max
+from django.utils import timezone
+
+from . import broadcasts
+
+
+def counter_enabled():
+    """
+    Whether unread counters are maintained.
+    """
+    return getattr(settings, 'NOTIFY_UNREAD_COUNTER', False)
+
+
+def _user_id(user):
+    return getattr(user, 'pk', user)
+
+
+def adjust(deltas):
+    """
+    Atomically applies per-user changes to the unread counters.
+
+    :param deltas: Dictionary of ``{user_id: change}``.
+    """
+    from .models import NotificationCounter
+
+    if not counter_enabled():
+        return
+    now = timezone.now()
+    for user_id, delta in deltas.items():
+        if delta:
+            NotificationCounter.objects.filter(user_id=user_id).update(
+                unread=F('unread') + delta, modified=now)
+
+
+def count_per_recipient(queryset):
+    """
+    Number of notifications per recipient in a queryset.
+
+    :return: Dictionary of ``{user_id: count}``.
+    """
+    rows = queryset.order_by().values_list('recipient').annotate(
+        n=Count('id'))
+    return dict(rows)
+
+
+@contextmanager
+def track(queryset, sign, counted=None):
+    """
+    Adjusts the counters of the recipients in ``queryset`` by ``sign``
+    times their number of rows, once the enclosed block has run.
+
+    The rows are locked with ``SELECT ... FOR UPDATE`` and counted before
+    the block is executed, the block receives a queryset restricted to
+    them and is expected to change all of them, e.g.
+    ``locked.update(read=True)``. Rows inserted or changed concurrently
+    are thus neither changed nor counted.
+
+    :param queryset: Notifications affected by the block.
+    :param sign: ``1`` when the rows become unread, ``-1`` otherwise.
+    :param counted: ``Q`` object, only the locked rows matching it are
+                    counted when supplied.
+    """
+    if not counter_enabled():
+        yield queryset
+        return
+
+    with transaction.atomic():
+        rows = list(queryset.select_for_update().order_by().values_list(
+            'id', 'recipient'))
+        locked = queryset.model.objects.filter(
+            id__in=[nf_id for nf_id, recipient_id in rows])
+        if counted is None:
+            counts = Counter(recipient_id for nf_id, recipient_id in rows)
+        else:
+            counts = count_per_recipient(locked.filter(counted))
+        yield locked
+        adjust(dict((user_id, sign * n) for user_id, n in counts.items()))
+
+
+def unread_count(user):
+    """
+    Number of unread notifications of a user, uses the counter when it is
+    enabled.
+
+    :param user: User instance or ID.
+
+    :return: Unread notification count.
+    """
+    from .models import Notification, NotificationCounter
+
+    if not counter_enabled():
+        return Notification.objects.for_user(user).unread().count()
+
+    try:
+        count = NotificationCounter.objects.values_list(
+            'unread', flat=True).get(user_id=_user_id(user))
+    except NotificationCounter.DoesNotExist:
+        count = rebuild([_user_id(user)])[_user_id(user)]
+    if broadcasts.broadcast_enabled():
+        # Broadcasts are not counted in the counters.
+        count += broadcasts.unread_count(user)
+    return count
+
+
+def rebuild(users=None):
+    """
+    Recomputes the counters from the notification table.
+
+    :param users: Users (or their IDs) to rebuild, all users with
+                  notifications or a counter when omitted.
+
+    :return: Dictionary of ``{user_id: unread_count}``.
+    """
+    from .models import Notification, NotificationCounter
+
+    # Broadcasts, without recipient, are not counted.
+    unread = Notification.objects.filter(recipient__isnull=False).unread()
+    if users is None:
+        user_ids = set(Notification.objects.filter(
+            recipient__isnull=False).order_by().values_list(
+            'recipient', flat=True).distinct())
+        user_ids.update(NotificationCounter.objects.values_list(
+            'user_id', flat=True))
+    else:
+        user_ids = set(_user_id(user) for user in users)
+        unread = unread.filter(recipient__in=user_ids)
+
+    counts = dict.fromkeys(user_ids, 0)
+    counts.update(count_per_recipient(unread))
+    return store(counts)
+
+
+def store(counts):
+    """
+    Overwrites the counters of the supplied users, creating them if needed.
+
+    :param counts: Dictionary of ``{user_id: unread_count}``.
+
+    :return: ``counts``.
+    """
+    from .models import NotificationCounter
+
+    now = timezone.now()
+    for user_id, n in counts.items():
+        updated = NotificationCounter.objects.filter(user_id=user_id).update(
+            unread=n, modified=now)
+        if not updated:
+            try:
+                with transaction.atomic():
+                    NotificationCounter.objects.create(user_id=user_id,
+                                                       unread=n)
+            except IntegrityError:
+                # Created concurrently.
+                NotificationCounter.objects.filter(user_id=user_id).update(
+                    unread=n, modified=now)
+    return counts
+
+
+def version(user):
+    """
+    Cheap token which changes whenever the user receives a notification or
+    the unread state of its notifications changes, used as ``ETag`` of
+    the update view.
+
+    Costs an index lookup for the latest notification ID, plus a counter
+    lookup when counters are enabled or a ``COUNT()`` otherwise.
+
+    :param user: User instance or ID.
+
+    :return: Version string.
+    """
+    from .models import Notification, NotificationCounter
+
+    last_id = Notification.objects.for_user(user).aggregate(
+        last_id=Max('id'))['last_id']
+
+    if not counter_enabled():
+        return '{}-{}'.format(last_id or 0, unread_count(user))
+
+    try:
+        unread, modified = NotificationCounter.objects.values_list(
+            'unread', 'modified').get(user_id=_user_id(user))
+    except NotificationCounter.DoesNotExist:
+        rebuild([_user_id(user)])
+        return version(user)
+    if broadcasts.broadcast_enabled():
+        unread += broadcasts.unread_count(user)
+    return '{}-{}-{}'.format(last_id or 0, unread, modified.isoformat())
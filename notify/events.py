@@ -0,0 +1,244 @@
+"""
+Wake-up backends used by the long-polling update view and the event
+stream.
+
+A backend is told about the users who received new notifications
+(``publish``) and lets a request block until something was published for
+its user (``wait``). The backend is configured with the
+``NOTIFY_EVENT_BACKEND`` setting:
+
+    - ``notify.events.DatabaseBackend`` (default) polls the notification
+      table, works with any deployment.
+    - ``notify.events.LocalBackend`` wakes up waiting requests of the
+      same process, suitable for single process servers and tests.
+    - ``notify.events.RedisBackend`` uses Redis pub/sub, for deployments
+      with several processes or hosts. Requires the ``redis`` package.
+
+Broadcasts (see ``notify.broadcasts``) are published on the shared
+``BROADCAST`` channel, which every user also listens to when
+``NOTIFY_BROADCASTS`` is enabled.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+from . import broadcasts
+
+# Channel of broadcasts, published instead of a user ID.
+BROADCAST = 'broadcast'
+
+
+def channels(user_id):
+    """
+    :param user_id: User ID.
+
+    :return: Channels a user listens to: the user ID, and ``BROADCAST``
+             when broadcasts are enabled.
+    """
+    if broadcasts.broadcast_enabled():
+        return [user_id, BROADCAST]
+    return [user_id]
+
+
+class BaseBackend(object):
+
+    """
+    Interface of wake-up backends.
+    """
+
+    def publish(self, user_ids):
+        """
+        Signals that the supplied users received new notifications.
+
+        :param user_ids: Iterable of user IDs, or ``BROADCAST``.
+        """
+        raise NotImplementedError
+
+    def cursor(self, user_id):
+        """
+        Opaque position in the event stream of a user, taken before
+        looking for new notifications so that nothing published in
+        between is missed by ``wait()``.
+
+        :param user_id: User ID.
+        """
+        return None
+
+    def wait(self, user_id, cursor, last_id, timeout):
+        """
+        Blocks until a notification newer than ``last_id`` might be
+        available for the user or ``timeout`` seconds have elapsed.
+
+        :param user_id: User ID.
+        :param cursor: Value returned by ``cursor()``.
+        :param last_id: Last notification ID known to the client.
+        :param timeout: Seconds to wait for at most.
+
+        :return: Whether the wait was woken up by an event.
+        """
+        raise NotImplementedError
+
+
+class LocalBackend(BaseBackend):
+
+    """
+    In-process backend, waiting requests block on a condition variable
+    which is notified by ``publish()`` in the same process.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._versions = {}
+
+    def publish(self, user_ids):
+        with self._condition:
+            for user_id in user_ids:
+                self._versions[user_id] = self._versions.get(user_id, 0) + 1
+            self._condition.notify_all()
+
+    def _cursor(self, user_id):
+        return [self._versions.get(channel, 0)
+                for channel in channels(user_id)]
+
+    def cursor(self, user_id):
+        with self._condition:
+            return self._cursor(user_id)
+
+    def wait(self, user_id, cursor, last_id, timeout):
+        deadline = time.time() + timeout
+        with self._condition:
+            while self._cursor(user_id) == cursor:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+
+class DatabaseBackend(BaseBackend):
+
+    """
+    Fallback backend polling the notification table every
+    ``NOTIFY_LONG_POLL_INTERVAL`` seconds, so that a single request
+    replaces many client round-trips. The interval defaults to the
+    polling interval of ``notifyX.js`` (``NOTIFY_UPDATE_TIME_INTERVAL``),
+    so that long polling issues no more queries than plain polling.
+    """
+
+    def publish(self, user_ids):
+        pass
+
+    def wait(self, user_id, cursor, last_id, timeout):
+        from .models import Notification
+
+        interval = getattr(
+            settings, 'NOTIFY_LONG_POLL_INTERVAL',
+            getattr(settings, 'NOTIFY_UPDATE_TIME_INTERVAL', 5000) / 1000.0)
+        deadline = time.time() + timeout
+        user = user_id
+        if broadcasts.broadcast_enabled():
+            # Loads the user so that broadcasts sent before it joined are
+            # left out, see ``broadcasts.visible_q``.
+            user = get_user_model()._default_manager.filter(
+                pk=user_id).first() or user_id
+        new = Notification.objects.for_user(user).filter(
+            id__gt=last_id).active()
+        while True:
+            if new.exists():
+                return True
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            time.sleep(min(interval, remaining))
+
+
+class RedisBackend(BaseBackend):
+
+    """
+    Redis pub/sub backend. Every user gets a channel on which ``publish()``
+    sends a message, and a version key which lets ``wait()`` detect events
+    published before it subscribed.
+
+    The server is configured with ``NOTIFY_REDIS_URL``.
+    """
+
+    prefix = 'notify:events:'
+
+    def __init__(self):
+        try:
+            import redis
+        except ImportError:
+            raise ImproperlyConfigured(
+                "RedisBackend requires the 'redis' package.")
+        url = getattr(settings, 'NOTIFY_REDIS_URL',
+                      'redis://localhost:6379/0')
+        self.client = redis.StrictRedis.from_url(url)
+
+    def publish(self, user_ids):
+        pipe = self.client.pipeline(transaction=False)
+        for user_id in user_ids:
+            pipe.incr('{}{}:version'.format(self.prefix, user_id))
+            pipe.publish('{}{}'.format(self.prefix, user_id), 1)
+        pipe.execute()
+
+    def cursor(self, user_id):
+        return self.client.mget(['{}{}:version'.format(self.prefix, channel)
+                                 for channel in channels(user_id)])
+
+    def wait(self, user_id, cursor, last_id, timeout):
+        deadline = time.time() + timeout
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        try:
+            pubsub.subscribe(*['{}{}'.format(self.prefix, channel)
+                               for channel in channels(user_id)])
+            if self.cursor(user_id) != cursor:
+                return True
+            while True:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                if pubsub.get_message(timeout=remaining):
+                    return True
+        finally:
+            pubsub.close()
+
+
+_backend = None
+_backend_path = None
+
+
+def get_backend():
+    """
+    Returns the configured backend instance, one per process.
+    """
+    global _backend, _backend_path
+
+    path = getattr(settings, 'NOTIFY_EVENT_BACKEND',
+                   'notify.events.DatabaseBackend')
+    if _backend is None or path != _backend_path:
+        _backend = import_string(path)()
+        _backend_path = path
+    return _backend
+
+
+def publish(user_ids):
+    """
+    Publishes new notifications of the supplied users to the backend once
+    the current transaction is committed.
+
+    :param user_ids: Iterable of user IDs, or ``BROADCAST``.
+    """
+    user_ids = set(user_ids)
+    if not user_ids:
+        return
+    if hasattr(transaction, 'on_commit'):
+        transaction.on_commit(lambda: get_backend().publish(user_ids))
+    else:
+        # django < 1.9, waiting clients may wake up before the commit and
+        # find nothing new.
+        get_backend().publish(user_ids)
@@ -0,0 +1,192 @@
+"""
+Timings and query counts of ``django-notify-x`` operations.
+
+The operations below report their wall time and number of queries to the
+backend configured with ``NOTIFY_METRICS_BACKEND``:
+
+    - ``notifier``: Sending a notification (``notify.send``).
+    - ``prefetch_relations``, ``render_notification`` and
+      ``render_notifications_batch`` from ``notify.utils``.
+    - ``view.<name>``: Every view of ``notify.views``.
+    - ``tag.render_notifications`` and ``tag.user_notifications``.
+
+Available backends:
+
+    - ``notify.instrumentation.LoggingBackend`` logs every measure to the
+      ``notify.metrics`` logger at the ``DEBUG`` level.
+    - ``notify.instrumentation.PrometheusBackend`` aggregates measures in
+      the process and renders them in the Prometheus text exposition
+      format, served by ``notify.instrumentation.metrics_view``.
+
+When ``NOTIFY_METRICS_BACKEND`` is ``None`` (the default) nothing is
+measured, instrumented functions only look the setting up.
+"""
+import logging
+import threading
+from contextlib import contextmanager
+from functools import wraps
+from timeit import default_timer
+
+from django.conf import settings
+from django.db import connection
+from django.http import Http404, HttpResponse
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger('notify.metrics')
+
+
+class BaseMetricsBackend(object):
+
+    """
+    Interface of metrics backends.
+    """
+
+    def record(self, name, duration, queries):
+        """
+        Records a measure of an operation.
+
+        :param name: Name of the operation, e.g. ``notifier``.
+        :param duration: Wall time in seconds.
+        :param queries: Number of queries executed, ``None`` when they
+                        cannot be counted (django < 2.0).
+        """
+        raise NotImplementedError
+
+
+class LoggingBackend(BaseMetricsBackend):
+
+    """
+    Logs every measure to the ``notify.metrics`` logger.
+    """
+
+    def record(self, name, duration, queries):
+        logger.debug("%s took %.2fms, %s queries", name, duration * 1000,
+                     queries)
+
+
+class PrometheusBackend(BaseMetricsBackend):
+
+    """
+    Aggregates the measures of the process, ``render()`` returns them in
+    the Prometheus text exposition format as two summaries,
+    ``notify_operation_seconds`` and ``notify_operation_queries``,
+    labelled by ``operation``.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # { name: [count, seconds, queries], ... }
+        self._metrics = {}
+
+    def record(self, name, duration, queries):
+        with self._lock:
+            metric = self._metrics.setdefault(name, [0, 0.0, 0])
+            metric[0] += 1
+            metric[1] += duration
+            metric[2] += queries or 0
+
+    def render(self):
+        with self._lock:
+            metrics = sorted((name, list(values))
+                             for name, values in self._metrics.items())
+
+        lines = []
+        for metric, help_text, index in (
+                ('notify_operation_seconds',
+                 'Wall time of notify operations.', 1),
+                ('notify_operation_queries',
+                 'Database queries of notify operations.', 2)):
+            lines.append('# HELP {} {}'.format(metric, help_text))
+            lines.append('# TYPE {} summary'.format(metric))
+            for name, values in metrics:
+                labels = '{{operation="{}"}}'.format(name)
+                lines.append('{}_count{} {}'.format(metric, labels, values[0]))
+                lines.append('{}_sum{} {}'.format(metric, labels,
+                                                  values[index]))
+        return '\n'.join(lines) + '\n'
+
+
+_backend = None
+_backend_path = None
+
+
+def get_backend():
+    """
+    Returns the configured backend instance, one per process, or ``None``
+    when metrics are disabled.
+    """
+    global _backend, _backend_path
+
+    path = getattr(settings, 'NOTIFY_METRICS_BACKEND', None)
+    if path is None:
+        return None
+    if _backend is None or path != _backend_path:
+        _backend = import_string(path)()
+        _backend_path = path
+    return _backend
+
+
+@contextmanager
+def measure(name):
+    """
+    Measures the wall time and queries of the enclosed block.
+
+    :param name: Name of the operation.
+    """
+    backend = get_backend()
+    if backend is None:
+        yield
+        return
+
+    queries = [0]
+
+    def count_query(execute, sql, params, many, context):
+        queries[0] += 1
+        return execute(sql, params, many, context)
+
+    start = default_timer()
+    try:
+        if hasattr(connection, 'execute_wrapper'):
+            with connection.execute_wrapper(count_query):
+                yield
+        else:
+            queries[0] = None
+            yield
+    finally:
+        backend.record(name, default_timer() - start, queries[0])
+
+
+def instrumented(name):
+    """
+    Decorator measuring every call of a function, see ``measure()``.
+
+    :param name: Name of the operation.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if getattr(settings, 'NOTIFY_METRICS_BACKEND', None) is None:
+                return func(*args, **kwargs)
+            with measure(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def metrics_view(request):
+    """
+    Serves the metrics of ``PrometheusBackend`` in the text exposition
+    format. It is not part of ``notify.urls``, include it in your URLs
+    behind the access restrictions of your choice::
+
+        url(r'^notify-metrics/$', metrics_view)
+
+    :param request: HTTP request context.
+
+    :return: Metrics, or 404 when the backend cannot render them.
+    """
+    backend = get_backend()
+    if not hasattr(backend, 'render'):
+        raise Http404
+    return HttpResponse(backend.render(),
+                        content_type='text/plain; version=0.0.4')
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from notify import retention
+
+
+class Command(BaseCommand):
+
+    help = ("Moves old notifications to the ArchivedNotification table, "
+            "in small batches of IDs.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('days', type=int,
+                            help="Archive notifications older than this "
+                                 "number of days.")
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help="Number of IDs covered by each batch.")
+        parser.add_argument('--sleep', type=float, default=0,
+                            help="Seconds to pause for between batches.")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Only count the notifications to archive.")
+
+    def handle(self, *args, **options):
+        count = retention.archive(options['days'],
+                                  batch_size=options['batch_size'],
+                                  sleep=options['sleep'],
+                                  dry_run=options['dry_run'])
+        if options['dry_run']:
+            self.stdout.write(
+                "{} notifications would be archived.".format(count))
+        else:
+            self.stdout.write("Archived {} notifications.".format(count))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from notify import retention
+
+
+class Command(BaseCommand):
+
+    help = ("Deletes the notifications expired under NOTIFY_RETENTION and "
+            "NOTIFY_RETENTION_DELETED_GRACE, in small batches of IDs.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help="Number of IDs covered by each DELETE.")
+        parser.add_argument('--sleep', type=float, default=0,
+                            help="Seconds to pause for between batches.")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Only count the expired notifications.")
+        parser.add_argument('--archive', action='store_true',
+                            help="Move the expired notifications to the "
+                                 "archive instead of deleting them.")
+
+    def handle(self, *args, **options):
+        count = retention.purge(batch_size=options['batch_size'],
+                                sleep=options['sleep'],
+                                dry_run=options['dry_run'],
+                                archive=options['archive'])
+        if options['dry_run']:
+            self.stdout.write(
+                "{} notifications would be purged.".format(count))
+        else:
+            self.stdout.write("Purged {} notifications.".format(count))
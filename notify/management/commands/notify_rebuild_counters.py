@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from notify import counters
+from notify.models import Notification, NotificationCounter
+
+
+class Command(BaseCommand):
+
+    help = ("Recomputes the per-user unread notification counters "
+            "from the notification table.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('user_ids', nargs='*', type=int,
+                            help="Only rebuild the counters of these users.")
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help="Number of users rebuilt per query.")
+
+    def handle(self, *args, **options):
+        user_ids = options['user_ids']
+        if not user_ids:
+            # Broadcasts, without recipient, have no counter.
+            user_ids = set(Notification.objects.filter(
+                recipient__isnull=False).order_by().values_list(
+                'recipient', flat=True).distinct())
+            user_ids.update(NotificationCounter.objects.values_list(
+                'user_id', flat=True))
+        user_ids = sorted(user_ids)
+
+        batch_size = options['batch_size']
+        for start in range(0, len(user_ids), batch_size):
+            counters.rebuild(user_ids[start:start + batch_size])
+
+        self.stdout.write("Rebuilt unread counters of {} users.".format(
+            len(user_ids)))
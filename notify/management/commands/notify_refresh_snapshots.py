@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from notify.models import Notification
+from notify.retention import id_ranges
+from notify.utils import invalidate_fragments
+
+
+class Command(BaseCommand):
+
+    help = ("Fills the JSON snapshot of notifications sent before "
+            "NOTIFY_JSON_SNAPSHOT was enabled, or recomputes every "
+            "snapshot with --all.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help="Recompute existing snapshots too, e.g. "
+                                 "after actors or targets were renamed.")
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help="Number of IDs covered by each batch.")
+
+    def handle(self, *args, **options):
+        notifications = Notification.objects.all()
+        if not options['all']:
+            notifications = notifications.filter(snapshot__isnull=True)
+
+        count = 0
+        for start, end in id_ranges(notifications, options['batch_size']):
+            batch = notifications.filter(id__gte=start, id__lt=end)
+            refreshed = []
+            with transaction.atomic():
+                for nf in batch.prefetch():
+                    nf.snapshot = nf.build_snapshot()
+                    nf.save(update_fields=['snapshot'])
+                    refreshed.append(nf.id)
+            invalidate_fragments(refreshed)
+            count += len(refreshed)
+
+        self.stdout.write("Refreshed {} notification snapshots.".format(count))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from notify import queue
+
+
+class Command(BaseCommand):
+
+    help = ("Delivers notifications queued while NOTIFY_ASYNC_DISPATCH "
+            "is enabled.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10,
+                            help="Jobs claimed at a time by each thread.")
+        parser.add_argument('--concurrency', type=int, default=1,
+                            help="Number of worker threads.")
+        parser.add_argument('--lease', type=int, default=60,
+                            help="Seconds after which the jobs of a stuck "
+                                 "worker are retried.")
+        parser.add_argument('--sleep', type=float, default=1,
+                            help="Seconds to wait for when the queue is "
+                                 "empty.")
+        parser.add_argument('--once', action='store_true',
+                            help="Exit once the queue is empty.")
+
+    def handle(self, *args, **options):
+        processed = queue.run_worker(
+            batch_size=options['batch_size'],
+            concurrency=options['concurrency'],
+            lease=options['lease'],
+            idle_sleep=options['sleep'],
+            once=options['once'])
+        self.stdout.write("Processed {} notification jobs.".format(processed))
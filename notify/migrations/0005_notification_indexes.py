@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 2.2.28 on 2026-10-18 04:32
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+UNREAD_INDEX_NAME = 'notify_nf_unread_partial_idx'
+
+# ``index_together`` of ``Notification``, with the names of the indexes
+# created on PostgreSQL. Django finds composite indexes by their columns
+# when it alters them, the names do not have to be the generated ones.
+INDEX_TOGETHER = [
+    ('notify_nf_rcpt_del_created_idx', ('recipient', 'deleted', 'created')),
+    ('notify_nf_rcpt_del_read_created_idx',
+     ('recipient', 'deleted', 'read', 'created')),
+    ('notify_nf_rcpt_del_id_idx', ('recipient', 'deleted', 'id')),
+]
+
+
+def create_indexes(apps, schema_editor):
+    # The notification table may be large, PostgreSQL builds the indexes
+    # without locking writes. Other backends lock the table meanwhile.
+    Notification = apps.get_model('notify', 'Notification')
+    if schema_editor.connection.vendor != 'postgresql':
+        schema_editor.alter_index_together(
+            Notification, set(),
+            set(fields for name, fields in INDEX_TOGETHER))
+        return
+    qn = schema_editor.quote_name
+    for name, fields in INDEX_TOGETHER:
+        columns = [Notification._meta.get_field(field).column
+                   for field in fields]
+        schema_editor.execute(
+            'CREATE INDEX CONCURRENTLY {name} ON {table} ({columns})'.format(
+                name=qn(name), table=qn(Notification._meta.db_table),
+                columns=', '.join(qn(column) for column in columns)))
+
+
+def drop_indexes(apps, schema_editor):
+    Notification = apps.get_model('notify', 'Notification')
+    if schema_editor.connection.vendor != 'postgresql':
+        schema_editor.alter_index_together(
+            Notification, set(fields for name, fields in INDEX_TOGETHER),
+            set())
+        return
+    for name, fields in INDEX_TOGETHER:
+        schema_editor.execute('DROP INDEX CONCURRENTLY IF EXISTS {}'.format(
+            schema_editor.quote_name(name)))
+
+
+def create_unread_index(apps, schema_editor):
+    # Partial indexes are only created on PostgreSQL, SQLite drops indexes
+    # which are not known to django whenever it rebuilds the table.
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    qn = schema_editor.quote_name
+    schema_editor.execute(
+        'CREATE INDEX CONCURRENTLY {name} ON {table} ({recipient}, {created}) '
+        'WHERE {read} = false AND {deleted} = false'.format(
+            name=qn(UNREAD_INDEX_NAME), table=qn('notify_notification'),
+            recipient=qn('recipient_id'), created=qn('created'),
+            read=qn('read'), deleted=qn('deleted')))
+
+
+def drop_unread_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX CONCURRENTLY IF EXISTS {}'.format(
+        schema_editor.quote_name(UNREAD_INDEX_NAME)))
+
+
+class Migration(migrations.Migration):
+
+    # CREATE INDEX CONCURRENTLY cannot run in a transaction.
+    atomic = False
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('notify', '0004_auto_20180315_0954'),
+    ]
+
+    operations = [
+        # Composite indexes are created before the single column recipient
+        # index is dropped, some backends require an index on foreign keys.
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(create_indexes, drop_indexes),
+            ],
+            state_operations=[
+                migrations.AlterIndexTogether(
+                    name='notification',
+                    index_together=set(
+                        fields for name, fields in INDEX_TOGETHER),
+                ),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='notification',
+            name='recipient',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='notifications', to=settings.AUTH_USER_MODEL, verbose_name='Notification receiver'),
+        ),
+        migrations.RunPython(create_unread_index, drop_unread_index),
+    ]
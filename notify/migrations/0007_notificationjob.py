@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 2.2.28 on 2026-10-18 04:41
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notify', '0006_notificationcounter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('payload', jsonfield.fields.JSONField(default=dict, verbose_name='Recipients and notification data')),
+                ('progress', models.PositiveIntegerField(default=0, verbose_name='Number of recipients notified')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='Number of processing attempts')),
+                ('locked_until', models.DateTimeField(blank=True, null=True, verbose_name='Lease expiry of the worker')),
+                ('last_error', models.TextField(blank=True, default='', verbose_name='Last processing error')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ('id',),
+            },
+        ),
+    ]
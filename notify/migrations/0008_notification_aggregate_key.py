@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 2.2.28 on 2026-10-18 04:49
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('notify', '0007_notificationjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='aggregate_key',
+            field=models.CharField(blank=True, editable=False, max_length=40, null=True, verbose_name='Key of aggregated notifications'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='notification',
+            unique_together={('recipient', 'aggregate_key')},
+        ),
+    ]
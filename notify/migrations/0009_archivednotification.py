@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 2.2.28 on 2026-10-18 04:52
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('notify', '0008_notification_aggregate_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedNotification',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('actor_object_id', models.PositiveIntegerField(blank=True, null=True)),
+                ('actor_text', models.CharField(blank=True, max_length=50, null=True)),
+                ('actor_url_text', models.CharField(blank=True, max_length=200, null=True)),
+                ('verb', models.CharField(max_length=100)),
+                ('description', models.CharField(blank=True, max_length=255, null=True)),
+                ('nf_type', models.CharField(default='default', max_length=20)),
+                ('target_object_id', models.PositiveIntegerField(blank=True, null=True)),
+                ('target_text', models.CharField(blank=True, max_length=50, null=True)),
+                ('target_url_text', models.CharField(blank=True, max_length=200, null=True)),
+                ('obj_object_id', models.PositiveIntegerField(blank=True, null=True)),
+                ('obj_text', models.CharField(blank=True, max_length=50, null=True)),
+                ('obj_url_text', models.CharField(blank=True, max_length=200, null=True)),
+                ('extra', jsonfield.fields.JSONField(blank=True, null=True)),
+                ('created', models.DateTimeField()),
+                ('read', models.BooleanField(default=False)),
+                ('deleted', models.BooleanField(default=False)),
+                ('actor_content_type', models.ForeignKey(blank=True, db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='contenttypes.ContentType')),
+                ('obj_content_type', models.ForeignKey(blank=True, db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='contenttypes.ContentType')),
+                ('recipient', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='archived_notifications', to=settings.AUTH_USER_MODEL, verbose_name='Notification receiver')),
+                ('target_content_type', models.ForeignKey(blank=True, db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='contenttypes.ContentType')),
+            ],
+            options={
+                'ordering': ('-created',),
+                'index_together': {('recipient', 'created')},
+            },
+        ),
+    ]
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 2.2.28 on 2026-10-18 04:58
+from __future__ import unicode_literals
+
+from django.db import migrations
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notify', '0010_readwatermark'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='snapshot',
+            field=jsonfield.fields.JSONField(blank=True, editable=False, null=True, verbose_name='Snapshot of the JSON data'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 2.2.28 on 2026-10-18 05:15
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('notify', '0011_notification_snapshot'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='archivednotification',
+            name='recipient',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='archived_notifications', to=settings.AUTH_USER_MODEL, verbose_name='Notification receiver'),
+        ),
+        migrations.AlterField(
+            model_name='notification',
+            name='recipient',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='notifications', to=settings.AUTH_USER_MODEL, verbose_name='Notification receiver'),
+        ),
+        migrations.CreateModel(
+            name='BroadcastState',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('read', models.BooleanField(default=False, verbose_name='Read status')),
+                ('deleted', models.BooleanField(default=False, verbose_name='Soft delete status')),
+                ('notification', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='broadcast_states', to='notify.Notification', verbose_name='Broadcast')),
+                ('user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='notify_broadcast_states', to=settings.AUTH_USER_MODEL, verbose_name='Notification receiver')),
+            ],
+            options={
+                'unique_together': {('user', 'notification')},
+            },
+        ),
+    ]
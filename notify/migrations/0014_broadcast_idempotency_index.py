@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+BROADCAST_KEY_INDEX_NAME = 'notify_nf_broadcast_key_uniq'
+
+
+def create_broadcast_key_index(apps, schema_editor):
+    # The (recipient, idempotency_key) constraint does not cover broadcasts,
+    # their recipient is NULL. Like the unread index of migration 0005, the
+    # partial index is only created on PostgreSQL.
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    qn = schema_editor.quote_name
+    schema_editor.execute(
+        'CREATE UNIQUE INDEX {name} ON {table} ({key}) '
+        'WHERE {recipient} IS NULL AND {key} IS NOT NULL'.format(
+            name=qn(BROADCAST_KEY_INDEX_NAME),
+            table=qn('notify_notification'), key=qn('idempotency_key'),
+            recipient=qn('recipient_id')))
+
+
+def drop_broadcast_key_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS {}'.format(
+        schema_editor.quote_name(BROADCAST_KEY_INDEX_NAME)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notify', '0013_notification_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_broadcast_key_index,
+                             drop_broadcast_key_index),
+    ]
@@ -1,17 +1,29 @@
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
-from django.db.models import QuerySet
+from django.db.models import Q, QuerySet
+try:
+    from django.db.models.query import ModelIterable
+except ImportError:
+    # django < 1.9
+    from django.db.models.query import ValuesQuerySet
+    ModelIterable = None
 from jsonfield.fields import JSONField
 from six import python_2_unicode_compatible
 from django.utils.html import escape
+from django.utils.safestring import mark_safe
 from django.utils.timesince import timesince
 from django.utils.translation import ugettext_lazy as _
 from django.utils.encoding import force_text
 from django.utils.functional import cached_property
 
-from .utils import prefetch_relations
+from . import broadcasts, counters, watermarks
+from .utils import invalidate_fragments, prefetch_relations
+
+
+# Actions of ``NotificationQueryset.bulk_action``.
+BULK_ACTIONS = ('read', 'unread', 'delete', 'restore')
 
 
 class NotificationQueryset(QuerySet):
@@ -20,29 +32,91 @@ class NotificationQueryset(QuerySet):
     Chain-able QuerySets using ```.as_manager()``.
     """
 
-    def prefetch(self):
+    def prefetch(self, skip_snapshots=False):
         """
         Marks the current queryset to prefetch all generic relations.
+
+        :param skip_snapshots: Leave out the notifications having a
+                               ``snapshot``, for callers which only use
+                               ``as_json()`` and ``box`` templates.
         """
         qs = self.select_related()
-        qs._prefetch_relations = True
+        qs._prefetch_relations = 'skip_snapshots' if skip_snapshots else True
         return qs
 
     def _fetch_all(self):
         if self._result_cache is None:
             if hasattr(self, '_prefetch_relations'):
-                # removes the flag since prefetch_relations is recursive
+                # removes the flag since prefetch_relations evaluates
+                # the queryset itself.
+                mode = self._prefetch_relations
                 del self._prefetch_relations
-                prefetch_relations(self)
-                self._prefetch_relations = True
+                if mode == 'skip_snapshots':
+                    prefetch_relations([nf for nf in self if not nf.snapshot])
+                else:
+                    prefetch_relations(self)
+                self._prefetch_relations = mode
+        if self._result_cache is None and self._yields_instances():
+            super(NotificationQueryset, self)._fetch_all()
+            if watermarks.watermark_enabled():
+                watermarks.attach(self._result_cache)
+            if hasattr(self, '_broadcast_user'):
+                broadcasts.attach(self._result_cache, self._broadcast_user)
         return super(NotificationQueryset, self)._fetch_all()
 
+    def _yields_instances(self):
+        # ``values()`` and ``values_list()`` querysets do not.
+        if ModelIterable is None:
+            # django < 1.9
+            return not isinstance(self, ValuesQuerySet)
+        return self._iterable_class is ModelIterable
+
     def _clone(self, **kwargs):
         clone = super(NotificationQueryset, self)._clone(**kwargs)
         if hasattr(self, '_prefetch_relations'):
-            clone._prefetch_relations = True
+            clone._prefetch_relations = self._prefetch_relations
+        if hasattr(self, '_broadcast_user'):
+            clone._broadcast_user = self._broadcast_user
+        if hasattr(self, '_recipient'):
+            clone._recipient = self._recipient
+        if hasattr(self, '_deleted'):
+            clone._deleted = self._deleted
         return clone
 
+    def _with_deleted(self, deleted):
+        # Remembers the soft-deleted state selected by ``active()``,
+        # ``read()``, ``unread()`` or ``deleted()`` for ``with_archive()``.
+        self._deleted = deleted
+        return self
+
+    def for_user(self, user):
+        """
+        QuerySet filter() for retrieving the notifications of a user,
+        merged with the broadcasts shown to the user when
+        ``NOTIFY_BROADCASTS`` is enabled, see ``notify.broadcasts``.
+
+        ``read_all()``, ``unread_all()``, ``delete_all()`` and
+        ``active_all()`` with a user also change the states of the user's
+        broadcasts.
+
+        :param user: Notification recipient.
+
+        :return: Notifications of the user.
+        """
+        if not broadcasts.broadcast_enabled():
+            qs = self.filter(recipient=user)
+        else:
+            qs = self.filter(broadcasts.feed_q(user))
+            qs._broadcast_user = user
+        qs._recipient = user
+        return qs
+
+    def _exclude_broadcast_states(self, *args, **kwargs):
+        if not hasattr(self, '_broadcast_user'):
+            return self
+        return self.exclude(id__in=broadcasts.state_ids(
+            self._broadcast_user, *args, **kwargs))
+
     def active(self):
         """
         QuerySet filter() for retrieving both read and unread notifications
@@ -50,7 +124,8 @@ class NotificationQueryset(QuerySet):
 
         :return: Non soft-deleted notifications.
         """
-        return self.filter(deleted=False)
+        return self.filter(deleted=False)._exclude_broadcast_states(
+            deleted=True)._with_deleted(False)
 
     def read(self):
         """
@@ -58,7 +133,12 @@ class NotificationQueryset(QuerySet):
 
         :return: Read and active Notifications filter().
         """
-        return self.filter(deleted=False, read=True)
+        q = watermarks.read_q()
+        if hasattr(self, '_broadcast_user'):
+            q |= Q(id__in=broadcasts.state_ids(self._broadcast_user,
+                                               read=True))
+        return self.filter(q, deleted=False)._exclude_broadcast_states(
+            deleted=True)._with_deleted(False)
 
     def unread(self):
         """
@@ -66,33 +146,58 @@ class NotificationQueryset(QuerySet):
 
         :return: Unread and active Notifications filter().
         """
-        return self.filter(deleted=False, read=False)
+        qs = self.filter(watermarks.unread_q(), deleted=False)
+        return qs._exclude_broadcast_states(
+            Q(read=True) | Q(deleted=True))._with_deleted(False)
 
     def unread_all(self, user=None):
         """
         Marks all notifications as unread for a user (if supplied)
 
+        With ``NOTIFY_READ_WATERMARK``, unfiltered querysets clear the
+        read watermark of the supplied user, see ``notify.watermarks``.
+
         :param user: Notification recipient.
 
         :return: Updates QuerySet as unread.
         """
+        user = user or getattr(self, '_broadcast_user', None)
+        if user and broadcasts.broadcast_enabled():
+            broadcasts.set_all(user, 'read', False)
+        if user and watermarks.watermark_enabled() and not self.query.where:
+            # Clears the read watermark of the user.
+            return watermarks.mark_all_unread(user)
+
         qs = self.read()
         if user:
             qs = qs.filter(recipient=user)
-        qs.update(read=False)
+        with counters.track(qs, 1) as locked:
+            locked.update(read=False)
 
     def read_all(self, user=None):
         """
         Marks all notifications as read for a user (if supplied)
 
+        With ``NOTIFY_READ_WATERMARK``, unfiltered querysets only move the
+        read watermark of the supplied user, e.g.
+        ``Notification.objects.read_all(user)``.
+
         :param user: Notification recipient.
 
         :return: Updates QuerySet as read.
         """
+        user = user or getattr(self, '_broadcast_user', None)
+        if user and broadcasts.broadcast_enabled():
+            broadcasts.set_all(user, 'read', True)
+        if user and watermarks.watermark_enabled() and not self.query.where:
+            # Moves the read watermark instead of updating every row.
+            return watermarks.mark_all_read(user)
+
         qs = self.unread()
         if user:
             qs = qs.filter(recipient=user)
-        qs.update(read=True)
+        with counters.track(qs, -1) as locked:
+            locked.update(read=True)
 
     def delete_all(self, user=None):
         """
@@ -102,16 +207,20 @@ class NotificationQueryset(QuerySet):
 
         :return: Updates QuerySet as soft-deleted.
         """
+        user = user or getattr(self, '_broadcast_user', None)
+        if user and broadcasts.broadcast_enabled():
+            broadcasts.set_all(user, 'deleted', True)
         qs = self.active()
         if user:
             qs = qs.filter(recipient=user)
 
         soft_delete = getattr(settings, 'NOTIFY_SOFT_DELETE', True)
 
-        if soft_delete:
-            qs.update(deleted=True)
-        else:
-            qs.delete()
+        with counters.track(qs, -1, watermarks.unread_q()) as locked:
+            if soft_delete:
+                locked.update(deleted=True)
+            else:
+                locked.delete()
 
     def active_all(self, user=None):
         """
@@ -121,10 +230,14 @@ class NotificationQueryset(QuerySet):
 
         :return: Updates QuerySet as soft-deleted.
         """
+        user = user or getattr(self, '_broadcast_user', None)
+        if user and broadcasts.broadcast_enabled():
+            broadcasts.set_all(user, 'deleted', False)
         qs = self.deleted()
         if user:
             qs = qs.filter(recipient=user)
-        qs.update(deleted=False)
+        with counters.track(qs, 1, watermarks.unread_q()) as locked:
+            locked.update(deleted=False)
 
     def deleted(self):
         """
@@ -132,7 +245,128 @@ class NotificationQueryset(QuerySet):
 
         :return: Soft deleted notification filter()
         """
-        return self.filter(deleted=True)
+        q = Q(deleted=True)
+        if hasattr(self, '_broadcast_user'):
+            q |= Q(id__in=broadcasts.state_ids(self._broadcast_user,
+                                               deleted=True))
+        return self.filter(q)._with_deleted(True)
+
+    def bulk_action(self, user, ids, action):
+        """
+        Applies a mark or delete action to many notifications of a user
+        with a single ``UPDATE`` (or ``DELETE``), keeping the unread
+        counter in sync. The rows are locked while their state is read, so
+        concurrent actions cannot skew the counter. With
+        ``NOTIFY_BROADCASTS``, broadcasts among ``ids`` are changed one by
+        one, through the states of the user.
+
+        :param user: Recipient, notifications of other users are left
+                     untouched and reported as ``not_found``.
+        :param ids: Iterable of notification IDs.
+        :param action: One of ``BULK_ACTIONS``: ``read``, ``unread``,
+                       ``delete`` or ``restore``.
+
+        :return: Dictionary of ``{id: result}``, the result being
+                 ``updated``, ``unchanged`` or ``not_found``.
+        """
+        if action not in BULK_ACTIONS:
+            raise ValueError("Invalid bulk action: {!r}".format(action))
+
+        ids = set(int(notification_id) for notification_id in ids)
+        results = dict.fromkeys(ids, 'not_found')
+        user_id = getattr(user, 'pk', user)
+        soft_delete = getattr(settings, 'NOTIFY_SOFT_DELETE', True)
+
+        with transaction.atomic():
+            qs = self.filter(recipient=user_id, id__in=ids)
+            rows = list(qs.select_for_update().order_by().values_list(
+                'id', 'read', 'deleted'))
+            read_until = watermarks.get(user_id) \
+                if watermarks.watermark_enabled() else 0
+
+            changed = []
+            delta = 0
+            for notification_id, read, deleted in rows:
+                read = read or notification_id <= read_until
+                if action == 'read':
+                    change, unread_change = not read, -(not deleted)
+                elif action == 'unread':
+                    change, unread_change = read, not deleted
+                elif action == 'delete':
+                    change = not deleted or not soft_delete
+                    unread_change = -(not read and not deleted)
+                else:
+                    change, unread_change = deleted, not read
+                results[notification_id] = \
+                    'updated' if change else 'unchanged'
+                if change:
+                    changed.append(notification_id)
+                    delta += unread_change
+
+            if changed:
+                if action == 'unread' and min(changed) <= read_until:
+                    watermarks.lower(Notification(id=min(changed),
+                                                  recipient_id=user_id))
+                qs = self.filter(recipient=user_id, id__in=changed)
+                if action == 'delete' and not soft_delete:
+                    qs.delete()
+                else:
+                    qs.update(**{
+                        'read': {'read': True},
+                        'unread': {'read': False},
+                        'delete': {'deleted': True},
+                        'restore': {'deleted': False},
+                    }[action])
+                counters.adjust({user_id: delta})
+
+        invalidate_fragments(changed)
+
+        missing = [notification_id for notification_id, result
+                   in results.items() if result == 'not_found']
+        if missing and broadcasts.broadcast_enabled():
+            method = {'read': 'mark_as_read', 'unread': 'mark_as_unread',
+                      'delete': 'soft_delete', 'restore': 'restore'}[action]
+            for nf in self.for_user(user).filter(recipient__isnull=True,
+                                                 id__in=missing):
+                results[nf.id] = \
+                    'updated' if getattr(nf, method)() else 'unchanged'
+        return results
+
+    def with_archive(self, user=None):
+        """
+        Reads across the notifications of this queryset and the archived
+        notifications (see ``ArchivedNotification``), for deep history
+        views. Filters of this queryset only apply to the notification
+        table, archived notifications are only filtered by recipient and,
+        after ``active()``, ``read()``, ``unread()`` or ``deleted()``, by
+        their soft-deleted state. Requires django 1.11 or later.
+
+        :param user: Recipient of the archived notifications to include,
+                     defaults to the user of ``for_user()`` querysets and
+                     of ``user.notifications``.
+
+        :return: Values QuerySet of dictionaries with the
+                 ``ARCHIVED_FIELDS`` keys, newest first.
+        """
+        if not hasattr(self, 'union'):
+            # django < 1.11
+            raise NotImplementedError("with_archive() requires django 1.11 "
+                                      "or later.")
+        user = user or getattr(self, '_recipient', None) or \
+            self._hints.get('instance')
+        if user is None:
+            raise ValueError("with_archive() needs the recipient of the "
+                             "archived notifications.")
+
+        hot = self.values(*ARCHIVED_FIELDS).order_by()
+        if hasattr(hot, '_prefetch_relations'):
+            del hot._prefetch_relations
+
+        archived = ArchivedNotification.objects.values(
+            *ARCHIVED_FIELDS).order_by().filter(recipient=user)
+        if hasattr(self, '_deleted'):
+            archived = archived.filter(deleted=self._deleted)
+        return hot.union(archived, all=True).order_by('-created', '-id')
 
 
 @python_2_unicode_compatible
@@ -186,11 +420,24 @@ class Notification(models.Model):
 
     :deleted:   Useful when you want to *soft delete* your notifications.
 
+    :snapshot:  Precomputed ``as_json()`` data of the generic relations,
+                see ``build_snapshot()``.
+
+    :aggregate_key: Shared by the notifications collapsed into this one,
+                    see ``notify.aggregation``.
+
+    :idempotency_key: Key of the send which created the notification,
+                      sending it again to the recipient does nothing.
+
     """
 
+    # Not indexed on its own, every composite index in ``Meta`` starts
+    # with the recipient.
+    # ``None`` for broadcasts, see ``notify.broadcasts``.
     recipient = models.ForeignKey(settings.AUTH_USER_MODEL,
                                   related_name='notifications',
-                                  on_delete=models.CASCADE,
+                                  on_delete=models.CASCADE, db_index=False,
+                                  null=True, blank=True,
                                   verbose_name=_('Notification receiver'))
 
     # actor attributes.
@@ -271,6 +518,23 @@ class Notification(models.Model):
     extra = JSONField(null=True, blank=True,
                       verbose_name=_('JSONField to store addtional data'))
 
+    # ``as_json()`` data computed when the notification is sent, see
+    # ``NOTIFY_JSON_SNAPSHOT``.
+    snapshot = JSONField(null=True, blank=True, editable=False,
+                         verbose_name=_('Snapshot of the JSON data'))
+
+    # Set on notifications sent with ``aggregate=True``, see
+    # ``notify.aggregation``.
+    aggregate_key = models.CharField(
+        max_length=40, blank=True, null=True, editable=False,
+        verbose_name=_('Key of aggregated notifications'))
+
+    # Supplied by senders with ``idempotency_key``, a recipient gets at
+    # most one notification per key.
+    idempotency_key = models.CharField(
+        max_length=100, blank=True, null=True, editable=False,
+        verbose_name=_('Idempotency key'))
+
     # Advanced details.
     created = models.DateTimeField(auto_now=False, auto_now_add=True)
     read = models.BooleanField(default=False,
@@ -282,6 +546,16 @@ class Notification(models.Model):
 
     class Meta(object):
         ordering = ('-created', )
+        # Access paths of ``active()``, ``unread()``/``read()`` and the
+        # ``id__gt`` filter used by the update view, all scoped to a
+        # recipient. Migration 0005 adds a partial unread index on PostgreSQL.
+        index_together = (
+            ('recipient', 'deleted', 'created'),
+            ('recipient', 'deleted', 'read', 'created'),
+            ('recipient', 'deleted', 'id'),
+        )
+        unique_together = (('recipient', 'aggregate_key'),
+                           ('recipient', 'idempotency_key'))
 
     def __str__(self):
         ctx = {
@@ -303,19 +577,85 @@ class Notification(models.Model):
                     "{actor} {verb} {obj} on {target} {at} ago").format(**ctx)
         return _("{description} -- {at} ago").format(**ctx)
 
+    def _transition(self, field, value, counted, delta):
+        """
+        Sets a state column with a conditional ``UPDATE`` of that column
+        only, which does nothing when it already has the value.
+
+        :param field: ``read`` or ``deleted``.
+        :param value: New value of the column.
+        :param counted: Filters of the rows whose change moves the unread
+                        counter.
+        :param delta: Change of the unread counter for those rows.
+
+        :return: Whether the notification changed.
+        """
+        if self.recipient_id is None:
+            return broadcasts.set_state(self, field, value)
+        rows = Notification.objects.filter(pk=self.pk).exclude(
+            **{field: value})
+        changed = rows.filter(**counted).update(**{field: value})
+        if changed:
+            counters.adjust({self.recipient_id: delta})
+        else:
+            changed = rows.update(**{field: value})
+        setattr(self, field, value)
+        if changed:
+            invalidate_fragments([self.id])
+        return bool(changed)
+
+    def _unread_filters(self):
+        filters = {'read': False}
+        if watermarks.watermark_enabled() and self.recipient_id:
+            filters['id__gt'] = watermarks.get(self.recipient_id)
+        return filters
+
     def mark_as_read(self):
         """
-        Marks notification as read
+        Marks notification as read, only writing the ``read`` column.
+
+        :return: Whether the notification was unread.
         """
-        self.read = True
-        self.save()
+        if watermarks.watermark_enabled() and self.recipient_id and \
+                self.id <= watermarks.get(self.recipient_id):
+            self.read = True
+            return False
+        return self._transition('read', True, {'deleted': False}, -1)
 
     def mark_as_unread(self):
         """
-        Marks notification as unread.
+        Marks notification as unread, only writing the ``read`` column.
+
+        :return: Whether the notification was read.
+        """
+        if watermarks.watermark_enabled() and self.recipient_id and \
+                self.id <= watermarks.get(self.recipient_id):
+            # Read through the watermark, whatever its column says.
+            watermarks.lower(self)
+            Notification.objects.filter(pk=self.pk).update(read=False)
+            if not self.deleted:
+                counters.adjust({self.recipient_id: 1})
+            self.read = False
+            invalidate_fragments([self.id])
+            return True
+        return self._transition('read', False, {'deleted': False}, 1)
+
+    def soft_delete(self):
+        """
+        Soft-deletes notification, only writing the ``deleted`` column.
+
+        :return: Whether the notification was not deleted.
+        """
+        return self._transition('deleted', True, self._unread_filters(), -1)
+
+    def restore(self):
+        """
+        Restores a soft-deleted notification, only writing the ``deleted``
+        column.
+
+        :return: Whether the notification was deleted.
         """
-        self.read = False
-        self.save()
+        return self._transition('deleted', False, self._unread_filters(), 1)
 
     @cached_property
     def actor(self):
@@ -400,27 +740,227 @@ class Notification(models.Model):
         """
         return escape(force_text(obj)) if obj else None
 
-    def as_json(self):
+    def build_snapshot(self):
         """
-        Notification data in a Python dictionary to which later gets
-        supplied to JSONResponse so that it gets JSON serialized
-        the *django-way*
+        Computes the part of ``as_json()`` which does not change once the
+        notification is sent. It is stored in ``snapshot`` when
+        ``NOTIFY_JSON_SNAPSHOT`` is enabled, so that ``as_json()`` does not
+        have to fetch the generic relations.
 
-        :return: Dictionary format of the QuerySet object.
+        :return: Dictionary of HTML escaped values.
         """
-        data = {
-            "id": self.id,
+        return {
             "actor": self.do_escape(self.actor),
             "actor_url": self.do_escape(self.actor_url),
             "verb": self.do_escape(self.verb),
             "description": self.do_escape(self.description),
-            "read": self.read,
             "nf_type": self.do_escape(self.nf_type),
             "target": self.do_escape(self.target),
             "target_url": self.do_escape(self.target_url),
             "obj": self.do_escape(self.obj),
             "obj_url": self.do_escape(self.obj_url),
+        }
+
+    def as_json(self):
+        """
+        Notification data in a Python dictionary to which later gets
+        supplied to JSONResponse so that it gets JSON serialized
+        the *django-way*
+
+        Uses the ``snapshot`` of the notification when it has one.
+
+        :return: Dictionary format of the QuerySet object.
+        """
+        if self.snapshot:
+            # Values were escaped when the snapshot was built.
+            data = dict((key, mark_safe(value) if value else value)
+                        for key, value in self.snapshot.items())
+        else:
+            data = self.build_snapshot()
+        data.update({
+            "id": self.id,
+            "read": self.read,
             "created": self.created,
             "data": self.extra,
-        }
+            "broadcast": self.recipient_id is None,
+        })
         return data
+
+
+@python_2_unicode_compatible
+class NotificationCounter(models.Model):
+
+    """
+    Denormalized number of unread, non-deleted notifications of a user.
+
+    Only maintained when ``NOTIFY_UNREAD_COUNTER`` is enabled, see
+    ``notify.counters``. Rows are created lazily, the first time the
+    count of a user is requested.
+    """
+
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, primary_key=True,
+                                related_name='notification_counter',
+                                on_delete=models.CASCADE,
+                                verbose_name=_('Notification receiver'))
+    unread = models.IntegerField(default=0,
+                                 verbose_name=_('Unread notifications'))
+    modified = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return force_text(self.unread)
+
+
+@python_2_unicode_compatible
+class ReadWatermark(models.Model):
+
+    """
+    ID of the latest notification of a user marked as read by
+    ``read_all()`` when ``NOTIFY_READ_WATERMARK`` is enabled. Every
+    notification of the user up to it is read, see ``notify.watermarks``.
+    """
+
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, primary_key=True,
+                                related_name='notify_watermark',
+                                on_delete=models.CASCADE,
+                                verbose_name=_('Notification receiver'))
+    read_until = models.IntegerField(
+        default=0, verbose_name=_('Latest notification read'))
+
+    def __str__(self):
+        return force_text(self.read_until)
+
+
+@python_2_unicode_compatible
+class BroadcastState(models.Model):
+
+    """
+    Read and deleted state of a broadcast for a user, only stored once the
+    user marked or deleted the broadcast, see ``notify.broadcasts``.
+    """
+
+    # Not indexed on its own, the unique index starts with the user.
+    user = models.ForeignKey(settings.AUTH_USER_MODEL,
+                             related_name='notify_broadcast_states',
+                             on_delete=models.CASCADE, db_index=False,
+                             verbose_name=_('Notification receiver'))
+    notification = models.ForeignKey(Notification,
+                                     related_name='broadcast_states',
+                                     on_delete=models.CASCADE,
+                                     verbose_name=_('Broadcast'))
+    read = models.BooleanField(default=False,
+                               verbose_name=_('Read status'))
+    deleted = models.BooleanField(default=False,
+                                  verbose_name=_('Soft delete status'))
+
+    class Meta:
+        unique_together = (('user', 'notification'), )
+
+    def __str__(self):
+        return '{}: {}'.format(self.user_id, self.notification_id)
+
+
+@python_2_unicode_compatible
+class NotificationJob(models.Model):
+
+    """
+    Outbox entry of a ``notify`` send waiting for ``manage.py
+    notify_worker``, created when ``NOTIFY_ASYNC_DISPATCH`` is enabled.
+
+    **Attributes**:
+        :payload:       Recipient IDs and the column values of the
+                        notifications to create, see ``notify.queue``.
+        :progress:      Number of recipients already notified. It is
+                        saved in the same transaction as each batch,
+                        which makes delivery resumable and idempotent.
+        :locked_until:  Lease of the worker processing the job, expired
+                        leases are claimed by other workers.
+        :attempts:      Number of times the job was claimed.
+    """
+
+    payload = JSONField(verbose_name=_('Recipients and notification data'))
+    progress = models.PositiveIntegerField(
+        default=0, verbose_name=_('Number of recipients notified'))
+    attempts = models.PositiveIntegerField(
+        default=0, verbose_name=_('Number of processing attempts'))
+    locked_until = models.DateTimeField(
+        null=True, blank=True, verbose_name=_('Lease expiry of the worker'))
+    last_error = models.TextField(blank=True, default='',
+                                  verbose_name=_('Last processing error'))
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta(object):
+        ordering = ('id', )
+
+    def __str__(self):
+        return _("Notification job {id}").format(id=self.id)
+
+
+# Columns copied to ``ArchivedNotification``.
+ARCHIVED_FIELDS = (
+    'id', 'recipient_id',
+    'actor_content_type_id', 'actor_object_id', 'actor_text',
+    'actor_url_text', 'verb', 'description', 'nf_type',
+    'target_content_type_id', 'target_object_id', 'target_text',
+    'target_url_text', 'obj_content_type_id', 'obj_object_id', 'obj_text',
+    'obj_url_text', 'extra', 'created', 'read', 'deleted',
+)
+
+
+@python_2_unicode_compatible
+class ArchivedNotification(models.Model):
+
+    """
+    Cold storage of old notifications, filled by ``manage.py
+    notify_archive`` (or ``notify_purge --archive``) which moves rows out
+    of ``Notification`` so that its table and indexes stay small.
+
+    Archived notifications keep the ID and the columns of the
+    notification (``ARCHIVED_FIELDS``) but only have a single index, and
+    their content types are plain references without relations. They
+    are read with ``Notification.objects.with_archive()``.
+    """
+
+    id = models.IntegerField(primary_key=True)
+    recipient = models.ForeignKey(settings.AUTH_USER_MODEL,
+                                  related_name='archived_notifications',
+                                  on_delete=models.CASCADE, db_index=False,
+                                  null=True, blank=True,
+                                  verbose_name=_('Notification receiver'))
+
+    actor_content_type = models.ForeignKey(
+        ContentType, null=True, blank=True, related_name='+',
+        on_delete=models.DO_NOTHING, db_constraint=False, db_index=False)
+    actor_object_id = models.PositiveIntegerField(null=True, blank=True)
+    actor_text = models.CharField(max_length=50, blank=True, null=True)
+    actor_url_text = models.CharField(max_length=200, blank=True, null=True)
+
+    verb = models.CharField(max_length=100)
+    description = models.CharField(max_length=255, blank=True, null=True)
+    nf_type = models.CharField(max_length=20, default='default')
+
+    target_content_type = models.ForeignKey(
+        ContentType, null=True, blank=True, related_name='+',
+        on_delete=models.DO_NOTHING, db_constraint=False, db_index=False)
+    target_object_id = models.PositiveIntegerField(null=True, blank=True)
+    target_text = models.CharField(max_length=50, blank=True, null=True)
+    target_url_text = models.CharField(max_length=200, blank=True, null=True)
+
+    obj_content_type = models.ForeignKey(
+        ContentType, null=True, blank=True, related_name='+',
+        on_delete=models.DO_NOTHING, db_constraint=False, db_index=False)
+    obj_object_id = models.PositiveIntegerField(null=True, blank=True)
+    obj_text = models.CharField(max_length=50, blank=True, null=True)
+    obj_url_text = models.CharField(max_length=200, blank=True, null=True)
+
+    extra = JSONField(null=True, blank=True)
+
+    created = models.DateTimeField()
+    read = models.BooleanField(default=False)
+    deleted = models.BooleanField(default=False)
+
+    class Meta(object):
+        ordering = ('-created', )
+        index_together = (('recipient', 'created'), )
+
+    def __str__(self):
+        return _("Archived notification {id}").format(id=self.id)
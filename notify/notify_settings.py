@@ -45,3 +45,16 @@ DELETE_NF_CLASS_SELECTOR = getattr(settings, 'NOTIFY_DELETE_NF_CLASS_SELECTOR',
 
 # Time interval between ajax calls for notification update.
 UPDATE_TIME_INTERVAL = getattr(settings, 'NOTIFY_UPDATE_TIME_INTERVAL', 5000)
+
+# Bounds of the delay between ajax calls, notifyX.js backs off from the
+# minimum up to the maximum while every tab is hidden or idle.
+UPDATE_MIN_INTERVAL = getattr(settings, 'NOTIFY_UPDATE_MIN_INTERVAL',
+                              UPDATE_TIME_INTERVAL)
+UPDATE_MAX_INTERVAL = getattr(settings, 'NOTIFY_UPDATE_MAX_INTERVAL', 60000)
+
+# Whether the notifyX.js should use the long-polling update view.
+LONG_POLL = getattr(settings, 'NOTIFY_LONG_POLL', False)
+
+# Whether the notifyX.js should receive new notifications from the
+# Server-Sent Events stream, when the browser supports it.
+STREAM = getattr(settings, 'NOTIFY_STREAM', False)
@@ -0,0 +1,228 @@
+"""
+Database-backed dispatch queue.
+
+When ``NOTIFY_ASYNC_DISPATCH`` is enabled, the ``notify`` receiver only
+validates its arguments and stores a compact ``NotificationJob`` in the
+same transaction as the caller (the *outbox*). ``manage.py notify_worker``
+then creates the notifications, no external broker is involved.
+
+Delivery is at-least-once and idempotent:
+
+    - Workers claim a job with a conditional ``UPDATE`` setting a lease,
+      so a job is processed by a single worker at a time. Jobs of
+      crashed workers are claimed again once their lease expires.
+    - Every batch of notifications is inserted in the same transaction
+      that records the job's progress, so a retried job resumes after the
+      last committed batch instead of notifying anybody twice.
+    - The progress is only advanced from the value the worker read. A
+      worker whose lease expired and whose job was claimed again by
+      another one stops at its next batch (``LeaseLost``).
+"""
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import close_old_connections, connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# ``Notification`` generic relations, stored as raw column values.
+CONTENT_OBJECTS = ('actor', 'target', 'obj')
+
+
+def serialize_fields(fields):
+    """
+    Converts the ``Notification`` keyword arguments built by the receiver
+    to JSON serializable column values: generic relations become their
+    raw ``*_content_type_id`` and ``*_object_id`` columns.
+
+    :param fields: Keyword arguments of the ``Notification`` objects.
+
+    :return: Dictionary of column values.
+    """
+    data = dict(fields)
+    for name in CONTENT_OBJECTS:
+        obj = data.pop('{}_content_object'.format(name), None)
+        if obj is not None:
+            data['{}_content_type_id'.format(name)] = \
+                ContentType.objects.get_for_model(obj).pk
+            data['{}_object_id'.format(name)] = obj.pk
+    return data
+
+
+def enqueue(recipient_ids, fields):
+    """
+    Stores a job creating a notification for each recipient.
+
+    :param recipient_ids: List of user IDs.
+    :param fields: Keyword arguments of the ``Notification`` objects,
+                   other than the recipient.
+
+    :return: Created ``NotificationJob``.
+    """
+    from .models import NotificationJob
+
+    return NotificationJob.objects.create(payload={
+        'recipients': recipient_ids,
+        'fields': serialize_fields(fields),
+    })
+
+
+def claim(limit, lease):
+    """
+    Claims up to ``limit`` pending jobs for ``lease`` seconds.
+
+    :return: List of claimed job IDs.
+    """
+    from .models import NotificationJob
+
+    now = timezone.now()
+    max_attempts = getattr(settings, 'NOTIFY_QUEUE_MAX_ATTEMPTS', 5)
+    claimable = NotificationJob.objects.filter(
+        Q(locked_until__isnull=True) | Q(locked_until__lt=now),
+        attempts__lt=max_attempts)
+
+    claimed = []
+    for job_id in claimable.values_list('id', flat=True)[:limit]:
+        # Only one of the workers racing for a job updates the row.
+        if claimable.filter(id=job_id).update(
+                locked_until=now + timedelta(seconds=lease),
+                attempts=F('attempts') + 1):
+            claimed.append(job_id)
+    return claimed
+
+
+class LeaseLost(Exception):
+    """
+    Raised when another worker advanced a job, after the lease of the
+    current worker expired.
+    """
+
+
+def deliver_next(job, batch_size, lease):
+    """
+    Delivers the next batch of recipients of a claimed job and records the
+    progress, in one transaction.
+
+    The progress is advanced first with an ``UPDATE`` conditioned on the
+    progress read by this worker, which also locks the job row until the
+    batch is committed.
+
+    :param job: ``NotificationJob`` claimed by this worker.
+    :param batch_size: Number of recipients of the batch.
+    :param lease: Seconds the lease is extended by.
+
+    :raise LeaseLost: When the job was advanced by another worker, nothing
+                      is delivered then.
+    """
+    from .models import NotificationJob
+    from .signals import deliver_batch
+
+    batch = job.payload['recipients'][job.progress:job.progress + batch_size]
+    locked_until = timezone.now() + timedelta(seconds=lease)
+    with transaction.atomic():
+        if not NotificationJob.objects.filter(
+                id=job.id, progress=job.progress).update(
+                progress=job.progress + len(batch), locked_until=locked_until):
+            raise LeaseLost("Job {} was advanced by another worker.".format(
+                job.id))
+        deliver_batch(batch, job.payload['fields'])
+    job.progress += len(batch)
+    job.locked_until = locked_until
+
+
+def process(job_id, lease):
+    """
+    Delivers the remaining recipients of a claimed job, one transaction
+    per batch, then deletes the job.
+
+    :param job_id: ID of a job claimed by this worker.
+    :param lease: Seconds the lease is extended by after each batch.
+
+    :raise LeaseLost: When another worker took the job over.
+    """
+    from .models import NotificationJob
+
+    batch_size = getattr(settings, 'NOTIFY_BULK_BATCH_SIZE', 500)
+    job = NotificationJob.objects.get(id=job_id)
+    while job.progress < len(job.payload['recipients']):
+        deliver_next(job, batch_size, lease)
+    job.delete()
+
+
+def work(batch_size=10, lease=60):
+    """
+    Claims and processes one batch of jobs.
+
+    :return: Number of jobs processed.
+    """
+    from .models import NotificationJob
+
+    processed = 0
+    for job_id in claim(batch_size, lease):
+        try:
+            process(job_id, lease)
+            processed += 1
+        except LeaseLost:
+            logger.warning("Notification job %s was taken over by another "
+                           "worker.", job_id)
+        except Exception as e:
+            logger.exception("Notification job %s failed.", job_id)
+            # The job is retried once its lease expires.
+            NotificationJob.objects.filter(id=job_id).update(
+                last_error=repr(e))
+    return processed
+
+
+def run_worker(batch_size=10, concurrency=1, lease=60, idle_sleep=1,
+               once=False):
+    """
+    Processes jobs until interrupted, or until the queue is empty when
+    ``once`` is set.
+
+    :param batch_size: Jobs claimed at a time by each thread.
+    :param concurrency: Number of worker threads.
+    :param lease: Seconds after which jobs of a stuck worker are retried.
+    :param idle_sleep: Seconds to wait for when the queue is empty.
+    :param once: Exit when no job is left.
+
+    :return: Number of jobs processed.
+    """
+    processed = [0]
+    lock = threading.Lock()
+
+    def loop():
+        while True:
+            count = work(batch_size, lease)
+            with lock:
+                processed[0] += count
+            if not count:
+                if once:
+                    return
+                time.sleep(idle_sleep)
+                # Drops connections which went stale while idle.
+                close_old_connections()
+
+    def thread_loop():
+        try:
+            loop()
+        finally:
+            connections.close_all()
+
+    if concurrency <= 1:
+        loop()
+        return processed[0]
+
+    threads = [threading.Thread(target=thread_loop)
+               for i in range(concurrency)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return processed[0]
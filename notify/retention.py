@@ -0,0 +1,188 @@
+"""
+Retention policy of notifications, enforced by ``manage.py notify_purge``.
+
+The policy is configured with two settings:
+
+    - ``NOTIFY_RETENTION`` maps ``nf_type`` values to the policy of their
+      notifications, ``'*'`` applies to every other type. A policy is a
+      dictionary with ``max_age``, the number of days notifications are
+      kept for, and ``read_only`` (``True`` by default), which restricts
+      the purge to read notifications::
+
+        NOTIFY_RETENTION = {
+            '*': {'max_age': 365},
+            'post_liked': {'max_age': 30, 'read_only': False},
+        }
+
+    - ``NOTIFY_RETENTION_DELETED_GRACE`` is the number of days soft-deleted
+      notifications are kept for, whatever their type.
+
+Ages are counted from the creation of the notifications. Expired
+notifications are deleted in ranges of IDs, so that every ``DELETE`` is a
+short primary key range scan holding few locks. Instead of being deleted,
+notifications can be moved to ``ArchivedNotification``, see ``archive()``.
+"""
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Min, Q
+from django.utils import timezone
+
+from . import counters, watermarks
+
+
+def expired_filter(now=None):
+    """
+    Builds the filter matching the notifications expired under the
+    retention policy.
+
+    :param now: Reference time, defaults to the current time.
+
+    :return: Tuple of the ``Q`` object, or ``None`` when nothing can
+             expire, and the latest creation time of expired notifications.
+    """
+    now = now or timezone.now()
+    policies = dict(getattr(settings, 'NOTIFY_RETENTION', {}))
+    grace = getattr(settings, 'NOTIFY_RETENTION_DELETED_GRACE', None)
+
+    conditions = []
+    cutoffs = []
+
+    default = policies.pop('*', None)
+    for nf_type, policy in list(policies.items()) + [(None, default)]:
+        if not policy or policy.get('max_age') is None:
+            continue
+        cutoff = now - timedelta(days=policy['max_age'])
+        if nf_type is None:
+            condition = Q(created__lt=cutoff) & ~Q(nf_type__in=list(policies))
+        else:
+            condition = Q(nf_type=nf_type, created__lt=cutoff)
+        if policy.get('read_only', True):
+            condition &= watermarks.read_q()
+        conditions.append(condition)
+        cutoffs.append(cutoff)
+
+    if grace is not None:
+        cutoff = now - timedelta(days=grace)
+        conditions.append(Q(deleted=True, created__lt=cutoff))
+        cutoffs.append(cutoff)
+
+    if not conditions:
+        return None, None
+
+    expired = conditions[0]
+    for condition in conditions[1:]:
+        expired |= condition
+    return expired, max(cutoffs)
+
+
+def id_ranges(queryset, batch_size, latest=None):
+    """
+    Splits the IDs of a queryset into consecutive ranges.
+
+    :param queryset: Notifications to cover.
+    :param batch_size: Number of IDs per range.
+    :param latest: Only cover notifications created before this time.
+
+    :return: Iterator of ``(start, end)`` tuples, ``end`` excluded.
+    """
+    first = queryset.aggregate(first=Min('id'))['first']
+    if latest is not None:
+        # Walks the primary key backwards from the newest notification,
+        # IDs grow with the creation time.
+        last = queryset.filter(created__lt=latest).order_by(
+            '-id').values_list('id', flat=True).first()
+    else:
+        last = queryset.aggregate(last=Max('id'))['last']
+    if first is None or last is None:
+        return
+
+    for start in range(first, last + 1, batch_size):
+        yield start, min(start + batch_size, last + 1)
+
+
+def move_to_archive(queryset):
+    """
+    Copies the notifications of a queryset to ``ArchivedNotification``
+    and deletes them, in the current transaction.
+
+    :return: Number of archived notifications.
+    """
+    from .models import ARCHIVED_FIELDS, ArchivedNotification
+
+    rows = list(queryset.values(*ARCHIVED_FIELDS))
+    ArchivedNotification.objects.bulk_create(
+        [ArchivedNotification(**row) for row in rows])
+    queryset.filter(id__in=[row['id'] for row in rows]).delete()
+    return len(rows)
+
+
+def remove_batches(expired, latest, batch_size=1000, sleep=0,
+                   dry_run=False, archive=False):
+    """
+    Deletes or archives the notifications matching ``expired``, one
+    transaction per range of ``batch_size`` IDs.
+
+    :param expired: ``Q`` object matching the notifications to remove.
+    :param latest: Latest creation time of the removed notifications.
+    :param batch_size: Number of IDs covered by each ``DELETE``.
+    :param sleep: Seconds to pause for between batches.
+    :param dry_run: Only count the notifications.
+    :param archive: Move the notifications to ``ArchivedNotification``.
+
+    :return: Number of removed (or matching) notifications.
+    """
+    from .models import Notification
+
+    total = 0
+    for start, end in id_ranges(Notification.objects.all(), batch_size,
+                                latest):
+        batch = Notification.objects.filter(id__gte=start, id__lt=end) \
+                                    .filter(expired)
+        if dry_run:
+            total += batch.count()
+            continue
+
+        with transaction.atomic():
+            unread = Q(watermarks.unread_q(), deleted=False)
+            with counters.track(batch, -1, unread) as locked:
+                if archive:
+                    total += move_to_archive(locked)
+                else:
+                    total += locked.delete()[0]
+        if sleep:
+            time.sleep(sleep)
+    return total
+
+
+def purge(batch_size=1000, sleep=0, dry_run=False, archive=False, now=None):
+    """
+    Deletes, or archives, the notifications expired under the retention
+    policy, see ``remove_batches()``.
+
+    :param now: Reference time, defaults to the current time.
+
+    :return: Number of purged (or expired) notifications.
+    """
+    expired, latest = expired_filter(now)
+    if expired is None:
+        return 0
+    return remove_batches(expired, latest, batch_size, sleep, dry_run,
+                          archive)
+
+
+def archive(days, batch_size=1000, sleep=0, dry_run=False, now=None):
+    """
+    Moves the notifications created more than ``days`` days ago to
+    ``ArchivedNotification``, see ``remove_batches()``.
+
+    :param days: Age of the archived notifications.
+    :param now: Reference time, defaults to the current time.
+
+    :return: Number of archived (or matching) notifications.
+    """
+    cutoff = (now or timezone.now()) - timedelta(days=days)
+    return remove_batches(Q(created__lt=cutoff), cutoff, batch_size, sleep,
+                          dry_run, archive=True)
@@ -1,7 +1,17 @@
+from collections import Counter, OrderedDict, namedtuple
+from itertools import islice
+
+import django
 from django import dispatch
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models.query import QuerySet
 from django.dispatch import receiver
+from notify import aggregation, counters, events, queue
+from notify.instrumentation import instrumented
 from notify.models import Notification
 from django.utils.translation import ugettext as _
+from six import string_types
 
 
 notify = dispatch.Signal(providing_args=[
@@ -10,11 +20,102 @@ notify = dispatch.Signal(providing_args=[
     'verb', 'description', 'nf_type',
     'target', 'target_text', 'target_url',
     'obj', 'obj_text', 'obj_url',
-    'extra',
+    'extra', 'aggregate', 'broadcast', 'idempotency_key',
 ])
 
 
+# Returned by ``notifier`` for ``recipient_list`` sends.
+FanOutResult = namedtuple('FanOutResult', ['created', 'batches'])
+
+
+def iter_recipient_ids(recipient_list):
+    """
+    Lazily yields the user IDs of a ``recipient_list``, which can be any
+    iterable of users or user IDs. QuerySets only fetch the IDs, in chunks.
+
+    :param recipient_list: Users or IDs of users to notify.
+
+    :return: Iterator of user IDs.
+    """
+    if isinstance(recipient_list, QuerySet):
+        return recipient_list.values_list('pk', flat=True).iterator()
+    return (getattr(user, 'pk', user) for user in recipient_list)
+
+
+def iter_batches(iterable, size):
+    """
+    Splits an iterable into lists of at most ``size`` items.
+    """
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def unsent_recipient_ids(recipient_ids, idempotency_key):
+    """
+    Leaves out the recipients who already received a notification with
+    an idempotency key, and duplicated IDs.
+
+    :param recipient_ids: List of user IDs.
+    :param idempotency_key: Key of the send.
+
+    :return: List of user IDs.
+    """
+    sent = set(Notification.objects.filter(
+        recipient_id__in=recipient_ids,
+        idempotency_key=idempotency_key).values_list(
+        'recipient_id', flat=True))
+    return list(OrderedDict.fromkeys(
+        recipient_id for recipient_id in recipient_ids
+        if recipient_id not in sent))
+
+
+def deliver_batch(recipient_ids, fields):
+    """
+    Creates the notifications of one batch of recipients with a single
+    INSERT and updates the unread counters of the recipients.
+    Aggregated notifications are delegated to ``notify.aggregation``.
+
+    With an ``idempotency_key``, the recipients who already received it
+    are skipped, so retried sends and jobs create nothing. Rows inserted
+    concurrently with the same key are ignored by the INSERT (django 2.2
+    or later), their recipients' counters may then be over-counted until
+    ``notify_rebuild_counters`` runs.
+
+    :param recipient_ids: List of user IDs.
+    :param fields: Column values of the ``Notification`` objects, other
+                   than the recipient, see ``queue.serialize_fields``.
+
+    :return: Number of notifications created.
+    """
+    key = fields.get('idempotency_key')
+    if key:
+        recipient_ids = unsent_recipient_ids(recipient_ids, key)
+        if not recipient_ids:
+            return 0
+
+    if fields.get('aggregate_key'):
+        return aggregation.deliver(recipient_ids, fields)
+
+    notifications = [Notification(recipient_id=recipient_id, **fields)
+                     for recipient_id in recipient_ids]
+    if key and django.VERSION >= (2, 2):
+        Notification.objects.bulk_create(notifications,
+                                         ignore_conflicts=True)
+    else:
+        Notification.objects.bulk_create(notifications)
+
+    recipient_counts = Counter(recipient_ids)
+    counters.adjust(recipient_counts)
+    events.publish(recipient_counts)
+    return len(notifications)
+
+
 @receiver(notify, dispatch_uid='notify_user')
+@instrumented('notifier')
 def notifier(sender, **kwargs):
     recipient = kwargs.pop('recipient', None)
 
@@ -38,10 +139,26 @@ def notifier(sender, **kwargs):
 
     extra = kwargs.pop('extra', None)
 
-    if recipient and recipient_list:
+    aggregate = kwargs.pop('aggregate', False)
+    broadcast = kwargs.pop('broadcast', False)
+    idempotency_key = kwargs.pop('idempotency_key', None)
+
+    # ``recipient_list`` is not evaluated, it can be a QuerySet or iterator.
+    if broadcast and (recipient or recipient_list is not None):
+        raise TypeError(_("A broadcast is sent to every user, it takes no "
+                          "recipient."))
+    elif broadcast and aggregate:
+        raise TypeError(_("Broadcasts cannot be aggregated."))
+    elif aggregate and idempotency_key:
+        # An aggregate collapses many sends, one key per row cannot tell
+        # which of them it already received.
+        raise TypeError(_("Aggregated notifications cannot take an "
+                          "idempotency key."))
+    elif recipient and recipient_list is not None:
         raise TypeError(_("You must specify either a single recipient or a list"
                         " of recipients, not both."))
-    elif not recipient and not recipient_list:
+    elif not broadcast and not recipient and (
+            recipient_list is None or recipient_list == []):
         raise TypeError(_("You must specify the recipient of the notification."))
 
     if not actor and not actor_text:
@@ -54,39 +171,108 @@ def notifier(sender, **kwargs):
         if len(verb) > Notification._meta.get_field('verb').max_length:
             raise ValueError(_("Verb is too long."))
 
-    if recipient_list and not isinstance(recipient_list, list):
-        raise TypeError(_("Supplied recipient is not an instance of list."))
+    if idempotency_key and len(idempotency_key) > \
+            Notification._meta.get_field('idempotency_key').max_length:
+        raise ValueError(_("Idempotency key is too long."))
+
+    if recipient_list is not None and (
+            isinstance(recipient_list, string_types) or
+            not hasattr(recipient_list, '__iter__')):
+        raise TypeError(_("Supplied recipient list is not iterable."))
+
+    fields = dict(
+        verb=verb, description=description, nf_type=nf_type,
+        actor_content_object=actor, actor_text=actor_text,
+        actor_url_text=actor_url,
+
+        target_content_object=target, target_text=target_text,
+        target_url_text=target_url,
+
+        obj_content_object=obj, obj_text=obj_text, obj_url_text=obj_url,
+        extra=extra
+    )
+
+    if aggregate:
+        fields['aggregate_key'] = aggregation.make_key(
+            verb, nf_type, target=target, target_text=target_text)
+        fields['extra'] = dict(
+            extra or {}, aggregate_count=1,
+            recent_actors=[aggregation.actor_entry(actor, actor_text,
+                                                   actor_url)])
+
+    if idempotency_key:
+        fields['idempotency_key'] = idempotency_key
+
+    if getattr(settings, 'NOTIFY_JSON_SNAPSHOT', False):
+        # Shared by every recipient, computed once per send.
+        fields['snapshot'] = Notification(**fields).build_snapshot()
+
+    if broadcast:
+        # A single row shown to every user, see ``notify.broadcasts``.
+        if not idempotency_key:
+            notification = Notification(recipient=None, **fields)
+            notification.save()
+            events.publish([events.BROADCAST])
+            return notification
+
+        sent = Notification.objects.filter(recipient__isnull=True,
+                                           idempotency_key=idempotency_key)
+        if sent.exists():
+            return sent.first()
+        try:
+            # Concurrent retries are rejected by a partial unique index on
+            # PostgreSQL, see migration 0014.
+            with transaction.atomic():
+                notification = Notification(recipient=None, **fields)
+                notification.save()
+        except IntegrityError:
+            duplicate = sent.first()
+            if duplicate is None:
+                raise
+            return duplicate
+        events.publish([events.BROADCAST])
+        return notification
 
-    if recipient:
-        notification = Notification(
-            recipient=recipient,
-            verb=verb, description=description, nf_type=nf_type,
-            actor_content_object=actor, actor_text=actor_text,
-            actor_url_text=actor_url,
+    # Resolves the content types and primary keys of the generic relations
+    # once per send, the rows of a batch only get the raw column values.
+    column_fields = queue.serialize_fields(fields)
 
-            target_content_object=target, target_text=target_text,
-            target_url_text=target_url,
+    if getattr(settings, 'NOTIFY_ASYNC_DISPATCH', False):
+        if recipient:
+            recipient_ids = [getattr(recipient, 'pk', recipient)]
+        else:
+            recipient_ids = list(iter_recipient_ids(recipient_list))
+        return queue.enqueue(recipient_ids, column_fields)
 
-            obj_content_object=obj, obj_text=obj_text, obj_url_text=obj_url,
-            extra=extra
-        )
-        saved_notification = notification.save()
+    if recipient and aggregate:
+        deliver_batch([getattr(recipient, 'pk', recipient)], column_fields)
+        saved_notification = None
+    elif recipient:
+        notification = Notification(recipient=recipient, **fields)
+        if idempotency_key:
+            try:
+                with transaction.atomic():
+                    saved_notification = notification.save()
+            except IntegrityError:
+                # Retried send, rejected by the unique constraint. Other
+                # errors, e.g. an unknown recipient, are raised.
+                if not Notification.objects.filter(
+                        recipient=notification.recipient_id,
+                        idempotency_key=idempotency_key).exists():
+                    raise
+                return None
+        else:
+            saved_notification = notification.save()
+        counters.adjust({notification.recipient_id: 1})
+        events.publish([notification.recipient_id])
     else:
-        notifications = []
-        for recipient in recipient_list:
-            notifications.append(Notification(
-                recipient=recipient,
-                verb=verb, description=description, nf_type=nf_type,
-                actor_content_object=actor, actor_text=actor_text,
-                actor_url_text=actor_url,
-
-                target_content_object=target, target_text=target_text,
-                target_url_text=target_url,
-
-                obj_content_object=obj, obj_text=obj_text,
-                obj_url_text=obj_url,
-
-                extra=extra
-            ))
-        saved_notification = Notification.objects.bulk_create(notifications)
+        # Streams the recipients in batches, so that at most one batch of
+        # notifications is held in memory and sent per INSERT.
+        batch_size = getattr(settings, 'NOTIFY_BULK_BATCH_SIZE', 500)
+        created = batches = 0
+        for recipient_ids in iter_batches(iter_recipient_ids(recipient_list),
+                                          batch_size):
+            created += deliver_batch(recipient_ids, column_fields)
+            batches += 1
+        saved_notification = FanOutResult(created=created, batches=batches)
     return saved_notification
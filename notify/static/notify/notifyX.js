@@ -6,6 +6,8 @@
 
 // AJAX call URLs
 var updateNotificationUrl;
+var updateWaitNotificationUrl;
+var streamNotificationUrl;
 var markNotificationUrl;
 var markAllNotificationUrl;
 var deleteNotificationUrl;
@@ -33,6 +35,8 @@ var deleteSuccess;
 var updateSuccess;
 
 var notificationUpdateTimeInterval;
+var notificationUpdateMinInterval;
+var notificationUpdateMaxInterval;
 
 // Django's implementation for AJAX-CSRF protection.
 // https://docs.djangoproject.com/en/dev/ref/csrf/#ajax
@@ -157,26 +161,258 @@ $(document).ready(function () {
 });
 
 // Update a notification using AJAX.
-$(document).ready(function updateNotifications() {
-    var $notification_box = $(nfBoxListClassSelector);
-    var flag = $notification_box.children().first().attr('data-nf-id') || '1';
+// Uses the long-polling endpoint when the server advertises it, the server
+// then holds the request until a new notification arrives.
+// When the server advertises an event stream and the browser supports it,
+// notifications are received from the stream instead.
+//
+// Only one tab of the browser, the leader, polls the server: it holds a
+// lease in localStorage and shares the responses with the other tabs via
+// BroadcastChannel (or localStorage events). When the leader goes away,
+// another tab takes the lease over once it expires.
+// While every tab is hidden or idle, the delay between polls doubles from
+// notificationUpdateMinInterval up to notificationUpdateMaxInterval. Every
+// delay is jittered so that tabs and users do not poll in lockstep.
+var notifyLeaderKey = 'notifyX.leader';
+var notifyMessageKey = 'notifyX.message';
+var notifyLeaseTime = 15000;
+var notifyIdleTime = 60000;
 
-    if (!flag || $notification_box.length == 0) {
-        console.log('Notity improperly configured. No data-nf-id was found.')
-        console.log('  Make sure you have a container element with \''+ nfBoxListClassSelector + '\' as css class.');
+var notifyTabId = Math.random().toString(36).slice(2) + Date.now().toString(36);
+var notifyChannel = window.BroadcastChannel ? new BroadcastChannel('notifyX') : null;
+var notifyInterval;
+var notifyPolling = false;
+var notifyPollTimer = null;
+var notifyInFlight = false;
+var notifyLastLocalActivity = Date.now();
+var notifyLastRemoteActivity = 0;
+var notifyLastActivityMessage = 0;
+
+function notifyMinInterval() {
+    return parseInt(notificationUpdateMinInterval || notificationUpdateTimeInterval, 10);
+}
+
+function notifyMaxInterval() {
+    return Math.max(parseInt(notificationUpdateMaxInterval || notificationUpdateTimeInterval, 10),
+                    notifyMinInterval());
+}
+
+function notifyJitter(delay) {
+    // Between 75% and 125% of the delay.
+    return Math.round(delay * (0.75 + Math.random() * 0.5));
+}
+
+function notifyIsIdle() {
+    var now = Date.now();
+    var localIdle = document.hidden || now - notifyLastLocalActivity > notifyIdleTime;
+    return localIdle && now - notifyLastRemoteActivity > notifyIdleTime;
+}
+
+function notifyReadLease() {
+    try {
+        return JSON.parse(localStorage.getItem(notifyLeaderKey));
+    } catch (e) {
+        return null;
+    }
+}
+
+// Returns whether this tab holds the lease, taking it when it is free or
+// expired. Tabs without localStorage are always their own leader.
+function notifyClaimLease() {
+    try {
+        var lease = notifyReadLease();
+        if (lease && lease.id != notifyTabId && lease.expires > Date.now()) {
+            return false;
+        }
+        localStorage.setItem(notifyLeaderKey, JSON.stringify({
+            id: notifyTabId, expires: Date.now() + notifyLeaseTime
+        }));
+        return notifyReadLease().id == notifyTabId;
+    } catch (e) {
+        return true;
+    }
+}
+
+function notifyReleaseLease() {
+    try {
+        var lease = notifyReadLease();
+        if (lease && lease.id == notifyTabId) {
+            localStorage.removeItem(notifyLeaderKey);
+        }
+    } catch (e) {}
+}
+
+function notifyBroadcast(message) {
+    message.sender = notifyTabId;
+    if (notifyChannel) {
+        notifyChannel.postMessage(message);
+        return;
+    }
+    try {
+        // The storage event only fires in the other tabs.
+        message.nonce = Math.random();
+        localStorage.setItem(notifyMessageKey, JSON.stringify(message));
+    } catch (e) {}
+}
+
+function notifyTopId() {
+    return parseInt($(nfBoxListClassSelector).children().first().attr('data-nf-id') || '0', 10);
+}
+
+function notifyReceive(message) {
+    if (!message || message.sender == notifyTabId) {
         return;
     }
+    if (message.type == 'activity') {
+        notifyLastRemoteActivity = Date.now();
+        if (notifyPolling && notifyInterval > notifyMinInterval()) {
+            notifySchedule(0);
+        }
+    } else if (message.type == 'update') {
+        // Tabs opened later may already show some of the notifications.
+        var topId = notifyTopId();
+        var response = message.response;
+        response.notifications = $.grep(response.notifications || [], function (notification) {
+            return !(notification.id <= topId);
+        });
+        updateSuccess(response);
+    }
+}
+
+function notifyActivity() {
+    notifyLastLocalActivity = Date.now();
+    if (notifyPolling && notifyInterval > notifyMinInterval()) {
+        notifySchedule(0);
+    }
+    // Tells the leader, at most once per lease time.
+    if (Date.now() - notifyLastActivityMessage > notifyLeaseTime / 3) {
+        notifyLastActivityMessage = Date.now();
+        notifyBroadcast({type: 'activity'});
+    }
+}
 
+// Polls after the delay, or right away at the minimum interval when the
+// delay is 0. A request in flight schedules the next poll itself.
+function notifySchedule(delay) {
+    if (delay === 0) {
+        notifyInterval = notifyMinInterval();
+    }
+    if (notifyInFlight) {
+        return;
+    }
+    clearTimeout(notifyPollTimer);
+    notifyPollTimer = setTimeout(updateNotifications, delay);
+}
+
+// Takes the lease over when it expires, renews it while leading.
+function notifyElect() {
+    var leader = notifyClaimLease();
+    if (leader && !notifyPolling) {
+        notifyPolling = true;
+        notifySchedule(0);
+    } else if (!leader && notifyPolling) {
+        notifyPolling = false;
+        clearTimeout(notifyPollTimer);
+    }
+    setTimeout(notifyElect, notifyJitter(notifyLeaseTime / 3));
+}
+
+function updateNotifications() {
+    var $notification_box = $(nfBoxListClassSelector);
+    var flag = $notification_box.children().first().attr('data-nf-id') || '1';
+    var longPoll = !!updateWaitNotificationUrl;
+
+    notifyInFlight = true;
     $.ajax({
         type: 'GET',
-        url: updateNotificationUrl + '?flag=' + flag,
+        url: (longPoll ? updateWaitNotificationUrl : updateNotificationUrl) + '?flag=' + flag,
+        // Sends If-None-Match, the server replies 304 when nothing changed.
+        ifModified: true,
         //success: updateSuccess(response),
-        success: function (response) {
+        success: function (response, status) {
             //console.log('update received');
+            if (status == 'notmodified') {
+                return;
+            }
             updateSuccess(response);
+            notifyBroadcast({type: 'update', response: response});
+            if (response.notifications && response.notifications.length) {
+                notifyInterval = notifyMinInterval();
+            }
         },
-        complete: function () {
-            setTimeout(updateNotifications, notificationUpdateTimeInterval);
+        complete: function (xhr, status) {
+            notifyInFlight = false;
+            if (!notifyPolling) {
+                return;
+            }
+            var delay = notifyInterval;
+            if (notifyIsIdle()) {
+                notifyInterval = Math.min(notifyInterval * 2, notifyMaxInterval());
+            } else {
+                notifyInterval = notifyMinInterval();
+                // Poll again right away after a long-poll, unless it failed.
+                if (longPoll && (status == 'success' || status == 'notmodified')) {
+                    delay = 0;
+                }
+            }
+            notifyPollTimer = setTimeout(updateNotifications, delay && notifyJitter(delay));
+        }
+    });
+}
+
+function notifyStartPolling() {
+    notifyInterval = notifyMinInterval();
+    if (notifyChannel) {
+        notifyChannel.onmessage = function (event) {
+            notifyReceive(event.data);
+        };
+    } else {
+        $(window).on('storage', function (event) {
+            if (event.originalEvent.key == notifyMessageKey && event.originalEvent.newValue) {
+                notifyReceive(JSON.parse(event.originalEvent.newValue));
+            }
+        });
+    }
+    $(document).on('mousemove keydown scroll touchstart', notifyActivity);
+    $(document).on('visibilitychange', function () {
+        if (!document.hidden) {
+            notifyActivity();
         }
     });
+    $(window).on('pagehide', notifyReleaseLease);
+
+    // Spreads the first polls of tabs opened at the same time.
+    setTimeout(notifyElect, Math.round(Math.random() * 500));
+}
+
+$(document).ready(function () {
+    var $notification_box = $(nfBoxListClassSelector);
+    var flag = $notification_box.children().first().attr('data-nf-id') || '1';
+
+    if (!flag || $notification_box.length == 0) {
+        console.log('Notity improperly configured. No data-nf-id was found.')
+        console.log('  Make sure you have a container element with \''+ nfBoxListClassSelector + '\' as css class.');
+        return;
+    }
+
+    if (streamNotificationUrl && window.EventSource) {
+        // The browser reconnects by itself, resuming with Last-Event-ID.
+        var stream = new EventSource(streamNotificationUrl + '?flag=' + flag);
+        stream.addEventListener('notification', function (event) {
+            updateSuccess({notifications: [JSON.parse(event.data)]});
+        });
+        stream.addEventListener('unread_count', function (event) {
+            updateSuccess({notifications: [], unread_count: JSON.parse(event.data).unread_count});
+        });
+        stream.onerror = function () {
+            // The browser gives up when the server refuses the stream,
+            // e.g. with a 404 response, falls back to polling.
+            if (stream.readyState == EventSource.CLOSED) {
+                notifyStartPolling();
+            }
+        };
+        return;
+    }
+
+    notifyStartPolling();
 });
@@ -1 +1,34 @@
-function getCookie(t){var e=null;if(document.cookie&&""!=document.cookie)for(var o=document.cookie.split(";"),i=0;i<o.length;i++){var c=jQuery.trim(o[i]);if(c.substring(0,t.length+1)==t+"="){e=decodeURIComponent(c.substring(t.length+1));break}}return e}function csrfSafeMethod(t){return/^(GET|HEAD|OPTIONS|TRACE)$/.test(t)}function sameOrigin(t){var e=document.location.host,o=document.location.protocol,i="//"+e,c=o+i;return t==c||t.slice(0,c.length+1)==c+"/"||t==i||t.slice(0,i.length+1)==i+"/"||!/^(\/\/|http:|https:).*/.test(t)}var updateNotificationUrl,markNotificationUrl,markAllNotificationUrl,deleteNotificationUrl,nfListClassSelector,nfClassSelector,nfBoxListClassSelector,nfBoxClassSelector,nfListSelector=nfBoxListClassSelector+", "+nfListClassSelector,nfSelector=nfClassSelector+", "+nfBoxClassSelector,markNotificationSelector,markAllNotificationSelector,deleteNotificationSelector,readNotificationClass,unreadNotificationClass,markSuccess,markAllSuccess,deleteSuccess,updateSuccess,notificationUpdateTimeInterval,csrftoken=getCookie("csrftoken");$.ajaxSetup({beforeSend:function(t,e){!csrfSafeMethod(e.type)&&sameOrigin(e.url)&&t.setRequestHeader("X-CSRFToken",csrftoken)}}),$(document).ready(function(){$(nfListSelector).delegate(markNotificationSelector,"click",function(){var t=$(this),e=t.attr("data-mark-action"),o={id:t.attr("data-id"),action:e,csrftoken:csrftoken};$.ajax({type:"POST",url:markNotificationUrl,data:o,success:function(e){markSuccess(e,t)}})})}),$(document).ready(function(){$(markAllNotificationSelector).on("click",function(){var t={action:$(this).attr("data-mark-action"),csrftoken:csrftoken};$.ajax({type:"POST",url:markAllNotificationUrl,data:t,success:function(t){markAllSuccess(t)}})})}),$(document).ready(function(){$(nfListSelector).delegate(deleteNotificationSelector,"click",function(){var t=$(this),e={id:t.attr("data-id"),csrftoken:csrftoken};$.ajax({type:"POST",url:deleteNotificationUrl,data:e,success:function(e){deleteSuccess(e,t)}})})}),$(document).ready(function t(){var e=$(nfBoxListClassSelector),o=e.children().first().attr("data-nf-id")||"1";return o&&0!=e.length?void $.ajax({type:"GET",url:updateNotificationUrl+"?flag="+o,success:function(t){updateSuccess(t)},complete:function(){setTimeout(t,notificationUpdateTimeInterval)}}):(console.log("Notity improperly configured. No data-nf-id was found."),void console.log("  Make sure you have a container element with '"+nfBoxListClassSelector+"' as css class."))});
+var updateNotificationUrl;var updateWaitNotificationUrl;var streamNotificationUrl;var markNotificationUrl;var markAllNotificationUrl;var deleteNotificationUrl;var nfListClassSelector;var nfClassSelector;var nfBoxListClassSelector;var nfBoxClassSelector;var nfListSelector=nfBoxListClassSelector+", "+nfListClassSelector;var nfSelector=nfClassSelector+", "+nfBoxClassSelector;var markNotificationSelector;var markAllNotificationSelector;var deleteNotificationSelector;var readNotificationClass;var unreadNotificationClass;var markSuccess;var markAllSuccess;var deleteSuccess;var updateSuccess;var notificationUpdateTimeInterval;var notificationUpdateMinInterval;var notificationUpdateMaxInterval;function getCookie(name){var cookieValue=null;if(document.cookie&&document.cookie!=''){var cookies=document.cookie.split(';');for(var i=0;i<cookies.length;i++){var cookie=jQuery.trim(cookies[i]);if(cookie.substring(0,name.length+1)==(name+'=')){cookieValue=decodeURIComponent(cookie.substring(name.length+1));break;}}}
+return cookieValue;}
+var csrftoken=getCookie('csrftoken');function csrfSafeMethod(method){return(/^(GET|HEAD|OPTIONS|TRACE)$/.test(method));}
+function sameOrigin(url){var host=document.location.host;var protocol=document.location.protocol;var sr_origin='//'+host;var origin=protocol+sr_origin;return(url==origin||url.slice(0,origin.length+1)==origin+'/')||(url==sr_origin||url.slice(0,sr_origin.length+1)==sr_origin+'/')||!(/^(\/\/|http:|https:).*/.test(url));}
+$.ajaxSetup({beforeSend:function(xhr,settings){if(!csrfSafeMethod(settings.type)&&sameOrigin(settings.url)){xhr.setRequestHeader("X-CSRFToken",csrftoken);}}});$(document).ready(function(){$(nfListSelector).delegate(markNotificationSelector,'click',function(){var $notification=$(this);var mark_action=$notification.attr('data-mark-action');var mark_post_data={id:$notification.attr('data-id'),action:mark_action,csrftoken:csrftoken};$.ajax({type:'POST',url:markNotificationUrl,data:mark_post_data,success:function(response){markSuccess(response,$notification);}});});});$(document).ready(function(){$(markAllNotificationSelector).on('click',function(){var mark_all_post_data={action:$(this).attr('data-mark-action'),csrftoken:csrftoken};$.ajax({type:'POST',url:markAllNotificationUrl,data:mark_all_post_data,success:function(response){markAllSuccess(response);}});});});$(document).ready(function(){$(nfListSelector).delegate(deleteNotificationSelector,'click',function(){var $notification=$(this);var delete_notification_data={id:$notification.attr('data-id'),csrftoken:csrftoken};$.ajax({type:'POST',url:deleteNotificationUrl,data:delete_notification_data,success:function(response){deleteSuccess(response,$notification);}});});});var notifyLeaderKey='notifyX.leader';var notifyMessageKey='notifyX.message';var notifyLeaseTime=15000;var notifyIdleTime=60000;var notifyTabId=Math.random().toString(36).slice(2)+Date.now().toString(36);var notifyChannel=window.BroadcastChannel?new BroadcastChannel('notifyX'):null;var notifyInterval;var notifyPolling=false;var notifyPollTimer=null;var notifyInFlight=false;var notifyLastLocalActivity=Date.now();var notifyLastRemoteActivity=0;var notifyLastActivityMessage=0;function notifyMinInterval(){return parseInt(notificationUpdateMinInterval||notificationUpdateTimeInterval,10);}
+function notifyMaxInterval(){return Math.max(parseInt(notificationUpdateMaxInterval||notificationUpdateTimeInterval,10),notifyMinInterval());}
+function notifyJitter(delay){return Math.round(delay*(0.75+Math.random()*0.5));}
+function notifyIsIdle(){var now=Date.now();var localIdle=document.hidden||now-notifyLastLocalActivity>notifyIdleTime;return localIdle&&now-notifyLastRemoteActivity>notifyIdleTime;}
+function notifyReadLease(){try{return JSON.parse(localStorage.getItem(notifyLeaderKey));}catch(e){return null;}}
+function notifyClaimLease(){try{var lease=notifyReadLease();if(lease&&lease.id!=notifyTabId&&lease.expires>Date.now()){return false;}
+localStorage.setItem(notifyLeaderKey,JSON.stringify({id:notifyTabId,expires:Date.now()+notifyLeaseTime}));return notifyReadLease().id==notifyTabId;}catch(e){return true;}}
+function notifyReleaseLease(){try{var lease=notifyReadLease();if(lease&&lease.id==notifyTabId){localStorage.removeItem(notifyLeaderKey);}}catch(e){}}
+function notifyBroadcast(message){message.sender=notifyTabId;if(notifyChannel){notifyChannel.postMessage(message);return;}
+try{message.nonce=Math.random();localStorage.setItem(notifyMessageKey,JSON.stringify(message));}catch(e){}}
+function notifyTopId(){return parseInt($(nfBoxListClassSelector).children().first().attr('data-nf-id')||'0',10);}
+function notifyReceive(message){if(!message||message.sender==notifyTabId){return;}
+if(message.type=='activity'){notifyLastRemoteActivity=Date.now();if(notifyPolling&&notifyInterval>notifyMinInterval()){notifySchedule(0);}}else if(message.type=='update'){var topId=notifyTopId();var response=message.response;response.notifications=$.grep(response.notifications||[],function(notification){return!(notification.id<=topId);});updateSuccess(response);}}
+function notifyActivity(){notifyLastLocalActivity=Date.now();if(notifyPolling&&notifyInterval>notifyMinInterval()){notifySchedule(0);}
+if(Date.now()-notifyLastActivityMessage>notifyLeaseTime/3){notifyLastActivityMessage=Date.now();notifyBroadcast({type:'activity'});}}
+function notifySchedule(delay){if(delay===0){notifyInterval=notifyMinInterval();}
+if(notifyInFlight){return;}
+clearTimeout(notifyPollTimer);notifyPollTimer=setTimeout(updateNotifications,delay);}
+function notifyElect(){var leader=notifyClaimLease();if(leader&&!notifyPolling){notifyPolling=true;notifySchedule(0);}else if(!leader&&notifyPolling){notifyPolling=false;clearTimeout(notifyPollTimer);}
+setTimeout(notifyElect,notifyJitter(notifyLeaseTime/3));}
+function updateNotifications(){var $notification_box=$(nfBoxListClassSelector);var flag=$notification_box.children().first().attr('data-nf-id')||'1';var longPoll=!!updateWaitNotificationUrl;notifyInFlight=true;$.ajax({type:'GET',url:(longPoll?updateWaitNotificationUrl:updateNotificationUrl)+'?flag='+flag,ifModified:true,success:function(response,status){if(status=='notmodified'){return;}
+updateSuccess(response);notifyBroadcast({type:'update',response:response});if(response.notifications&&response.notifications.length){notifyInterval=notifyMinInterval();}},complete:function(xhr,status){notifyInFlight=false;if(!notifyPolling){return;}
+var delay=notifyInterval;if(notifyIsIdle()){notifyInterval=Math.min(notifyInterval*2,notifyMaxInterval());}else{notifyInterval=notifyMinInterval();if(longPoll&&(status=='success'||status=='notmodified')){delay=0;}}
+notifyPollTimer=setTimeout(updateNotifications,delay&&notifyJitter(delay));}});}
+function notifyStartPolling(){notifyInterval=notifyMinInterval();if(notifyChannel){notifyChannel.onmessage=function(event){notifyReceive(event.data);};}else{$(window).on('storage',function(event){if(event.originalEvent.key==notifyMessageKey&&event.originalEvent.newValue){notifyReceive(JSON.parse(event.originalEvent.newValue));}});}
+$(document).on('mousemove keydown scroll touchstart',notifyActivity);$(document).on('visibilitychange',function(){if(!document.hidden){notifyActivity();}});$(window).on('pagehide',notifyReleaseLease);setTimeout(notifyElect,Math.round(Math.random()*500));}
+$(document).ready(function(){var $notification_box=$(nfBoxListClassSelector);var flag=$notification_box.children().first().attr('data-nf-id')||'1';if(!flag||$notification_box.length==0){console.log('Notity improperly configured. No data-nf-id was found.')
+console.log('  Make sure you have a container element with \''+nfBoxListClassSelector+'\' as css class.');return;}
+if(streamNotificationUrl&&window.EventSource){var stream=new EventSource(streamNotificationUrl+'?flag='+flag);stream.addEventListener('notification',function(event){updateSuccess({notifications:[JSON.parse(event.data)]});});stream.addEventListener('unread_count',function(event){updateSuccess({notifications:[],unread_count:JSON.parse(event.data).unread_count});});stream.onerror=function(){if(stream.readyState==EventSource.CLOSED){notifyStartPolling();}};return;}
+notifyStartPolling();});
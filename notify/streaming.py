@@ -0,0 +1,110 @@
+"""
+Server-Sent Events stream of new notifications.
+
+The stream sends a ``notification`` event, carrying the same data as an
+item of ``notification_update``, for every new notification and an
+``unread_count`` event whenever the number of unread notifications
+changes. Each ``notification`` event has the notification ID as its event
+ID, so that browsers resume from it with the ``Last-Event-ID`` header
+after reconnecting.
+
+Between checks the stream blocks on the backend configured in
+``NOTIFY_EVENT_BACKEND``, see ``notify.events``.
+"""
+import json
+import time
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from . import counters, events
+from .utils import render_notifications_batch
+
+def format_event(data, event=None, event_id=None):
+    """
+    Formats a single Server-Sent Event.
+
+    :param data: JSON serializable event data.
+    :param event: Event type.
+    :param event_id: Event ID, sent back by the browser as ``Last-Event-ID``.
+
+    :return: Event in the ``text/event-stream`` format.
+    """
+    lines = []
+    if event_id is not None:
+        lines.append('id: {}'.format(event_id))
+    if event:
+        lines.append('event: {}'.format(event))
+    lines.append('data: {}'.format(json.dumps(data, cls=DjangoJSONEncoder)))
+    return '\n'.join(lines) + '\n\n'
+
+
+def stream_settings():
+    """
+    :return: Lifetime and keep-alive interval (in seconds) and retry
+             delay (in milliseconds) of streams.
+    """
+    return (getattr(settings, 'NOTIFY_STREAM_LIFETIME', 300),
+            getattr(settings, 'NOTIFY_STREAM_KEEPALIVE', 15),
+            getattr(settings, 'NOTIFY_STREAM_RETRY', 3000))
+
+
+def fetch_events(user, last_id, target, unread_count):
+    """
+    Collects the events of a user since ``last_id``.
+
+    :param user: Notification recipient.
+    :param last_id: ID of the last notification sent to the client.
+    :param target: Render target of the notification HTML.
+    :param unread_count: Unread count last sent to the client.
+
+    :return: Tuple of events, new ``last_id`` and new ``unread_count``.
+    """
+    from .models import Notification
+
+    new_notifications = Notification.objects.for_user(user).filter(
+        id__gt=last_id).active().order_by('id').prefetch(
+            skip_snapshots=target == 'box')
+
+    chunks = []
+    for nf, notification, html in render_notifications_batch(
+            new_notifications, render_target=target, with_json=True):
+        notification['html'] = html
+        chunks.append(format_event(notification, event='notification',
+                                   event_id=nf.id))
+        last_id = nf.id
+
+    count = counters.unread_count(user)
+    if count != unread_count:
+        chunks.append(format_event({'unread_count': count},
+                                   event='unread_count'))
+    return chunks, last_id, count
+
+
+def event_stream(user, last_id, target='box'):
+    """
+    Generator of the events of a user, for WSGI servers.
+
+    Ends after ``NOTIFY_STREAM_LIFETIME`` seconds, the browser then
+    reconnects after ``NOTIFY_STREAM_RETRY`` milliseconds.
+    """
+    lifetime, keepalive, retry = stream_settings()
+    backend = events.get_backend()
+    deadline = time.time() + lifetime
+    unread_count = None
+
+    yield 'retry: {}\n\n'.format(retry)
+    while True:
+        cursor = backend.cursor(user.pk)
+        chunks, last_id, unread_count = fetch_events(
+            user, last_id, target, unread_count)
+        for chunk in chunks:
+            yield chunk
+
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return
+        if not backend.wait(user.pk, cursor, last_id,
+                            min(keepalive, remaining)):
+            yield ': keep-alive\n\n'
+
@@ -7,7 +7,9 @@ except ImportError:
 
 from django.utils.translation import ugettext as _
 from .. import notify_settings
-from ..utils import render_notification
+from ..instrumentation import instrumented
+from ..models import Notification
+from ..utils import paginate_notifications, render_notifications_batch
 
 register = template.Library()
 
@@ -49,16 +51,14 @@ class RenderNotificationsNode(template.Node):
         :param notifications: Notification QuerySet Object
         :return: Rendered HTML.
         """
-        html_chunks = []
-        for nf in notifications:
-            extra = nf.as_json() if self.target == 'box' else {}
-            html = render_notification(nf, render_target=self.target, **extra)
-            html_chunks.append(html)
+        html_chunks = [html for nf, data, html in render_notifications_batch(
+            notifications, render_target=self.target)]
         if not html_chunks:
             html_chunks.append(_("<b>No notifications yet.</b>"))
         html_string = '\n'.join(html_chunks)
         return html_string
 
+    @instrumented('tag.render_notifications')
     def render(self, context):
         """
         Render method of the template tag, returns generated html content to
@@ -102,6 +102,10 @@ def include_notify_js_variables(context):
     ctx = {
         'user': context['request'].user,
         'update_notification': reverse('notifications:update'),
+        'update_wait_notification': reverse('notifications:update_wait')
+        if notify_settings.LONG_POLL else '',
+        'stream_notification': reverse('notifications:stream')
+        if notify_settings.STREAM else '',
         'mark_notification': reverse('notifications:mark'),
         'mark_all_notification': reverse('notifications:mark_all'),
         'delete_notification': reverse('notifications:delete'),
@@ -119,6 +123,8 @@ def include_notify_js_variables(context):
         'nf_unread_class': notify_settings.UNREAD_NF_CLASS,
 
         'nf_update_time_interval': notify_settings.UPDATE_TIME_INTERVAL,
+        'nf_update_min_interval': notify_settings.UPDATE_MIN_INTERVAL,
+        'nf_update_max_interval': notify_settings.UPDATE_MAX_INTERVAL,
     }
     return ctx
 
@@ -128,6 +134,9 @@ class UserNotification(RenderNotificationsNode):
     """
     Returns notifications for a supplied user, can be used as shortcut
     for render_notifications
+
+    Renders a single page of ``NOTIFY_PAGE_SIZE`` notifications, starting
+    after the ``cursor`` URL parameter of the request when supplied.
     """
     @classmethod
     def handle_token(cls, parser, token):
@@ -146,6 +155,7 @@ class UserNotification(RenderNotificationsNode):
         else:
             return cls(obj='user-notification', target=tokens[2])
 
+    @instrumented('tag.user_notifications')
     def render(self, context):
         if self.obj == 'user-notification':
             request = context['request']
@@ -159,7 +169,9 @@ class UserNotification(RenderNotificationsNode):
                 is_authenticated = user.is_authenticated
 
             if is_authenticated:
-                notifications = user.notifications.active().prefetch()
+                notifications = paginate_notifications(
+                    Notification.objects.for_user(user).active().prefetch(),
+                    cursor=request.GET.get('cursor'))[0]
                 return self.generate_html(notifications)
         return ''
 
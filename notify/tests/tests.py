@@ -1,18 +1,35 @@
-from django.test import TestCase, override_settings
+import json
+import threading
+from datetime import timedelta
+from unittest import skipUnless
+
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.models import QuerySet
+from django.test import TestCase, TransactionTestCase, override_settings
 from django.contrib.auth import get_user_model
-from notify.models import Notification
-from notify.signals import notify
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import caches
 from django.utils import timezone
+from django.template import Template, Context, RequestContext
+from django.test.client import RequestFactory
+from django.contrib.auth.models import AnonymousUser
+from six import StringIO
 
 try:
     from django.core.urlresolvers import reverse
 except ImportError:
     from django.urls import reverse
 
-import json
-from django.template import Template, Context, RequestContext
-from django.test.client import RequestFactory
-from django.contrib.auth.models import AnonymousUser
+from notify import aggregation, counters, events, instrumentation, queue, \
+    retention, watermarks
+from notify.events import DatabaseBackend, LocalBackend
+from notify.models import ArchivedNotification, BroadcastState, \
+    Notification, NotificationCounter, NotificationJob
+from notify.signals import deliver_batch, notify
+from notify.utils import clear_template_cache, fragment_key, \
+    get_notification_template, paginate_notifications, render_notification, \
+    render_notifications_batch, template_autoreload
 
 User = get_user_model()
 
@@ -161,6 +178,60 @@ class NotificationTest(TestCase):
             timedelta = timezone.now() - nf.created
             self.assertLessEqual(timedelta.seconds, 60)
 
+    @override_settings(NOTIFY_BULK_BATCH_SIZE=3)
+    def test_queryset_recipient_list_in_batches(self):
+        # one query for the ids, one INSERT per batch.
+        with self.assertNumQueries(1 + 4):
+            result = notify.send(User, recipient_list=self.recipient_list,
+                                 actor=self.actor, verb='uploaded a video')
+        summary = result[0][1]
+        self.assertEqual(summary.created, self.no_of_users)
+        self.assertEqual(summary.batches, 4)
+        self.assertEqual(Notification.objects.count(), self.no_of_users)
+
+    def test_fan_out_resolves_content_types_once(self):
+        ContentType.objects.clear_cache()
+        get_for_model = ContentType.objects.get_for_model
+        calls = []
+
+        def counting_get_for_model(model, *args, **kwargs):
+            calls.append(model)
+            return get_for_model(model, *args, **kwargs)
+
+        ContentType.objects.get_for_model = counting_get_for_model
+        try:
+            notify.send(User, recipient_list=self.recipient_list,
+                        actor=self.actor, target=self.recipient,
+                        verb='uploaded a video')
+        finally:
+            del ContentType.objects.get_for_model
+        self.assertEqual(len(calls), 2)
+
+        user_type = ContentType.objects.get_for_model(User)
+        for nf in Notification.objects.all():
+            self.assertEqual(nf.actor_content_type_id, user_type.pk)
+            self.assertEqual(nf.actor_object_id, self.actor.pk)
+            self.assertEqual(nf.target_object_id, self.recipient.pk)
+
+    def test_recipient_id_iterator(self):
+        ids = (pk for pk in self.recipient_list.values_list('pk', flat=True))
+        result = notify.send(User, recipient_list=ids, actor=self.actor,
+                             verb='uploaded a video')
+        self.assertEqual(result[0][1].created, self.no_of_users)
+        self.assertEqual(
+            set(Notification.objects.values_list('recipient', flat=True)),
+            set(self.recipient_list.values_list('pk', flat=True)))
+
+    def test_invalid_recipient_list(self):
+        self.assertRaises(TypeError, notify.send, User,
+                          recipient_list=self.recipient, actor=self.actor,
+                          verb='uploaded a video')
+        self.assertRaises(TypeError, notify.send, User,
+                          recipient_list='user-0', actor=self.actor,
+                          verb='uploaded a video')
+        self.assertRaises(TypeError, notify.send, User, recipient_list=[],
+                          actor=self.actor, verb='uploaded a video')
+
 
 class NotificationViewTest(TestCase):
 
@@ -641,6 +712,9 @@ class NotificationTemplateTagTest(TestCase):
         self.request.user = self.user
         rendered = self.JS_INCLUSION.render(RequestContext(self.request))
         self.assertIn('<script type="text/javascript">', rendered)
+        self.assertIn('var notificationUpdateMinInterval = "5000";', rendered)
+        self.assertIn('var notificationUpdateMaxInterval = "60000";',
+                      rendered)
 
     def test_js_inclusion_tag_anonymous_user(self):
         self.request.user = AnonymousUser()
@@ -658,3 +732,1590 @@ class NotificationTemplateTagTest(TestCase):
         self.assertNotIn('followed you', rendered)
 
 # TODO: Write test for test-worthy methods.
+
+
+class PrefetchRelationsTest(TestCase):
+
+    def setUp(self):
+        from django.contrib.auth.models import Group
+
+        self.recipient = User.objects.create(username='recipient',
+                                             email='recipient@test.com')
+        self.actors = [User.objects.create(username='actor-%r' % i,
+                                           email='actor%r@test.com' % i)
+                       for i in range(5)]
+        self.group = Group.objects.create(name='group')
+
+        for actor in self.actors:
+            notify.send(User, recipient=self.recipient, actor=actor,
+                        target=self.group, obj=actor, verb='joined')
+        notify.send(User, recipient=self.recipient, actor_text='Anonymous',
+                    verb='joined')
+
+    def test_queries_per_content_type(self):
+        # one for notifications (recipient is select_related),
+        # one for users and one for groups.
+        with self.assertNumQueries(3):
+            notifications = list(
+                self.recipient.notifications.active().prefetch())
+            for nf in notifications:
+                nf.actor, nf.target, nf.obj
+
+        actors = [nf.actor for nf in notifications if nf.actor_content_type_id]
+        self.assertEqual(sorted(a.pk for a in actors),
+                         sorted(a.pk for a in self.actors))
+        anonymous = [nf for nf in notifications if not nf.actor_content_type_id]
+        self.assertEqual(anonymous[0].actor, 'Anonymous')
+
+    def test_prefetch_relations_utility(self):
+        from notify.utils import prefetch_relations
+
+        notifications = prefetch_relations(
+            list(Notification.objects.all()))
+        with self.assertNumQueries(0):
+            for nf in notifications:
+                nf.target
+
+    def test_missing_related_object(self):
+        self.group.delete()
+        with self.assertNumQueries(3):
+            notifications = list(
+                self.recipient.notifications.active().prefetch())
+        self.assertEqual(len(notifications), 6)
+
+
+@skipUnless(hasattr(QuerySet, 'explain'), "QuerySet.explain() not available")
+class NotificationIndexTest(TestCase):
+
+    """
+    Makes sure the hot queries are served by the composite indexes.
+    """
+
+    def setUp(self):
+        self.recipient = User.objects.create(username='recipient',
+                                             email='recipient@test.com')
+        for i in range(10):
+            notify.send(User, recipient=self.recipient, actor_text='Joe',
+                        verb='followed you')
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                # Tables this small are always scanned sequentially.
+                cursor.execute('SET enable_seqscan = off')
+
+    def index_on(self, *columns):
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(
+                cursor, Notification._meta.db_table)
+        for name, details in constraints.items():
+            if details['index'] and tuple(details['columns']) == columns:
+                return name
+        self.fail("No index on {}".format(columns))
+
+    def assertUsesIndex(self, queryset, *index_names):
+        plan = queryset.explain()
+        self.assertTrue(any(name in plan for name in index_names),
+                        "{} not used in:\n{}".format(index_names, plan))
+
+    @skipUnless(connection.vendor in ('sqlite', 'postgresql'),
+                "Query plans are only checked on SQLite and PostgreSQL")
+    def test_unread_uses_index(self):
+        candidates = [self.index_on('recipient_id', 'deleted',
+                                    'read', 'created')]
+        if connection.vendor == 'postgresql':
+            candidates.append('notify_nf_unread_partial_idx')
+        self.assertUsesIndex(self.recipient.notifications.unread(),
+                             *candidates)
+
+    @skipUnless(connection.vendor in ('sqlite', 'postgresql'),
+                "Query plans are only checked on SQLite and PostgreSQL")
+    def test_active_uses_index(self):
+        self.assertUsesIndex(
+            self.recipient.notifications.active(),
+            self.index_on('recipient_id', 'deleted', 'created'),
+            self.index_on('recipient_id', 'deleted', 'read', 'created'))
+
+    @skipUnless(connection.vendor in ('sqlite', 'postgresql'),
+                "Query plans are only checked on SQLite and PostgreSQL")
+    def test_update_filter_uses_index(self):
+        self.assertUsesIndex(
+            self.recipient.notifications.filter(id__gt=3).active(),
+            self.index_on('recipient_id', 'deleted', 'id'),
+            self.index_on('recipient_id', 'deleted', 'created'))
+
+
+@override_settings(NOTIFY_UNREAD_COUNTER=True)
+class UnreadCounterTest(TestCase):
+
+    def setUp(self):
+        self.recipient = User.objects.create(username='recipient',
+                                             email='recipient@test.com')
+        self.recipient.set_password('pwd@recipient')
+        self.recipient.save()
+        self.other = User.objects.create(username='other',
+                                         email='other@test.com')
+
+        for i in range(5):
+            notify.send(User, recipient=self.recipient, actor_text='Joe',
+                        verb='followed you')
+        notify.send(User, recipient_list=[self.recipient, self.other],
+                    actor_text='Joe', verb='posted')
+
+        # Counters are created lazily.
+        self.assertEqual(counters.unread_count(self.recipient), 6)
+        self.assertEqual(counters.unread_count(self.other), 1)
+
+    def assertCounterIsAccurate(self):
+        for user in (self.recipient, self.other):
+            self.assertEqual(
+                NotificationCounter.objects.get(user=user).unread,
+                Notification.objects.filter(recipient=user).unread().count())
+
+    def test_notify_increments(self):
+        notify.send(User, recipient=self.recipient, actor_text='Joe',
+                    verb='followed you')
+        notify.send(User, recipient_list=[self.recipient, self.other],
+                    actor_text='Joe', verb='posted')
+        self.assertEqual(counters.unread_count(self.recipient), 8)
+        self.assertCounterIsAccurate()
+
+    def test_mark_as_read_and_unread(self):
+        nf = self.recipient.notifications.first()
+        nf.mark_as_read()
+        self.assertEqual(counters.unread_count(self.recipient), 5)
+        # marking twice does not change the counter.
+        nf.mark_as_read()
+        self.assertEqual(counters.unread_count(self.recipient), 5)
+        nf.mark_as_unread()
+        self.assertEqual(counters.unread_count(self.recipient), 6)
+        self.assertCounterIsAccurate()
+
+    def test_track_ignores_concurrent_rows(self):
+        qs = Notification.objects.filter(recipient=self.recipient).unread()
+        with counters.track(qs, -1) as locked:
+            # Sent between the count and the update.
+            notify.send(User, recipient=self.recipient, actor_text='Joe',
+                        verb='followed you')
+            locked.update(read=True)
+        self.assertEqual(counters.unread_count(self.recipient), 1)
+        self.assertCounterIsAccurate()
+
+    def test_mark_all_and_delete_all(self):
+        self.recipient.notifications.first().mark_as_read()
+
+        self.recipient.notifications.read_all()
+        self.assertEqual(counters.unread_count(self.recipient), 0)
+        self.assertCounterIsAccurate()
+
+        self.recipient.notifications.unread_all()
+        self.assertEqual(counters.unread_count(self.recipient), 6)
+        self.assertCounterIsAccurate()
+
+        self.recipient.notifications.first().mark_as_read()
+        Notification.objects.delete_all()
+        self.assertEqual(counters.unread_count(self.recipient), 0)
+        self.assertEqual(counters.unread_count(self.other), 0)
+        self.assertCounterIsAccurate()
+
+        Notification.objects.active_all()
+        self.assertEqual(counters.unread_count(self.recipient), 5)
+        self.assertEqual(counters.unread_count(self.other), 1)
+        self.assertCounterIsAccurate()
+
+    @override_settings(NOTIFY_SOFT_DELETE=False)
+    def test_hard_delete_all(self):
+        self.recipient.notifications.delete_all()
+        self.assertEqual(counters.unread_count(self.recipient), 0)
+        self.assertCounterIsAccurate()
+
+    def test_delete_view(self):
+        self.assertTrue(self.client.login(username='recipient',
+                                          password='pwd@recipient'))
+        nf = self.recipient.notifications.first()
+        self.client.post(reverse('notifications:delete'), {'id': nf.id},
+                         HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(counters.unread_count(self.recipient), 5)
+        self.assertCounterIsAccurate()
+
+    def test_update_view_uses_counter(self):
+        self.assertTrue(self.client.login(username='recipient',
+                                          password='pwd@recipient'))
+        NotificationCounter.objects.filter(user=self.recipient).update(
+            unread=42)
+        url = "{}?flag=1".format(reverse('notifications:update'))
+        resp = json.loads(self.client.get(url).content.decode('utf-8'))
+        self.assertEqual(resp['unread_count'], 42)
+
+    def test_rebuild_command(self):
+        NotificationCounter.objects.update(unread=42)
+        call_command('notify_rebuild_counters', stdout=StringIO())
+        self.assertCounterIsAccurate()
+
+        NotificationCounter.objects.update(unread=42)
+        call_command('notify_rebuild_counters', str(self.other.pk),
+                     stdout=StringIO())
+        self.assertEqual(counters.unread_count(self.other), 1)
+        self.assertEqual(counters.unread_count(self.recipient), 42)
+
+
+class LongPollTest(TestCase):
+
+    def setUp(self):
+        self.recipient = User.objects.create(username='recipient',
+                                             email='recipient@test.com')
+        self.recipient.set_password('pwd@recipient')
+        self.recipient.save()
+        notify.send(User, recipient=self.recipient, actor_text='Joe',
+                    verb='followed you')
+        self.last_id = self.recipient.notifications.get().id
+        self.assertTrue(self.client.login(username='recipient',
+                                          password='pwd@recipient'))
+
+    def get_update(self, flag):
+        url = "{}?flag={}".format(reverse('notifications:update_wait'), flag)
+        return json.loads(self.client.get(url).content.decode('utf-8'))
+
+    def test_local_backend_wakes_up(self):
+        backend = LocalBackend()
+        cursor = backend.cursor(self.recipient.pk)
+        timer = threading.Timer(0.05, backend.publish, [[self.recipient.pk]])
+        timer.start()
+        self.assertTrue(backend.wait(self.recipient.pk, cursor, 0, 5))
+        timer.join()
+
+    def test_local_backend_does_not_miss_events(self):
+        backend = LocalBackend()
+        cursor = backend.cursor(self.recipient.pk)
+        backend.publish([self.recipient.pk])
+        self.assertTrue(backend.wait(self.recipient.pk, cursor, 0, 0))
+
+    def test_local_backend_times_out(self):
+        backend = LocalBackend()
+        cursor = backend.cursor(self.recipient.pk)
+        backend.publish([self.recipient.pk + 1])
+        self.assertFalse(backend.wait(self.recipient.pk, cursor, 0, 0.05))
+
+    def test_database_backend(self):
+        backend = DatabaseBackend()
+        self.assertTrue(backend.wait(self.recipient.pk, None, 0, 0))
+        self.assertFalse(
+            backend.wait(self.recipient.pk, None, self.last_id, 0.05))
+
+    def test_returns_existing_notifications_immediately(self):
+        notify.send(User, recipient=self.recipient, actor_text='Joe',
+                    verb='followed you')
+        resp = self.get_update(self.last_id)
+        self.assertTrue(resp['success'])
+        self.assertEqual(resp['retrieved'], 1)
+
+    @override_settings(NOTIFY_LONG_POLL_TIMEOUT=0.05)
+    def test_times_out_without_notifications(self):
+        resp = self.get_update(self.last_id)
+        self.assertTrue(resp['success'])
+        self.assertEqual(resp['retrieved'], 0)
+
+    def test_without_flag(self):
+        resp = self.get_update('')
+        self.assertFalse(resp['success'])
+
+
+@override_settings(NOTIFY_STREAM_LIFETIME=0)
+class NotificationStreamTest(TestCase):
+
+    def setUp(self):
+        self.recipient = User.objects.create(username='recipient',
+                                             email='recipient@test.com')
+        self.recipient.set_password('pwd@recipient')
+        self.recipient.save()
+        for i in range(3):
+            notify.send(User, recipient=self.recipient, actor_text='Joe',
+                        verb='followed you')
+        self.ids = sorted(self.recipient.notifications.values_list(
+            'id', flat=True))
+        self.assertTrue(self.client.login(username='recipient',
+                                          password='pwd@recipient'))
+
+    def get_events(self, **kwargs):
+        response = self.client.get(reverse('notifications:stream'), **kwargs)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        content = b''.join(response.streaming_content).decode('utf-8')
+        events = []
+        for block in content.strip().split('\n\n'):
+            fields = dict(line.split(': ', 1) for line in block.split('\n'))
+            events.append(fields)
+        return events
+
+    def test_resume_from_last_event_id(self):
+        events = self.get_events(HTTP_LAST_EVENT_ID=str(self.ids[0]))
+        self.assertEqual(events[0], {'retry': '3000'})
+
+        notifications = [e for e in events if e.get('event') == 'notification']
+        self.assertEqual([int(e['id']) for e in notifications], self.ids[1:])
+        data = json.loads(notifications[0]['data'])
+        self.assertEqual(data['id'], self.ids[1])
+        self.assertIn('followed you', data['html'])
+
+        counts = [e for e in events if e.get('event') == 'unread_count']
+        self.assertEqual(json.loads(counts[0]['data']), {'unread_count': 3})
+
+    def test_without_last_event_id(self):
+        events = self.get_events()
+        self.assertFalse(
+            [e for e in events if e.get('event') == 'notification'])
+
+    @override_settings(NOTIFY_STREAM_LIFETIME=0.2,
+                       NOTIFY_STREAM_KEEPALIVE=0.05,
+                       NOTIFY_EVENT_BACKEND='notify.events.LocalBackend')
+    def test_keep_alive(self):
+        response = self.client.get(reverse('notifications:stream'))
+        content = b''.join(response.streaming_content).decode('utf-8')
+        self.assertIn(': keep-alive', content)
+
+    def test_refused_under_asgi(self):
+        from django.http import Http404
+        from notify.views import notification_stream
+
+        request = RequestFactory().get(reverse('notifications:stream'))
+        request.user = self.recipient
+        request.scope = {'type': 'http'}
+        with self.assertRaises(Http404):
+            notification_stream(request)
+
+
+@override_settings(NOTIFY_ASYNC_DISPATCH=True, NOTIFY_BULK_BATCH_SIZE=3)
+class DispatchQueueTest(TestCase):
+
+    def setUp(self):
+        from django.contrib.auth.models import Group
+
+        self.actor = User.objects.create(username='actor',
+                                         email='actor@test.com')
+        self.recipients = [User.objects.create(username='user-%r' % i,
+                                               email='user%r@test.com' % i)
+                           for i in range(7)]
+        self.group = Group.objects.create(name='group')
+
+    def send(self, **kwargs):
+        return notify.send(User, actor=self.actor, verb='joined',
+                           target=self.group, **kwargs)[0][1]
+
+    def test_send_enqueues_job(self):
+        job = self.send(recipient_list=self.recipients)
+        self.assertIsInstance(job, NotificationJob)
+        self.assertEqual(Notification.objects.count(), 0)
+        self.assertEqual(job.payload['recipients'],
+                         [u.pk for u in self.recipients])
+
+    def test_send_validates_arguments(self):
+        self.assertRaises(TypeError, notify.send, User, actor=self.actor,
+                          verb='joined')
+        self.assertEqual(NotificationJob.objects.count(), 0)
+
+    def test_worker_delivers_jobs(self):
+        self.send(recipient_list=self.recipients)
+        self.send(recipient=self.recipients[0])
+
+        call_command('notify_worker', once=True, stdout=StringIO())
+
+        self.assertEqual(NotificationJob.objects.count(), 0)
+        self.assertEqual(Notification.objects.count(), 8)
+        nf = self.recipients[0].notifications.prefetch()[0]
+        self.assertEqual(nf.actor, self.actor)
+        self.assertEqual(nf.target, self.group)
+        self.assertEqual(nf.verb, 'joined')
+
+    def test_claimed_job_is_not_claimed_again(self):
+        job = self.send(recipient_list=self.recipients)
+        self.assertEqual(queue.claim(10, 60), [job.id])
+        self.assertEqual(queue.claim(10, 60), [])
+
+        # Expired leases are claimed again.
+        NotificationJob.objects.update(
+            locked_until=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(queue.claim(10, 60), [job.id])
+
+    def test_resumes_after_last_committed_batch(self):
+        job = self.send(recipient_list=self.recipients)
+
+        # A worker died after delivering the first batch.
+        deliver_batch(job.payload['recipients'][:3], job.payload['fields'])
+        NotificationJob.objects.filter(id=job.id).update(progress=3)
+
+        self.assertEqual(queue.work(), 1)
+        self.assertEqual(Notification.objects.count(), len(self.recipients))
+        for user in self.recipients:
+            self.assertEqual(user.notifications.count(), 1)
+
+    def test_expired_lease_stops_the_worker(self):
+        job = self.send(recipient_list=self.recipients)
+        stale = NotificationJob.objects.get(id=job.id)
+
+        # The lease expired, another worker took the job over and delivered
+        # the first batch.
+        queue.deliver_next(NotificationJob.objects.get(id=job.id), 3, 60)
+
+        with self.assertRaises(queue.LeaseLost):
+            queue.deliver_next(stale, 3, 60)
+        self.assertEqual(Notification.objects.count(), 3)
+        self.assertEqual(NotificationJob.objects.get(id=job.id).progress, 3)
+
+    def test_failed_job_is_kept(self):
+        job = self.send(recipient_list=self.recipients)
+        job.payload['fields']['unknown_field'] = 1
+        job.save()
+        with self.assertLogs('notify.queue', 'ERROR'):
+            self.assertEqual(queue.work(), 0)
+        job = NotificationJob.objects.get(id=job.id)
+        self.assertTrue(job.last_error)
+        self.assertEqual(job.attempts, 1)
+        self.assertEqual(Notification.objects.count(), 0)
+
+
+@override_settings(NOTIFY_PAGE_SIZE=4)
+class KeysetPaginationTest(TestCase):
+
+    USER_NOTIFICATIONS = Template("""
+    {% load notification_tags %}
+    {% user_notifications %}
+    """)
+
+    def setUp(self):
+        self.recipient = User.objects.create(username='recipient',
+                                             email='recipient@test.com')
+        self.recipient.set_password('pwd@recipient')
+        self.recipient.save()
+        for i in range(10):
+            notify.send(User, recipient=self.recipient, actor_text='Joe',
+                        verb='reached level %r' % i)
+        # Notifications sharing a timestamp are ordered by id.
+        Notification.objects.filter(id__in=[4, 5, 6]).update(
+            created=Notification.objects.get(id=5).created)
+        self.expected = list(Notification.objects.order_by(
+            '-created', '-id').values_list('id', flat=True))
+
+    def test_paginate_notifications(self):
+        queryset = self.recipient.notifications.active()
+        seen, cursor = [], None
+        while True:
+            with self.assertNumQueries(1):
+                page, cursor = paginate_notifications(queryset, cursor)
+                seen.extend(nf.id for nf in page)
+            if not cursor:
+                break
+        self.assertEqual(seen, self.expected)
+
+    def test_invalid_cursor_returns_first_page(self):
+        queryset = self.recipient.notifications.active()
+        page, cursor = paginate_notifications(queryset, 'not-a-cursor')
+        self.assertEqual([nf.id for nf in page], self.expected[:4])
+
+    def test_notifications_view(self):
+        self.assertTrue(self.client.login(username='recipient',
+                                          password='pwd@recipient'))
+        response = self.client.get(reverse('notifications:all'))
+        self.assertEqual([nf.id for nf in response.context['notifications']],
+                         self.expected[:4])
+        response = self.client.get(reverse('notifications:all'),
+                                   {'cursor': response.context['next_cursor']})
+        self.assertEqual([nf.id for nf in response.context['notifications']],
+                         self.expected[4:8])
+
+    def test_list_view(self):
+        self.assertTrue(self.client.login(username='recipient',
+                                          password='pwd@recipient'))
+        url = reverse('notifications:list')
+        resp = json.loads(self.client.get(url, {'limit': 6}).content.decode(
+            'utf-8'))
+        self.assertTrue(resp['success'])
+        self.assertEqual([nf['id'] for nf in resp['notifications']],
+                         self.expected[:6])
+        self.assertIn('reached level', resp['notifications'][0]['html'])
+
+        resp = json.loads(self.client.get(
+            url, {'limit': 6, 'cursor': resp['next_cursor']}).content.decode(
+            'utf-8'))
+        self.assertEqual([nf['id'] for nf in resp['notifications']],
+                         self.expected[6:])
+        self.assertIsNone(resp['next_cursor'])
+
+    def test_user_notifications_tag(self):
+        request = RequestFactory().get('/foobar/')
+        request.user = self.recipient
+        rendered = self.USER_NOTIFICATIONS.render(RequestContext(request))
+        self.assertEqual(rendered.count('class="notification '), 4)
+
+
+class NotificationTemplateCacheTest(TestCase):
+
+    def setUp(self):
+        clear_template_cache()
+
+    def test_template_is_resolved_once(self):
+        template = get_notification_template('followed_you', 'box')
+        self.assertIs(get_notification_template('followed_you', 'box'),
+                      template)
+        self.assertIsNot(get_notification_template('followed_you', 'page'),
+                         template)
+        self.assertEqual(template.template.name,
+                         'notifications/includes/default_box.html')
+
+    def test_cache_cleared_on_setting_change(self):
+        template = get_notification_template('default')
+        with override_settings(NOTIFY_SOMETHING=True):
+            self.assertIsNot(get_notification_template('default'), template)
+
+    @override_settings(DEBUG=True)
+    def test_bypassed_without_template_autoreload(self):
+        template = get_notification_template('default')
+        if template_autoreload is None:
+            self.assertIsNot(get_notification_template('default'), template)
+        else:
+            self.assertIs(get_notification_template('default'), template)
+
+
+class RenderNotificationsBatchTest(TestCase):
+
+    def setUp(self):
+        self.recipient = User.objects.create(username='recipient',
+                                             email='recipient@test.com')
+        for i in range(6):
+            notify.send(User, recipient=self.recipient, actor_text='Joe',
+                        verb='reached level %r' % i,
+                        nf_type='level' if i % 2 else 'default')
+
+    def test_same_output_as_render_notification(self):
+        notifications = list(self.recipient.notifications.active())
+        for target in ('', 'page', 'box'):
+            rendered = render_notifications_batch(notifications, target)
+            self.assertEqual([nf for nf, data, html in rendered],
+                             notifications)
+            for nf, data, html in rendered:
+                extra = nf.as_json() if target == 'box' else {}
+                self.assertEqual(data, extra)
+                self.assertEqual(
+                    html, render_notification(nf, render_target=target,
+                                              **extra))
+
+    def test_variables_do_not_leak_between_notifications(self):
+        notifications = list(self.recipient.notifications.active())
+        rendered = render_notifications_batch(notifications, 'box')
+        for nf, data, html in rendered:
+            self.assertIn(nf.verb, html)
+            self.assertEqual(html.count('reached level'), 1)
+
+
+class ConditionalUpdateTest(TestCase):
+
+    def setUp(self):
+        self.recipient = User.objects.create(username='recipient',
+                                             email='recipient@test.com')
+        self.recipient.set_password('pwd@recipient')
+        self.recipient.save()
+        notify.send(User, recipient=self.recipient, actor_text='Joe',
+                    verb='followed you')
+        self.notification = self.recipient.notifications.get()
+        self.url = "{}?flag={}".format(reverse('notifications:update'),
+                                       self.notification.id)
+        self.assertTrue(self.client.login(username='recipient',
+                                          password='pwd@recipient'))
+
+    def assertNotModified(self, etag, expected=True):
+        resp = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 304 if expected else 200)
+
+    def test_etag(self):
+        resp = self.client.get(self.url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('ETag', resp)
+        self.assertIn('no-cache', resp['Cache-Control'])
+        self.assertNotModified(resp['ETag'])
+
+    def test_not_modified_skips_rendering(self):
+        etag = self.client.get(self.url)['ETag']
+        with self.assertNumQueries(4):
+            # Session, user, latest notification ID and unread counter.
+            self.assertNotModified(etag)
+
+    def test_changes_on_new_notification(self):
+        etag = self.client.get(self.url)['ETag']
+        notify.send(User, recipient=self.recipient, actor_text='Joe',
+                    verb='followed you')
+        self.assertNotModified(etag, False)
+
+    def test_changes_on_mark(self):
+        etag = self.client.get(self.url)['ETag']
+        self.notification.mark_as_read()
+        self.assertNotModified(etag, False)
+
+    @override_settings(NOTIFY_UNREAD_COUNTER=False)
+    def test_changes_on_mark_without_counter(self):
+        etag = self.client.get(self.url)['ETag']
+        self.assertNotModified(etag)
+        self.notification.mark_as_read()
+        self.assertNotModified(etag, False)
+
+    def test_depends_on_flag(self):
+        etag = self.client.get(self.url)['ETag']
+        self.url = "{}?flag=0".format(reverse('notifications:update'))
+        self.assertNotModified(etag, False)
+
+
+@override_settings(NOTIFY_UNREAD_COUNTER=True)
+class AggregationTest(TestCase):
+
+    def setUp(self):
+        self.recipient = User.objects.create(username='recipient',
+                                             email='recipient@test.com')
+        self.other = User.objects.create(username='other',
+                                         email='other@test.com')
+        counters.rebuild()
+
+    def like(self, actor_text, recipient=None, **kwargs):
+        kwargs.setdefault('target_text', 'My post')
+        notify.send(User, recipient=recipient or self.recipient,
+                    actor_text=actor_text, verb='liked', nf_type='like',
+                    aggregate=True, **kwargs)
+
+    def test_collapses_similar_notifications(self):
+        for i in range(4):
+            self.like('user%s' % i)
+        nf = self.recipient.notifications.get()
+        self.assertEqual(nf.actor_text, 'user3')
+        self.assertEqual(nf.extra['aggregate_count'], 4)
+        self.assertEqual([actor['text'] for actor in nf.extra['recent_actors']],
+                         ['user3', 'user2', 'user1', 'user0'])
+        self.assertEqual(counters.unread_count(self.recipient), 1)
+
+    @override_settings(NOTIFY_AGGREGATE_MAX_ACTORS=2)
+    def test_recent_actors_are_capped(self):
+        for i in range(4):
+            self.like('user%s' % i)
+        nf = self.recipient.notifications.get()
+        self.assertEqual(nf.extra['aggregate_count'], 4)
+        self.assertEqual([actor['text'] for actor in nf.extra['recent_actors']],
+                         ['user3', 'user2'])
+
+    def test_keeps_extra(self):
+        self.like('user0', extra={'post_id': 1})
+        self.like('user1', extra={'post_id': 1})
+        nf = self.recipient.notifications.get()
+        self.assertEqual(nf.extra['post_id'], 1)
+        self.assertEqual(nf.extra['aggregate_count'], 2)
+
+    def test_separate_keys(self):
+        self.like('user0')
+        self.like('user1', target_text='Other post')
+        self.like('user2', recipient=self.other)
+        notify.send(User, recipient=self.recipient, actor_text='user3',
+                    verb='liked', nf_type='like', target_text='My post')
+        self.assertEqual(self.recipient.notifications.count(), 3)
+        self.assertEqual(self.other.notifications.count(), 1)
+
+    def test_window(self):
+        with self.settings(NOTIFY_AGGREGATE_WINDOW=60):
+            key = aggregation.make_key('liked', 'like', target_text='My post',
+                                       now=120)
+            self.assertEqual(key, aggregation.make_key(
+                'liked', 'like', target_text='My post', now=179))
+            self.assertNotEqual(key, aggregation.make_key(
+                'liked', 'like', target_text='My post', now=180))
+
+    def test_read_aggregate_becomes_unread(self):
+        self.like('user0')
+        self.recipient.notifications.get().mark_as_read()
+        self.assertEqual(counters.unread_count(self.recipient), 0)
+        self.like('user1')
+        nf = self.recipient.notifications.get()
+        self.assertFalse(nf.read)
+        self.assertEqual(counters.unread_count(self.recipient), 1)
+
+    @override_settings(NOTIFY_READ_WATERMARK=True)
+    def test_aggregate_read_by_watermark_becomes_unread(self):
+        self.like('user0')
+        Notification.objects.filter(recipient=self.recipient).read_all()
+        self.assertEqual(counters.unread_count(self.recipient), 0)
+        self.like('user1')
+        self.assertEqual(self.recipient.notifications.unread().count(), 1)
+        self.assertEqual(counters.unread_count(self.recipient), 1)
+
+    def test_update_returns_bumped_aggregate(self):
+        self.recipient.set_password('pwd@recipient')
+        self.recipient.save()
+        self.assertTrue(self.client.login(username='recipient',
+                                          password='pwd@recipient'))
+        self.like('user0')
+        flag = self.recipient.notifications.get().id
+        self.like('user1')
+        nf = self.recipient.notifications.get()
+        self.assertGreater(nf.id, flag)
+        url = "{}?flag={}".format(reverse('notifications:update'), flag)
+        resp = json.loads(self.client.get(url).content.decode('utf-8'))
+        self.assertTrue(resp['success'])
+        self.assertEqual(resp['retrieved'], 1)
+        self.assertEqual(resp['notifications'][0]['id'], nf.id)
+
+    def test_fan_out(self):
+        self.like('user0')
+        result = notify.send(
+            User, recipient_list=User.objects.all(), actor_text='user1',
+            verb='liked', nf_type='like', target_text='My post',
+            aggregate=True)[0][1]
+        self.assertEqual(result.created, 2)
+        self.assertEqual(
+            self.recipient.notifications.get().extra['aggregate_count'], 2)
+        self.assertEqual(
+            self.other.notifications.get().extra['aggregate_count'], 1)
+        self.assertEqual(counters.unread_count(self.other), 1)
+
+    def test_unique_key(self):
+        self.like('user0')
+        nf = self.recipient.notifications.get()
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                Notification.objects.create(
+                    recipient=self.recipient, actor_text='user1',
+                    verb='liked', aggregate_key=nf.aggregate_key)
+
+
+@skipUnless(connection.vendor == 'postgresql',
+            "requires row locks of PostgreSQL")
+class AggregationConcurrencyTest(TransactionTestCase):
+
+    def test_parallel_senders(self):
+        from django.db import connections
+
+        recipient = User.objects.create(username='recipient',
+                                        email='recipient@test.com')
+        errors = []
+
+        def like(i):
+            try:
+                notify.send(User, recipient=recipient, actor_text='user%s' % i,
+                            verb='liked', nf_type='like',
+                            target_text='My post', aggregate=True)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=like, args=(i, ))
+                   for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        nf = recipient.notifications.get()
+        self.assertEqual(nf.extra['aggregate_count'], 8)
+
+
+@override_settings(NOTIFY_UNREAD_COUNTER=True)
+class RetentionTest(TestCase):
+
+    def setUp(self):
+        self.recipient = User.objects.create(username='recipient',
+                                             email='recipient@test.com')
+        counters.rebuild()
+
+    def send(self, days, nf_type='default', read=False, deleted=False):
+        notify.send(User, recipient=self.recipient, actor_text='Joe',
+                    verb='followed you', nf_type=nf_type)
+        nf = self.recipient.notifications.order_by('-id')[0]
+        Notification.objects.filter(id=nf.id).update(
+            created=timezone.now() - timedelta(days=days),
+            read=read, deleted=deleted)
+        return nf.id
+
+    def purge(self, **kwargs):
+        out = StringIO()
+        call_command('notify_purge', stdout=out, **kwargs)
+        return out.getvalue()
+
+    def remaining(self):
+        return set(Notification.objects.values_list('id', flat=True))
+
+    def test_no_policy(self):
+        self.send(1000, read=True)
+        self.assertEqual(retention.expired_filter(), (None, None))
+        self.assertIn('Purged 0 notifications', self.purge())
+        self.assertEqual(Notification.objects.count(), 1)
+
+    @override_settings(NOTIFY_RETENTION={'*': {'max_age': 30}})
+    def test_read_only(self):
+        old_read = self.send(40, read=True)
+        old_unread = self.send(40)
+        recent_read = self.send(10, read=True)
+        self.assertIn('Purged 1 notifications', self.purge())
+        self.assertEqual(self.remaining(), {old_unread, recent_read})
+        self.assertNotIn(old_read, self.remaining())
+
+    @override_settings(NOTIFY_RETENTION={
+        '*': {'max_age': 100},
+        'like': {'max_age': 7, 'read_only': False},
+    })
+    def test_per_type(self):
+        like = self.send(10, nf_type='like')
+        kept_like = self.send(1, nf_type='like')
+        old_default = self.send(200, read=True)
+        kept_default = self.send(50, read=True)
+        self.assertEqual(counters.unread_count(self.recipient), 2)
+        self.purge(batch_size=1)
+        self.assertEqual(self.remaining(), {kept_like, kept_default})
+        self.assertEqual(counters.unread_count(self.recipient), 1)
+        self.assertNotIn(like, self.remaining())
+        self.assertNotIn(old_default, self.remaining())
+
+    @override_settings(NOTIFY_RETENTION_DELETED_GRACE=7)
+    def test_deleted_grace(self):
+        deleted = self.send(10, deleted=True)
+        recently_deleted = self.send(2, deleted=True)
+        kept = self.send(10)
+        self.purge()
+        self.assertEqual(self.remaining(), {recently_deleted, kept})
+        self.assertNotIn(deleted, self.remaining())
+
+    @override_settings(NOTIFY_RETENTION={'*': {'max_age': 30}})
+    def test_dry_run(self):
+        self.send(40, read=True)
+        self.send(40, read=True)
+        self.assertIn('2 notifications would be purged',
+                      self.purge(dry_run=True, batch_size=1))
+        self.assertEqual(Notification.objects.count(), 2)
+
+
+@override_settings(NOTIFY_UNREAD_COUNTER=True)
+class ArchiveTest(TestCase):
+
+    def setUp(self):
+        self.recipient = User.objects.create(username='recipient',
+                                             email='recipient@test.com')
+        self.other = User.objects.create(username='other',
+                                         email='other@test.com')
+        counters.rebuild()
+        self.old = [self.send(100 + i) for i in range(3)]
+        self.recent = self.send(1)
+        self.other_old = self.send(200, recipient=self.other)
+
+    def send(self, days, recipient=None):
+        notify.send(User, recipient=recipient or self.recipient,
+                    actor=self.other, verb='followed you',
+                    extra={'days': days})
+        nf = Notification.objects.order_by('-id')[0]
+        Notification.objects.filter(id=nf.id).update(
+            created=timezone.now() - timedelta(days=days))
+        return nf.id
+
+    def archive(self, *args, **kwargs):
+        out = StringIO()
+        call_command('notify_archive', *args, stdout=out, **kwargs)
+        return out.getvalue()
+
+    def test_moves_old_notifications(self):
+        self.assertIn('Archived 4 notifications',
+                      self.archive('30', batch_size=2))
+        self.assertEqual(
+            list(Notification.objects.values_list('id', flat=True)),
+            [self.recent])
+        archived = ArchivedNotification.objects.get(id=self.old[0])
+        self.assertEqual(archived.recipient, self.recipient)
+        self.assertEqual(archived.actor_object_id, self.other.pk)
+        self.assertEqual(archived.extra, {'days': 100})
+        self.assertEqual(counters.unread_count(self.recipient), 1)
+
+    def test_dry_run(self):
+        self.assertIn('4 notifications would be archived',
+                      self.archive('30', dry_run=True))
+        self.assertEqual(ArchivedNotification.objects.count(), 0)
+
+    def test_with_archive(self):
+        self.archive('30')
+        rows = list(self.recipient.notifications.with_archive(
+            self.recipient))
+        self.assertEqual([row['id'] for row in rows],
+                         [self.recent] + self.old)
+        self.assertEqual(rows[1]['extra'], {'days': 100})
+
+    def test_with_archive_excludes_other_users(self):
+        self.archive('30')
+        for qs in (self.recipient.notifications.all(),
+                   Notification.objects.for_user(self.recipient)):
+            self.assertEqual([row['id'] for row in qs.with_archive()],
+                             [self.recent] + self.old)
+        self.assertEqual(
+            [row['id'] for row in self.other.notifications.with_archive()],
+            [self.other_old])
+        with self.assertRaises(ValueError):
+            Notification.objects.with_archive()
+
+    def test_with_archive_applies_deleted_state(self):
+        Notification.objects.filter(id=self.old[0]).update(deleted=True)
+        self.archive('30')
+        notifications = self.recipient.notifications
+        self.assertEqual(
+            [row['id'] for row in notifications.active().with_archive()],
+            [self.recent] + self.old[1:])
+        self.assertEqual(
+            [row['id'] for row in notifications.deleted().with_archive()],
+            self.old[:1])
+
+    @override_settings(NOTIFY_RETENTION={'*': {'max_age': 150,
+                                               'read_only': False}})
+    def test_purge_to_archive(self):
+        out = StringIO()
+        call_command('notify_purge', archive=True, stdout=out)
+        self.assertIn('Purged 1 notifications', out.getvalue())
+        self.assertEqual(
+            list(ArchivedNotification.objects.values_list('id', flat=True)),
+            [self.other_old])
+
+
+@override_settings(NOTIFY_READ_WATERMARK=True, NOTIFY_UNREAD_COUNTER=True)
+class ReadWatermarkTest(TestCase):
+
+    def setUp(self):
+        self.recipient = User.objects.create(username='recipient',
+                                             email='recipient@test.com')
+        for i in range(5):
+            self.send()
+        counters.rebuild()
+        self.ids = list(self.recipient.notifications.order_by(
+            'id').values_list('id', flat=True))
+
+    def send(self):
+        notify.send(User, recipient=self.recipient, actor_text='Joe',
+                    verb='followed you')
+
+    def unread_ids(self):
+        return sorted(self.recipient.notifications.unread().values_list(
+            'id', flat=True))
+
+    def test_read_all_moves_watermark(self):
+        # Independent of the number of notifications: looks up the latest
+        # notification, creates the watermark and updates the counter.
+        with self.assertNumQueries(8):
+            Notification.objects.read_all(self.recipient)
+        self.assertEqual(watermarks.get(self.recipient), self.ids[-1])
+        # Rows are left untouched.
+        self.assertEqual(
+            Notification.objects.filter(read=False).count(), 5)
+        self.assertEqual(self.unread_ids(), [])
+        self.assertEqual(self.recipient.notifications.read().count(), 5)
+        self.assertEqual(counters.unread_count(self.recipient), 0)
+        counters.rebuild([self.recipient])
+        self.assertEqual(counters.unread_count(self.recipient), 0)
+
+    def test_loaded_notifications_are_read(self):
+        Notification.objects.read_all(self.recipient)
+        self.send()
+        notifications = list(self.recipient.notifications.order_by('id'))
+        self.assertEqual([nf.as_json()['read'] for nf in notifications],
+                         [True] * 5 + [False])
+        self.assertTrue(Notification.objects.get(id=self.ids[0]).read)
+
+    def test_new_notifications_are_unread(self):
+        Notification.objects.read_all(self.recipient)
+        self.send()
+        self.assertEqual(len(self.unread_ids()), 1)
+        self.assertEqual(counters.unread_count(self.recipient), 1)
+
+    def test_mark_as_unread_below_watermark(self):
+        Notification.objects.read_all(self.recipient)
+        Notification.objects.get(id=self.ids[2]).mark_as_unread()
+        self.assertEqual(self.unread_ids(), [self.ids[2]])
+        self.assertEqual(counters.unread_count(self.recipient), 1)
+        self.assertEqual(watermarks.get(self.recipient), self.ids[2] - 1)
+        self.assertTrue(Notification.objects.get(id=self.ids[3]).read)
+
+    def test_mark_as_read_above_watermark(self):
+        Notification.objects.read_all(self.recipient)
+        self.send()
+        nf = self.recipient.notifications.unread().get()
+        nf.mark_as_read()
+        self.assertEqual(self.unread_ids(), [])
+        self.assertEqual(counters.unread_count(self.recipient), 0)
+
+    def test_unread_all(self):
+        Notification.objects.read_all(self.recipient)
+        Notification.objects.unread_all(self.recipient)
+        self.assertEqual(self.unread_ids(), self.ids)
+        self.assertEqual(counters.unread_count(self.recipient), 5)
+
+    def test_filtered_querysets_update_rows(self):
+        self.recipient.notifications.filter(id__lte=self.ids[1]).read_all()
+        self.assertEqual(watermarks.get(self.recipient), 0)
+        self.assertEqual(self.unread_ids(), self.ids[2:])
+        self.assertEqual(counters.unread_count(self.recipient), 3)
+
+
+@override_settings(NOTIFY_JSON_SNAPSHOT=True)
+class JsonSnapshotTest(TestCase):
+
+    def setUp(self):
+        self.recipient = User.objects.create(username='recipient',
+                                             email='recipient@test.com')
+        self.recipient.set_password('pwd@recipient')
+        self.recipient.save()
+        self.actor = User.objects.create(username='<actor>',
+                                         email='actor@test.com')
+        notify.send(User, recipient=self.recipient, actor=self.actor,
+                    verb='followed you', target=self.actor)
+
+    def test_snapshot_matches_as_json(self):
+        nf = self.recipient.notifications.get()
+        self.assertEqual(nf.snapshot['actor'], '&lt;actor&gt;')
+        expected = dict(nf.build_snapshot(), id=nf.id, read=nf.read,
+                        created=nf.created, data=nf.extra, broadcast=False)
+        self.assertEqual(nf.as_json(), expected)
+
+    def test_as_json_skips_generic_relations(self):
+        nf = self.recipient.notifications.get()
+        with self.assertNumQueries(0):
+            self.assertEqual(nf.as_json()['target'], '&lt;actor&gt;')
+
+    def test_snapshot_is_not_escaped_twice(self):
+        nf = self.recipient.notifications.get()
+        html = render_notification(nf, render_target='box', **nf.as_json())
+        self.assertIn('&lt;actor&gt;', html)
+        self.assertNotIn('&amp;lt;', html)
+
+    def test_box_uses_overridden_default_template(self):
+        templates = [{
+            'BACKEND': 'django.template.backends.django.DjangoTemplates',
+            'OPTIONS': {'loaders': [
+                ('django.template.loaders.locmem.Loader', {
+                    'notifications/includes/default.html':
+                        '<li>{{ actor }} did it</li>'}),
+                'django.template.loaders.app_directories.Loader',
+            ]},
+        }]
+        nf = self.recipient.notifications.get()
+        with override_settings(TEMPLATES=templates):
+            html = render_notification(nf, render_target='box',
+                                       **nf.as_json())
+        self.assertIn('<li>&lt;actor&gt; did it</li>', html)
+
+    def test_box_render_without_relations(self):
+        for i in range(3):
+            notify.send(User, recipient=self.recipient, actor=self.actor,
+                        verb='followed you', target=self.actor)
+        notifications = self.recipient.notifications.active().prefetch(
+            skip_snapshots=True)
+        with self.assertNumQueries(1):
+            rendered = render_notifications_batch(notifications, 'box')
+        self.assertEqual(len(rendered), 4)
+
+    def test_refresh_command(self):
+        Notification.objects.update(snapshot=None)
+        self.actor.username = 'renamed'
+        self.actor.save()
+        out = StringIO()
+        call_command('notify_refresh_snapshots', stdout=out)
+        self.assertIn('Refreshed 1 notification snapshots', out.getvalue())
+        nf = self.recipient.notifications.get()
+        self.assertEqual(nf.snapshot['actor'], 'renamed')
+
+        out = StringIO()
+        call_command('notify_refresh_snapshots', stdout=out)
+        self.assertIn('Refreshed 0 notification snapshots', out.getvalue())
+        call_command('notify_refresh_snapshots', all=True, stdout=out)
+        self.assertIn('Refreshed 1 notification snapshots', out.getvalue())
+
+
+@override_settings(NOTIFY_UNREAD_COUNTER=True)
+class StateTransitionTest(TestCase):
+
+    def setUp(self):
+        self.recipient = User.objects.create(username='recipient',
+                                             email='recipient@test.com')
+        notify.send(User, recipient=self.recipient, actor_text='Joe',
+                    verb='followed you', extra={'n': 1})
+        counters.rebuild()
+        self.nf = self.recipient.notifications.get()
+
+    def test_mark_as_read_writes_the_read_column(self):
+        # A concurrent change of another column is kept.
+        Notification.objects.update(extra={'n': 2})
+        with self.assertNumQueries(2):
+            self.assertTrue(self.nf.mark_as_read())
+        nf = self.recipient.notifications.get()
+        self.assertTrue(nf.read)
+        self.assertEqual(nf.extra, {'n': 2})
+        self.assertEqual(counters.unread_count(self.recipient), 0)
+
+    def test_transitions_are_idempotent(self):
+        self.assertTrue(self.nf.mark_as_read())
+        self.assertFalse(self.nf.mark_as_read())
+        self.assertTrue(self.nf.mark_as_unread())
+        self.assertFalse(Notification.objects.get().mark_as_unread())
+        self.assertEqual(counters.unread_count(self.recipient), 1)
+
+    def test_soft_delete_and_restore(self):
+        self.assertTrue(self.nf.soft_delete())
+        self.assertFalse(self.nf.soft_delete())
+        self.assertEqual(counters.unread_count(self.recipient), 0)
+        # Reading a deleted notification leaves the counter alone.
+        self.assertTrue(self.nf.mark_as_read())
+        self.assertTrue(self.nf.mark_as_unread())
+        self.assertEqual(counters.unread_count(self.recipient), 0)
+        self.assertTrue(self.nf.restore())
+        self.assertFalse(self.nf.restore())
+        self.assertEqual(counters.unread_count(self.recipient), 1)
+
+    @override_settings(NOTIFY_READ_WATERMARK=True)
+    def test_watermark(self):
+        Notification.objects.read_all(self.recipient)
+        nf = self.recipient.notifications.get()
+        self.assertFalse(nf.mark_as_read())
+        self.assertTrue(nf.mark_as_unread())
+        self.assertEqual(self.recipient.notifications.unread().count(), 1)
+        self.assertEqual(counters.unread_count(self.recipient), 1)
+
+
+@override_settings(NOTIFY_UNREAD_COUNTER=True)
+class BulkActionTest(TestCase):
+
+    def setUp(self):
+        self.recipient = User.objects.create(username='recipient',
+                                             email='recipient@test.com')
+        self.recipient.set_password('pwd@recipient')
+        self.recipient.save()
+        self.other = User.objects.create(username='other',
+                                         email='other@test.com')
+        notify.send(User, recipient_list=[self.recipient, self.other],
+                    actor_text='Joe', verb='posted')
+        for i in range(4):
+            notify.send(User, recipient=self.recipient, actor_text='Joe',
+                        verb='followed you')
+        counters.rebuild()
+        self.ids = list(self.recipient.notifications.order_by(
+            'id').values_list('id', flat=True))
+        self.foreign_id = self.other.notifications.get().id
+        self.client.login(username='recipient', password='pwd@recipient')
+
+    def post(self, ids, action):
+        response = self.client.post(
+            reverse('notifications:bulk'),
+            {'id': ','.join(str(i) for i in ids), 'action': action},
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        return json.loads(response.content.decode('utf-8'))
+
+    def assertUnreadCount(self, count):
+        self.assertEqual(counters.unread_count(self.recipient), count)
+        self.assertEqual(self.recipient.notifications.unread().count(),
+                         count)
+
+    def test_mark_read_single_update(self):
+        ids = self.ids[:3]
+        # Savepoint, locking SELECT, UPDATE, counter and release.
+        with self.assertNumQueries(5):
+            Notification.objects.bulk_action(self.recipient, ids, 'read')
+        response = self.post(ids + [self.foreign_id], 'read')
+        self.assertTrue(response['success'])
+        self.assertEqual(response['results'], {
+            str(self.ids[0]): 'unchanged', str(self.ids[1]): 'unchanged',
+            str(self.ids[2]): 'unchanged', str(self.foreign_id): 'not_found'})
+        self.assertUnreadCount(2)
+        self.assertFalse(self.other.notifications.get().read)
+
+    def test_unread_delete_restore(self):
+        self.post(self.ids[:2], 'read')
+        response = self.post(self.ids[1:3], 'unread')
+        self.assertEqual(response['results'], {
+            str(self.ids[1]): 'updated', str(self.ids[2]): 'unchanged'})
+        self.assertUnreadCount(4)
+
+        self.post(self.ids[:2], 'delete')
+        self.assertUnreadCount(3)
+        self.assertEqual(self.recipient.notifications.deleted().count(), 2)
+        self.post(self.ids, 'restore')
+        self.assertUnreadCount(4)
+
+    @override_settings(NOTIFY_SOFT_DELETE=False)
+    def test_hard_delete(self):
+        self.post(self.ids[:2], 'delete')
+        self.assertEqual(self.recipient.notifications.count(), 3)
+        self.assertUnreadCount(3)
+
+    @override_settings(NOTIFY_READ_WATERMARK=True)
+    def test_watermark(self):
+        Notification.objects.read_all(self.recipient)
+        response = self.post(self.ids[:2], 'read')
+        self.assertEqual(set(response['results'].values()), {'unchanged'})
+        self.post(self.ids[2:4], 'unread')
+        self.assertEqual(
+            list(self.recipient.notifications.unread().order_by(
+                'id').values_list('id', flat=True)), self.ids[2:4])
+        self.assertUnreadCount(2)
+
+    @override_settings(NOTIFY_BULK_ACTION_LIMIT=2)
+    def test_invalid_requests(self):
+        self.assertFalse(self.post(self.ids[:2], 'archive')['success'])
+        self.assertFalse(self.post(['x'], 'read')['success'])
+        self.assertFalse(self.post(self.ids[:3], 'read')['success'])
+        self.assertUnreadCount(5)
+
+
+@override_settings(NOTIFY_BROADCASTS=True, NOTIFY_UNREAD_COUNTER=True)
+class BroadcastTest(TestCase):
+
+    def setUp(self):
+        self.users = []
+        for name in ('alice', 'bob'):
+            user = User.objects.create(username=name,
+                                       email=name + '@test.com')
+            user.set_password('pwd@' + name)
+            user.save()
+            self.users.append(user)
+        self.alice, self.bob = self.users
+        notify.send(User, recipient=self.alice, actor_text='Joe',
+                    verb='followed you')
+        self.broadcast = notify.send(User, broadcast=True,
+                                     actor_text='Admin',
+                                     verb='announced')[0][1]
+
+    def test_single_row(self):
+        self.assertIsNone(self.broadcast.recipient_id)
+        self.assertEqual(Notification.objects.count(), 2)
+        self.assertEqual(BroadcastState.objects.count(), 0)
+
+    def test_merged_into_feed(self):
+        feed = Notification.objects.for_user(self.alice)
+        self.assertEqual(feed.active().count(), 2)
+        self.assertEqual(feed.unread().count(), 2)
+        self.assertEqual(counters.unread_count(self.alice), 2)
+        self.assertEqual(counters.unread_count(self.bob), 1)
+        data = feed.get(pk=self.broadcast.pk).as_json()
+        self.assertTrue(data['broadcast'])
+        self.assertFalse(data['read'])
+
+    def test_state_is_per_user(self):
+        nf = Notification.objects.for_user(self.alice).get(
+            pk=self.broadcast.pk)
+        self.assertTrue(nf.mark_as_read())
+        self.assertFalse(nf.mark_as_read())
+        self.assertEqual(BroadcastState.objects.count(), 1)
+        self.assertTrue(
+            Notification.objects.for_user(self.alice).get(
+                pk=self.broadcast.pk).read)
+        self.assertEqual(counters.unread_count(self.alice), 1)
+        self.assertEqual(counters.unread_count(self.bob), 1)
+
+        self.assertTrue(nf.soft_delete())
+        self.assertEqual(
+            Notification.objects.for_user(self.alice).active().count(), 1)
+        self.assertEqual(
+            Notification.objects.for_user(self.alice).deleted().count(), 1)
+        self.assertTrue(nf.restore())
+        self.assertFalse(Notification.objects.get(
+            pk=self.broadcast.pk).deleted)
+
+    def test_unattached_broadcast_cannot_change(self):
+        with self.assertRaises(ValueError):
+            Notification.objects.get(pk=self.broadcast.pk).mark_as_read()
+
+    def test_mark_all_and_delete_all(self):
+        Notification.objects.read_all(self.alice)
+        self.assertEqual(counters.unread_count(self.alice), 0)
+        self.assertEqual(counters.unread_count(self.bob), 1)
+        self.assertFalse(Notification.objects.get(
+            pk=self.broadcast.pk).read)
+        Notification.objects.unread_all(self.alice)
+        self.assertEqual(counters.unread_count(self.alice), 2)
+        Notification.objects.delete_all(self.bob)
+        self.assertEqual(
+            Notification.objects.for_user(self.bob).active().count(), 0)
+        self.assertEqual(
+            Notification.objects.for_user(self.alice).active().count(), 2)
+
+    def test_hidden_before_joining(self):
+        self.bob.date_joined = timezone.now() + timedelta(minutes=1)
+        self.bob.save()
+        self.assertEqual(
+            Notification.objects.for_user(self.bob).count(), 0)
+
+    def test_update_view(self):
+        self.client.login(username='bob', password='pwd@bob')
+        response = self.client.get(reverse('notifications:update'),
+                                   {'flag': 1})
+        data = json.loads(response.content.decode('utf-8'))
+        self.assertEqual([nf['id'] for nf in data['notifications']],
+                         [self.broadcast.pk])
+        self.assertEqual(data['unread_count'], 1)
+
+        response = self.client.post(
+            reverse('notifications:mark'),
+            {'id': self.broadcast.pk, 'action': 'read'},
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertTrue(json.loads(response.content.decode('utf-8'))[
+            'success'])
+        self.assertEqual(counters.unread_count(self.bob), 0)
+
+    @override_settings(NOTIFY_SOFT_DELETE=False)
+    def test_delete_view_keeps_broadcast(self):
+        self.client.login(username='bob', password='pwd@bob')
+        self.client.post(reverse('notifications:delete'),
+                         {'id': self.broadcast.pk},
+                         HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertTrue(Notification.objects.filter(
+            pk=self.broadcast.pk).exists())
+        self.assertEqual(
+            Notification.objects.for_user(self.bob).active().count(), 0)
+
+    def test_bulk_action(self):
+        results = Notification.objects.bulk_action(
+            self.alice, [self.broadcast.pk], 'read')
+        self.assertEqual(results, {self.broadcast.pk: 'updated'})
+        self.assertEqual(counters.unread_count(self.alice), 1)
+
+    def test_rebuild_counters_command(self):
+        out = StringIO()
+        call_command('notify_rebuild_counters', stdout=out)
+        self.assertIn('Rebuilt unread counters of 1 users', out.getvalue())
+        self.assertEqual(counters.unread_count(self.alice), 2)
+
+    def test_wakes_up_waiting_users(self):
+        backend = LocalBackend()
+        cursor = backend.cursor(self.bob.pk)
+        backend.publish([events.BROADCAST])
+        self.assertTrue(backend.wait(self.bob.pk, cursor, 0, 0))
+
+    def test_database_backend(self):
+        backend = DatabaseBackend()
+        self.assertTrue(
+            backend.wait(self.bob.pk, None, self.broadcast.pk - 1, 0))
+        self.assertFalse(
+            backend.wait(self.bob.pk, None, self.broadcast.pk, 0.05))
+
+    def test_database_backend_skips_broadcasts_before_joining(self):
+        carol = User.objects.create(username='carol', email='carol@test.com')
+        self.assertFalse(Notification.objects.for_user(carol).exists())
+        self.assertFalse(DatabaseBackend().wait(carol.pk, None, 0, 0))
+
+    @override_settings(NOTIFY_BROADCASTS=False)
+    def test_disabled(self):
+        self.assertEqual(
+            Notification.objects.for_user(self.alice).count(), 1)
+        self.assertEqual(counters.unread_count(self.bob), 0)
+
+
+@override_settings(NOTIFY_UNREAD_COUNTER=True)
+class IdempotencyKeyTest(TestCase):
+
+    def setUp(self):
+        self.users = [User.objects.create(username='user-{}'.format(i),
+                                          email='user-{}@test.com'.format(i))
+                      for i in range(3)]
+        counters.rebuild(self.users)
+
+    def send(self, **kwargs):
+        kwargs.setdefault('actor_text', 'Joe')
+        kwargs.setdefault('verb', 'followed you')
+        return notify.send(User, idempotency_key='task-1', **kwargs)[0][1]
+
+    def assertCounts(self, *counts):
+        self.assertEqual(
+            [user.notifications.count() for user in self.users],
+            list(counts))
+        self.assertEqual(
+            [counters.unread_count(user) for user in self.users],
+            list(counts))
+
+    def test_single_send_retry(self):
+        self.send(recipient=self.users[0])
+        self.send(recipient=self.users[0])
+        self.assertCounts(1, 0, 0)
+        notify.send(User, recipient=self.users[0], actor_text='Joe',
+                    verb='followed you', idempotency_key='task-2')
+        self.assertCounts(2, 0, 0)
+
+    def test_other_integrity_errors_are_raised(self):
+        with self.assertRaises(IntegrityError):
+            self.send(recipient=self.users[0], nf_type=None)
+        with self.settings(NOTIFY_BROADCASTS=True):
+            with self.assertRaises(IntegrityError):
+                self.send(broadcast=True, nf_type=None)
+
+    def test_fan_out_retry(self):
+        self.send(recipient=self.users[0])
+        result = self.send(recipient_list=self.users)
+        self.assertEqual(result.created, 2)
+        self.assertCounts(1, 1, 1)
+        result = self.send(recipient_list=self.users + self.users)
+        self.assertEqual(result.created, 0)
+        self.assertCounts(1, 1, 1)
+
+    def test_aggregate_rejects_key(self):
+        # Retries of aggregated sends would be collapsed again.
+        with self.assertRaises(TypeError):
+            self.send(recipient=self.users[0], aggregate=True)
+        with self.assertRaises(TypeError):
+            self.send(recipient_list=self.users, aggregate=True)
+        self.assertCounts(0, 0, 0)
+
+    @override_settings(NOTIFY_BROADCASTS=True)
+    def test_broadcast_retry(self):
+        first = self.send(broadcast=True)
+        self.assertEqual(self.send(broadcast=True), first)
+        self.assertEqual(Notification.objects.count(), 1)
+
+    def test_unique_constraint(self):
+        self.send(recipient=self.users[0])
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                Notification.objects.create(
+                    recipient=self.users[0], actor_text='Joe',
+                    verb='followed you', idempotency_key='task-1')
+
+    def test_key_too_long(self):
+        with self.assertRaises(ValueError):
+            notify.send(User, recipient=self.users[0], actor_text='Joe',
+                        verb='followed you', idempotency_key='x' * 101)
+
+
+@override_settings(NOTIFY_FRAGMENT_CACHE='default')
+class FragmentCacheTest(TestCase):
+
+    def setUp(self):
+        caches['default'].clear()
+        self.recipient = User.objects.create(username='recipient',
+                                             email='recipient@test.com')
+        self.actor = User.objects.create(username='actor',
+                                         email='actor@test.com')
+        for i in range(3):
+            notify.send(User, recipient=self.recipient, actor=self.actor,
+                        verb='followed you', target=self.actor)
+
+    def render_page(self):
+        page = paginate_notifications(
+            self.recipient.notifications.active().prefetch())[0]
+        return [html for nf, data, html in render_notifications_batch(page)]
+
+    def test_warm_render_skips_relations(self):
+        with self.assertNumQueries(2):
+            # Page and users, actors and targets share the content type.
+            cold = self.render_page()
+        with self.assertNumQueries(1):
+            warm = self.render_page()
+        self.assertEqual(cold, warm)
+
+    def test_key_includes_read_flag_and_version(self):
+        nf = self.recipient.notifications.first()
+        self.assertNotEqual(fragment_key(nf.id, False),
+                            fragment_key(nf.id, True))
+        with override_settings(NOTIFY_TEMPLATE_VERSION=2):
+            self.assertNotEqual(fragment_key(nf.id, False),
+                                fragment_key(nf.id, False, 'box'))
+            self.assertIn(':2:', fragment_key(nf.id, False))
+
+    def test_key_includes_language(self):
+        from django.utils import translation
+
+        nf = self.recipient.notifications.first()
+        with translation.override('fr'):
+            html = render_notification(nf)
+            key = fragment_key(nf.id, nf.read)
+        self.assertNotEqual(key, fragment_key(nf.id, nf.read))
+        self.assertEqual(key, fragment_key(nf.id, nf.read, language='fr'))
+        self.assertEqual(caches['default'].get(key), html)
+        nf.mark_as_read()
+        self.assertIsNone(caches['default'].get(key))
+
+    def test_single_render_is_cached(self):
+        nf = self.recipient.notifications.first()
+        html = render_notification(nf)
+        self.assertEqual(
+            caches['default'].get(fragment_key(nf.id, nf.read)), html)
+
+    def test_mark_as_read_invalidates(self):
+        self.render_page()
+        nf = self.recipient.notifications.first()
+        key = fragment_key(nf.id, False)
+        self.assertIsNotNone(caches['default'].get(key))
+        nf.mark_as_read()
+        self.assertIsNone(caches['default'].get(key))
+
+    def test_aggregation_invalidates(self):
+        notify.send(User, recipient=self.recipient, actor=self.actor,
+                    verb='liked your post', aggregate=True)
+        nf = self.recipient.notifications.get(aggregate_key__isnull=False)
+        render_notification(nf)
+        notify.send(User, recipient=self.recipient, actor=self.actor,
+                    verb='liked your post', aggregate=True)
+        self.assertIsNone(
+            caches['default'].get(fragment_key(nf.id, nf.read)))
+
+    @override_settings(NOTIFY_FRAGMENT_CACHE=None)
+    def test_disabled(self):
+        self.render_page()
+        nf = self.recipient.notifications.first()
+        self.assertIsNone(caches['default'].get(fragment_key(nf.id, False)))
+
+
+@override_settings(
+    NOTIFY_METRICS_BACKEND='notify.instrumentation.PrometheusBackend')
+class InstrumentationTest(TestCase):
+
+    def setUp(self):
+        self.recipient = User.objects.create(username='recipient',
+                                             email='recipient@test.com')
+        self.recipient.set_password('pwd@recipient')
+        self.recipient.save()
+        self.backend = instrumentation.get_backend()
+        self.backend._metrics.clear()
+
+    def test_notifier(self):
+        notify.send(User, recipient=self.recipient, actor_text='Joe',
+                    verb='followed you')
+        count, seconds, queries = self.backend._metrics['notifier']
+        self.assertEqual(count, 1)
+        self.assertGreater(seconds, 0)
+        self.assertEqual(queries, 1)
+
+    def test_views_and_rendering(self):
+        notify.send(User, recipient=self.recipient, actor_text='Joe',
+                    verb='followed you')
+        self.assertTrue(self.client.login(username='recipient',
+                                          password='pwd@recipient'))
+        self.client.get(reverse('notifications:update') + '?flag=0')
+        self.client.get(reverse('notifications:list'))
+        for name in ('view.notification_update', 'view.notification_list',
+                     'render_notifications_batch', 'prefetch_relations'):
+            self.assertIn(name, self.backend._metrics)
+
+    def test_template_tag(self):
+        notify.send(User, recipient=self.recipient, actor_text='Joe',
+                    verb='followed you')
+        request = RequestFactory().get('/')
+        request.user = self.recipient
+        Template('{% load notification_tags %}{% user_notifications %}') \
+            .render(RequestContext(request, {}))
+        self.assertEqual(self.backend._metrics['tag.user_notifications'][0],
+                         1)
+
+    def test_prometheus_exposition(self):
+        self.backend.record('notifier', 0.5, 2)
+        self.backend.record('notifier', 0.25, 1)
+        response = instrumentation.metrics_view(RequestFactory().get('/'))
+        content = response.content.decode('utf-8')
+        self.assertIn('# TYPE notify_operation_seconds summary', content)
+        self.assertIn('notify_operation_seconds_count{operation="notifier"} 2',
+                      content)
+        self.assertIn('notify_operation_seconds_sum{operation="notifier"} 0.75',
+                      content)
+        self.assertIn('notify_operation_queries_sum{operation="notifier"} 3',
+                      content)
+
+    @override_settings(
+        NOTIFY_METRICS_BACKEND='notify.instrumentation.LoggingBackend')
+    def test_logging_backend(self):
+        with self.assertLogs('notify.metrics', 'DEBUG') as logs:
+            notify.send(User, recipient=self.recipient, actor_text='Joe',
+                        verb='followed you')
+        self.assertIn('notifier took', logs.output[0])
+
+    @override_settings(NOTIFY_METRICS_BACKEND=None)
+    def test_disabled(self):
+        self.assertIsNone(instrumentation.get_backend())
+        notify.send(User, recipient=self.recipient, actor_text='Joe',
+                    verb='followed you')
+        self.assertEqual(self.backend._metrics, {})
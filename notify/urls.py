@@ -10,10 +10,15 @@ app_name = 'notifications'
 
 urlpatterns = [
     url(r'^all/$', nf.notifications, name="all"),
+    url(r'^api/list/$', nf.notification_list, name="list"),
     url(r'^api/update/$', nf.notification_update, name="update"),
+    url(r'^api/update/wait/$', nf.notification_update_wait,
+        name="update_wait"),
+    url(r'^api/stream/$', nf.notification_stream, name="stream"),
     url(r'^mark/$', nf.mark, name='mark'),
     url(r'^mark-all/$', nf.mark_all, name='mark_all'),
     url(r'^delete/$', nf.delete, name='delete'),
+    url(r'^bulk/$', nf.bulk, name='bulk'),
     url(r'^rdr/(?P<notification_id>[\d]+)/$', nf.read_and_redirect,
         name='read_and_redirect'),
 ]
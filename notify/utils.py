@@ -1,27 +1,309 @@
-from django.template.loader import render_to_string
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.db.models import Q
+from django.template import Context
+from django.template.base import Template as DjangoTemplate
+from django.template.loader import select_template
+from django.utils.dateparse import parse_datetime
+from django.utils.encoding import force_bytes, force_text
+from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
+from django.utils.translation import get_language
+
+from .instrumentation import instrumented
+
+try:
+    from django.utils.autoreload import file_changed
+except ImportError:
+    # django < 2.2
+    file_changed = None
+
+try:
+    from django.template import autoreload as template_autoreload
+except ImportError:
+    # django < 3.2, the development server does not watch templates.
+    template_autoreload = None
+
+# { (nf_type, render_target): Template, ... }
+_template_cache = {}
+
+
+def notification_template_names(nf_type, render_target=''):
+    """
+    Candidate templates of a notification type for a render target, in
+    order of precedence.
 
+    :param nf_type: Notification type.
+    :param render_target: Render target, e.g. ``box``.
 
-def render_notification(notification, render_target='', **extra):
-    template_name = notification.nf_type
+    :return: List of template names.
+    """
     template_dir = 'notifications/includes/'
-
-    nf_ctx = {'notification': notification}
-    nf_ctx.update(extra)
-
     suffix = '_{}'.format(render_target) if render_target and render_target != 'page' else ''
-    templates = [
-        "{0}{1}{2}.html".format(template_dir, template_name, suffix),
+    return [
+        "{0}{1}{2}.html".format(template_dir, nf_type, suffix),
         "{0}default{1}.html".format(template_dir, suffix),
-        "{0}{1}.html".format(template_dir, template_name),
+        "{0}{1}.html".format(template_dir, nf_type),
         "{0}default.html".format(template_dir),
     ]
 
-    return render_to_string(templates, nf_ctx)
 
+def get_notification_template(nf_type, render_target=''):
+    """
+    Returns the compiled template of a notification type for a render
+    target.
+
+    Resolved templates are cached per process, so that the template
+    loaders are only searched once per ``(nf_type, render_target)``. The
+    cache is cleared when templates are reloaded by the development
+    server, on django versions whose development server does not watch
+    templates (before 3.2) it is bypassed when ``DEBUG`` is on.
+
+    :param nf_type: Notification type.
+    :param render_target: Render target, e.g. ``box``.
 
-def prefetch_relations(weak_queryset):
+    :return: Template object of the template backend.
     """
-    FROM: https://djangosnippets.org/snippets/2492/
+    key = (nf_type, render_target or '')
+    if template_autoreload is None and settings.DEBUG:
+        return select_template(notification_template_names(*key))
+    try:
+        return _template_cache[key]
+    except KeyError:
+        template = select_template(notification_template_names(*key))
+        _template_cache[key] = template
+        return template
+
+
+def clear_template_cache(**kwargs):
+    """
+    Empties the cache of ``get_notification_template``.
+    """
+    _template_cache.clear()
+
+
+setting_changed.connect(clear_template_cache)
+if file_changed is not None:
+    file_changed.connect(clear_template_cache)
+
+
+# Render targets whose fragments are deleted by ``invalidate_fragments``.
+FRAGMENT_TARGETS = ('', 'box', 'page')
+
+
+def fragment_cache():
+    """
+    :return: Cache of rendered notifications, ``None`` when
+             ``NOTIFY_FRAGMENT_CACHE`` is not set.
+    """
+    alias = getattr(settings, 'NOTIFY_FRAGMENT_CACHE', None)
+    return caches[alias] if alias else None
+
+
+def fragment_key(notification_id, read, render_target='', language=None):
+    """
+    Cache key of the HTML of a notification, includes
+    ``NOTIFY_TEMPLATE_VERSION`` so that bumping it discards every fragment,
+    and the language the HTML is translated to, the active one by default.
+    """
+    return 'notify:fragment:{}:{}:{}:{}:{}'.format(
+        getattr(settings, 'NOTIFY_TEMPLATE_VERSION', 1), notification_id,
+        int(bool(read)), render_target, language or get_language())
+
+
+def fragment_languages():
+    """
+    :return: Languages fragments may be cached in: ``LANGUAGE_CODE`` and,
+             when ``USE_I18N`` is on, the ``LANGUAGES`` of the site.
+    """
+    languages = set([settings.LANGUAGE_CODE])
+    if settings.USE_I18N:
+        languages.update(code for code, name in settings.LANGUAGES)
+    return languages
+
+
+def invalidate_fragments(notification_ids):
+    """
+    Deletes the cached HTML of notifications, in both read states, for
+    every target of ``FRAGMENT_TARGETS`` and every language of
+    ``fragment_languages()``.
+
+    :param notification_ids: Iterable of notification IDs.
+    """
+    cache = fragment_cache()
+    if cache is None:
+        return
+    languages = fragment_languages()
+    cache.delete_many([fragment_key(notification_id, read, target, language)
+                       for notification_id in notification_ids
+                       for read in (False, True)
+                       for target in FRAGMENT_TARGETS
+                       for language in languages])
+
+
+def _cache_fragments(cache, fragments):
+    cache.set_many(fragments, getattr(settings,
+                                      'NOTIFY_FRAGMENT_CACHE_TIMEOUT', 600))
+
+
+@instrumented('render_notification')
+def render_notification(notification, render_target='', **extra):
+    cache = fragment_cache() if not extra else None
+    if cache is not None:
+        key = fragment_key(notification.id, notification.read, render_target)
+        html = cache.get(key)
+        if html is not None:
+            return html
+
+    nf_ctx = {'notification': notification}
+    nf_ctx.update(extra)
+
+    template = get_notification_template(notification.nf_type, render_target)
+    html = template.render(nf_ctx)
+    if cache is not None:
+        _cache_fragments(cache, {key: html})
+    return html
+
+
+def defer_prefetch(queryset):
+    """
+    Evaluates a queryset marked with ``prefetch()`` without prefetching
+    its generic relations when the fragment cache is enabled:
+    ``render_notifications_batch`` then only prefetches the relations of
+    the notifications missing from the cache.
+
+    :return: The evaluated queryset.
+    """
+    mode = getattr(queryset, '_prefetch_relations', None)
+    if mode and fragment_cache() is not None and \
+            queryset._result_cache is None:
+        del queryset._prefetch_relations
+        queryset._deferred_prefetch = mode
+    len(queryset)
+    return queryset
+
+
+@instrumented('render_notifications_batch')
+def render_notifications_batch(notifications, render_target='',
+                               with_json=None):
+    """
+    Renders many notifications, in their original order.
+
+    Notifications are grouped by ``nf_type``: each group renders with one
+    compiled template and one context, onto which the variables of every
+    notification are pushed and popped. ``as_json()`` is computed once per
+    notification, its data is both supplied to the template (like
+    ``render_notification(nf, **nf.as_json())``) and returned.
+
+    With ``NOTIFY_FRAGMENT_CACHE``, cached HTML is fetched with a single
+    ``get_many()`` and only the missing notifications are rendered, then
+    stored with a single ``set_many()``.
+
+    :param notifications: Iterable of notifications, e.g. a QuerySet.
+    :param render_target: Render target, e.g. ``box``.
+    :param with_json: Whether to compute ``as_json()``, by default only
+                      for the ``box`` target.
+
+    :return: List of ``(notification, data, html)`` tuples, ``data`` is
+             the ``as_json()`` dictionary or an empty one.
+    """
+    if with_json is None:
+        with_json = render_target == 'box'
+
+    cache = fragment_cache()
+    cached = {}
+    keys = {}
+    if cache is not None:
+        defer_prefetch(notifications)
+        keys = dict((nf.id, fragment_key(nf.id, nf.read, render_target))
+                    for nf in notifications)
+        cached = cache.get_many(list(keys.values()))
+
+        mode = getattr(notifications, '_deferred_prefetch', None)
+        if mode:
+            # Relations are needed to render the missing notifications and
+            # for the ``as_json()`` of notifications without a snapshot.
+            prefetch_relations([
+                nf for nf in notifications
+                if not (mode == 'skip_snapshots' and nf.snapshot) and (
+                    keys[nf.id] not in cached or
+                    (with_json and not nf.snapshot))])
+
+    # { nf_type: (template, context or None), ... }
+    groups = {}
+    rendered = []
+    missing = {}
+    for nf in notifications:
+        data = nf.as_json() if with_json else {}
+        html = cached.get(keys.get(nf.id))
+        if html is not None:
+            rendered.append((nf, data, html))
+            continue
+
+        try:
+            template, context = groups[nf.nf_type]
+        except KeyError:
+            template = get_notification_template(nf.nf_type, render_target)
+            context = None
+            if isinstance(getattr(template, 'template', None), DjangoTemplate):
+                context = Context(
+                    autoescape=template.backend.engine.autoescape)
+            groups[nf.nf_type] = template, context
+
+        if context is None:
+            # Not a django template, render it the regular way.
+            nf_ctx = {'notification': nf}
+            nf_ctx.update(data)
+            html = template.render(nf_ctx)
+        else:
+            with context.push(data, notification=nf):
+                html = template.template.render(context)
+        rendered.append((nf, data, html))
+        if cache is not None:
+            missing[keys[nf.id]] = html
+
+    if missing:
+        _cache_fragments(cache, missing)
+    return rendered
+
+
+def _generic_foreign_keys(model):
+    """
+    Lists the ``GenericForeignKey`` descriptors of a model along with the
+    attribute names holding their content type id and object id.
+
+    :param model: Model class to inspect.
+
+    :return: List of ``(gfk, ct_attname, fk_attname)`` tuples.
+    """
+    from django.contrib.contenttypes.fields import GenericForeignKey
+
+    gfks = []
+    for gfk in model.__dict__.values():
+        if not isinstance(gfk, GenericForeignKey):
+            continue
+        ct_attname = model._meta.get_field(gfk.ct_field).get_attname()
+        gfks.append((gfk, ct_attname, gfk.fk_field))
+    return gfks
+
+
+def _cache_related_object(gfk, instance, related):
+    """
+    Stores ``related`` as the cached value of ``gfk`` on ``instance`` so that
+    accessing the descriptor does not hit the database again.
+    """
+    if hasattr(gfk, 'set_cached_value'):
+        gfk.set_cached_value(instance, related)
+    else:
+        # django < 2.0
+        setattr(instance, gfk.cache_attr, related)
+
+
+@instrumented('prefetch_relations')
+def prefetch_relations(weak_queryset, recursive=False):
+    """
+    Resolves every ``GenericForeignKey`` of the objects in ``weak_queryset``
+    using one query per distinct content type.
 
     Consider such a model class::
 
@@ -30,11 +312,6 @@ def prefetch_relations(weak_queryset):
             actor_object_id = models.PositiveIntegerField()
             actor = GenericForeignKey('actor_content_type','actor_object_id')
 
-    And dataset::
-
-        Action(actor=user1).save()
-        Action(actor=user2).save()
-
     This will hit the user table once for each action::
 
         [a.actor for a in Action.objects.all()]
@@ -43,79 +320,126 @@ def prefetch_relations(weak_queryset):
 
         [a.actor for a in prefetch_relations(Action.objects.all())]
 
-    Actually, the example above will hit the database N+1 times,  where N is
-    the number of actions. But with prefetch_relations(), the database will be
-    hit N+1 times where N is the number of distinct content types.
+    The resolver walks the queryset twice: once to collect the object ids
+    wanted for each content type and once to attach the fetched instances
+    using a ``(content_type_id, object_id) -> instance`` map, which keeps
+    the work linear in the number of rows.
+
+    :param weak_queryset: QuerySet (or list) of objects having generic
+                          relations.
+    :param recursive: Also prefetch the generic relations of the related
+                      objects. Off by default as it costs extra queries
+                      which are rarely needed.
 
-    Note that prefetch_relations() is recursive.
+    :return: The supplied ``weak_queryset`` with its relations cached.
+    """
+    from django.contrib.contenttypes.models import ContentType
 
-    Here an example, making a list with prefetch_relations(), and then without
-    prefetch_relations(). See the number of database hits after each test.
+    if not len(weak_queryset):
+        return weak_queryset
 
-        In [1]: from django import db; from prefetch_relations import prefetch_relations
+    model = weak_queryset[0].__class__
+    gfks = _generic_foreign_keys(model)
 
-        In [2]: db.reset_queries()
+    # { content_type_id: set(object_ids), ... }
+    wanted = {}
+    for weak_model in weak_queryset:
+        for gfk, ct_attname, fk_attname in gfks:
+            ct_id = getattr(weak_model, ct_attname)
+            object_id = getattr(weak_model, fk_attname)
+            if not ct_id or object_id is None:
+                continue
+            wanted.setdefault(ct_id, set()).add(int(object_id))
+
+    # { (content_type_id, object_id): instance, ... }
+    resolved = {}
+    for ct_id, object_ids in wanted.items():
+        model_class = ContentType.objects.get_for_id(ct_id).model_class()
+        if model_class is None:
+            # Stale content type, the model no longer exists.
+            continue
+        related = model_class._default_manager.filter(
+            pk__in=object_ids).select_related()
+        if recursive:
+            related = prefetch_relations(related, recursive=True)
+        for obj in related:
+            resolved[(ct_id, obj.pk)] = obj
 
-        In [3]: x = [(a.actor, a.action_object, a.target) for a in prefetch_relations(Action.objects.all().order_by('-pk'))]
+    for weak_model in weak_queryset:
+        for gfk, ct_attname, fk_attname in gfks:
+            ct_id = getattr(weak_model, ct_attname)
+            object_id = getattr(weak_model, fk_attname)
+            if not ct_id or object_id is None:
+                continue
+            related = resolved.get((ct_id, int(object_id)))
+            if related is not None:
+                _cache_related_object(gfk, weak_model, related)
 
-        In [4]: print len(db.connection.queries)
-        34
+    return weak_queryset
 
-        In [5]: db.reset_queries()
 
-        In [6]: print len(db.connection.queries)
-        0
+def encode_cursor(notification):
+    """
+    Encodes the ``(created, id)`` position of a notification as an opaque,
+    URL safe pagination cursor.
 
-        In [7]: x = [(a.actor, a.action_object, a.target) for a in Action.objects.all().order_by('-pk')]
+    :param notification: Last notification of a page.
 
-        In [8]: print len(db.connection.queries)
-        396
+    :return: Cursor string.
     """
-    from django.contrib.contenttypes.models import ContentType
-    from django.contrib.contenttypes.fields import GenericForeignKey
+    position = '{}|{}'.format(notification.created.isoformat(),
+                              notification.id)
+    return force_text(urlsafe_base64_encode(force_bytes(position)))
 
-    # reverse model's generic foreign keys into a dict:
-    # { 'field_name': generic.GenericForeignKey instance, ... }
-    gfks = {}
-    for name, gfk in weak_queryset.model.__dict__.items():
-        if not isinstance(gfk, GenericForeignKey):
-            continue
-        gfks[name] = gfk
 
-    data = {}
-    for weak_model in weak_queryset:
-        for gfk_name, gfk_field in gfks.items():
-            related_content_type_id = getattr(
-                weak_model,
-                gfk_field.model._meta.get_field(gfk_field.ct_field).get_attname())
-            if not related_content_type_id:
-                continue
-            related_content_type = ContentType.objects.get_for_id(related_content_type_id)
-            related_object_id = int(getattr(weak_model, gfk_field.fk_field))
-
-            if related_content_type not in data.keys():
-                data[related_content_type] = []
-            data[related_content_type].append(related_object_id)
-
-    for content_type, object_ids in data.items():
-        model_class = content_type.model_class()
-        models = prefetch_relations(model_class.objects.filter(pk__in=object_ids).select_related())
-        for model in models:
-            for weak_model in weak_queryset:
-                for gfk_name, gfk_field in gfks.items():
-                    related_content_type_id = getattr(
-                        weak_model,
-                        gfk_field.model._meta.get_field(gfk_field.ct_field).get_attname())
-                    if not related_content_type_id:
-                        continue
-                    related_content_type = ContentType.objects.get_for_id(related_content_type_id)
-                    related_object_id = int(getattr(weak_model, gfk_field.fk_field))
-
-                    if related_object_id != model.pk:
-                        continue
-                    if related_content_type != content_type:
-                        continue
-
-                    setattr(weak_model, gfk_name, model)
+def decode_cursor(cursor):
+    """
+    Decodes a cursor created by ``encode_cursor``.
 
-    return weak_queryset
+    :param cursor: Cursor string.
+
+    :return: ``(created, id)`` tuple or ``None`` if the cursor is invalid.
+    """
+    try:
+        created, pk = force_text(urlsafe_base64_decode(cursor)).split('|')
+        created = parse_datetime(created)
+        pk = int(pk)
+    except (TypeError, ValueError):
+        return None
+    if created is None:
+        return None
+    return created, pk
+
+
+def paginate_notifications(queryset, cursor=None, limit=None):
+    """
+    Keyset (cursor) pagination of notifications, newest first.
+
+    Unlike ``OFFSET`` pagination, a page is fetched by filtering on the
+    ``(created, id)`` position of the last notification of the previous
+    page, which costs the same for every page.
+
+    :param queryset: Notification QuerySet.
+    :param cursor: Cursor of the previous page, first page if ``None`` or
+                   invalid.
+    :param limit: Page size, defaults to ``NOTIFY_PAGE_SIZE``.
+
+    :return: Tuple of the evaluated page QuerySet and the cursor of the
+             next page, ``None`` for the last page.
+    """
+    if limit is None:
+        limit = getattr(settings, 'NOTIFY_PAGE_SIZE', 20)
+
+    queryset = queryset.order_by('-created', '-id')
+    position = decode_cursor(cursor) if cursor else None
+    if position:
+        created, pk = position
+        queryset = queryset.filter(
+            Q(created__lt=created) | Q(created=created, id__lt=pk))
+
+    page = defer_prefetch(queryset[:limit])
+    notifications = list(page)
+    next_cursor = None
+    if notifications and len(notifications) == limit:
+        next_cursor = encode_cursor(notifications[-1])
+    return page, next_cursor
@@ -6,13 +6,19 @@ try:
 except ImportError:
     from django.urls import reverse
 
-from django.http import JsonResponse, HttpResponseBadRequest, HttpResponseRedirect
+from django.db.models import Max
+from django.http import Http404, JsonResponse, HttpResponseBadRequest, \
+    HttpResponseRedirect, StreamingHttpResponse
 from django.shortcuts import render
 from django.utils.http import is_safe_url
 from django.utils.translation import ugettext as _
-from django.views.decorators.http import require_POST
-from .models import Notification
-from .utils import render_notification
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition, require_POST
+from . import counters, events, streaming
+from .instrumentation import instrumented
+from .models import BULK_ACTIONS, Notification
+from .utils import (invalidate_fragments, paginate_notifications,
+                    render_notifications_batch)
 
 # TODO: Convert function-based views to Class-based views.
 
@@ -39,6 +45,7 @@ def notification_redirect(request, ctx):
             return HttpResponseRedirect(reverse('notifications:all'))
 
 
+@instrumented('view.notifications')
 @login_required
 def notifications(request):
     """
@@ -47,15 +54,66 @@ def notifications(request):
     Each notification type is expected to have a render template
     at ``notifications/includes/NOTIFICATION_TYPE.html``.
 
+    Notifications are paginated with a cursor, the ``cursor`` URL
+    parameter of the next page is supplied to the template as
+    ``next_cursor``.
+
     :param request: HTTP request context.
 
     :return: Rendered notification list page.
     """
-    notification_list = request.user.notifications.active().prefetch()
+    notification_list, next_cursor = paginate_notifications(
+        Notification.objects.for_user(request.user).active().prefetch(),
+        cursor=request.GET.get('cursor'))
     return render(request, 'notifications/all.html',
-                  {'notifications': notification_list})
+                  {'notifications': notification_list,
+                   'next_cursor': next_cursor})
 
 
+@instrumented('view.notification_list')
+@login_required
+def notification_list(request):
+    """
+    Returns a page of notifications of the logged-in user in JSON format.
+
+    URL parameters:
+
+        - ``cursor``: ``next_cursor`` of the previous page, the first \
+        page is returned without it.
+        - ``limit``: Page size, at most ``NOTIFY_MAX_PAGE_SIZE``.
+        - ``target``: Render target of the notification HTML, \
+        ``box`` by default.
+
+    :param request: HTTP request context.
+
+    :return: Notifications and the cursor of the next page in JSON format.
+    """
+    target = request.GET.get('target', 'box')
+    limit = request.GET.get('limit', '')
+    max_limit = getattr(settings, 'NOTIFY_MAX_PAGE_SIZE', 100)
+    limit = min(int(limit), max_limit) if limit.isdigit() and int(limit) \
+        else None
+
+    page, next_cursor = paginate_notifications(
+        Notification.objects.for_user(request.user).active().prefetch(
+            skip_snapshots=target == 'box'),
+        cursor=request.GET.get('cursor'), limit=limit)
+
+    notification_list = []
+    for nf, notification, html in render_notifications_batch(
+            page, render_target=target, with_json=True):
+        notification['html'] = html
+        notification_list.append(notification)
+
+    ctx = {
+        "notifications": notification_list,
+        "next_cursor": next_cursor,
+        "success": True,
+    }
+    return JsonResponse(ctx)
+
+
+@instrumented('view.mark')
 @login_required
 @require_POST
 def mark(request):
@@ -73,8 +131,8 @@ def mark(request):
 
     if notification_id:
         try:
-            notification = Notification.objects.get(pk=notification_id,
-                                                    recipient=request.user)
+            notification = Notification.objects.for_user(
+                request.user).get(pk=notification_id)
             if action == 'read':
                 notification.mark_as_read()
                 msg = _("Marked as read")
@@ -96,6 +154,7 @@ def mark(request):
     return notification_redirect(request, ctx)
 
 
+@instrumented('view.mark_all')
 @login_required
 @require_POST
 def mark_all(request):
@@ -111,10 +170,10 @@ def mark_all(request):
     success = True
 
     if action == 'read':
-        request.user.notifications.read_all()
+        Notification.objects.read_all(request.user)
         msg = _("Marked all notifications as read")
     elif action == 'unread':
-        request.user.notifications.unread_all()
+        Notification.objects.unread_all(request.user)
         msg = _("Marked all notifications as unread")
     else:
         msg = _("Invalid mark action")
@@ -125,6 +184,7 @@ def mark_all(request):
     return notification_redirect(request, ctx)
 
 
+@instrumented('view.delete')
 @login_required
 @require_POST
 def delete(request):
@@ -146,14 +206,19 @@ def delete(request):
 
     if notification_id:
         try:
-            notification = Notification.objects.get(pk=notification_id,
-                                                    recipient=request.user)
+            notification = Notification.objects.for_user(
+                request.user).get(pk=notification_id)
             soft_delete = getattr(settings, 'NOTIFY_SOFT_DELETE', True)
-            if soft_delete:
-                notification.deleted = True
-                notification.save()
+            # Broadcasts are shared, they are only deleted for the user.
+            if soft_delete or notification.recipient_id is None:
+                notification.soft_delete()
             else:
+                was_unread = not notification.read and \
+                    not notification.deleted
                 notification.delete()
+                invalidate_fragments([notification_id])
+                if was_unread:
+                    counters.adjust({request.user.pk: -1})
             msg = _("Deleted notification successfully")
         except Notification.DoesNotExist:
             success = False
@@ -167,7 +232,70 @@ def delete(request):
     return notification_redirect(request, ctx)
 
 
+@instrumented('view.bulk')
 @login_required
+@require_POST
+def bulk(request):
+    """
+    Applies a mark or delete action to many notifications at once, e.g.
+    the notifications selected on a page. Takes the ``id`` (repeated, or
+    comma separated) and ``action`` POST data, the action being ``read``,
+    ``unread``, ``delete`` or ``restore``. Deletions follow
+    ``NOTIFY_SOFT_DELETE``.
+
+    At most ``NOTIFY_BULK_ACTION_LIMIT`` IDs are accepted per request.
+
+    :param request: HTTP request context.
+
+    :return: Response to the action, with the result of every ID
+             (``updated``, ``unchanged`` or ``not_found``) in ``results``.
+    """
+    action = request.POST.get('action', None)
+    ids = [notification_id for value in request.POST.getlist('id')
+           for notification_id in value.split(',') if notification_id]
+    limit = getattr(settings, 'NOTIFY_BULK_ACTION_LIMIT', 100)
+    success = False
+    results = {}
+
+    if action not in BULK_ACTIONS:
+        msg = _("Invalid bulk action.")
+    elif not ids or not all(i.isdigit() for i in ids):
+        msg = _("Invalid Notification ID")
+    elif len(ids) > limit:
+        msg = _("Too many notifications, at most {limit} are "
+                "allowed.").format(limit=limit)
+    else:
+        results = Notification.objects.bulk_action(request.user, ids, action)
+        success = True
+        msg = _("Updated {count} notifications").format(
+            count=sum(result == 'updated' for result in results.values()))
+
+    ctx = {'msg': msg, 'success': success, 'action': action,
+           'results': dict((str(k), v) for k, v in results.items())}
+
+    return notification_redirect(request, ctx)
+
+
+def notification_update_etag(request):
+    """
+    ``ETag`` of ``notification_update``, built from the URL parameters and
+    the version of the user's notifications (see ``counters.version``).
+
+    :param request: HTTP request context.
+
+    :return: ETag string, ``None`` for invalid requests.
+    """
+    flag = request.GET.get('flag', '')
+    if not flag.isdigit():
+        return None
+    return '{}-{}-{}'.format(flag, request.GET.get('target', 'box'),
+                             counters.version(request.user))
+
+
+@instrumented('view.notification_update')
+@login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=notification_update_etag)
 def notification_update(request):
     """
     Handles live updating of notifications, follows ajax-polling approach.
@@ -223,6 +351,11 @@ def notification_update(request):
 
             - That makes: ``notifications/includes/comment_reply_box.html``
 
+        - The response has an ``ETag``, when it is sent back in the \
+        ``If-None-Match`` header and nothing changed since, a \
+        ``304 Not Modified`` response is returned without querying \
+        or rendering the notifications.
+
         - The rest is self-explanatory.
 
     :param request: HTTP request context.
@@ -235,21 +368,21 @@ def notification_update(request):
 
     if last_notification:
 
-        new_notifications = request.user.notifications.filter(
-            id__gt=last_notification).active().prefetch()
+        new_notifications = Notification.objects.for_user(
+            request.user).filter(id__gt=last_notification).active().prefetch(
+                skip_snapshots=target == 'box')
 
         msg = _("Notifications successfully retrieved.") \
             if new_notifications else _("No new notifications.")
         notification_list = []
-        for nf in new_notifications:
-            notification = nf.as_json()
+        for nf, notification, html in render_notifications_batch(
+                new_notifications, render_target=target, with_json=True):
+            notification['html'] = html
             notification_list.append(notification)
-            notification['html'] = render_notification(
-                nf, render_target=target, **notification)
 
         ctx = {
             "retrieved": len(new_notifications),
-            "unread_count": request.user.notifications.unread().count(),
+            "unread_count": counters.unread_count(request.user),
             "notifications": notification_list,
             "success": True,
             "msg": msg,
@@ -264,6 +397,81 @@ def notification_update(request):
     return JsonResponse(ctx)
 
 
+@instrumented('view.notification_update_wait')
+@login_required
+def notification_update_wait(request):
+    """
+    Long-polling variant of ``notification_update``.
+
+    Takes the same URL parameters but holds the request until a new
+    notification arrives for the user or ``NOTIFY_LONG_POLL_TIMEOUT``
+    seconds have elapsed, then responds exactly like
+    ``notification_update``.
+
+    The request is woken up by the backend set in
+    ``NOTIFY_EVENT_BACKEND``, see ``notify.events``.
+
+    :param request: HTTP request context.
+
+    :return: Notification updates (if any) in JSON format.
+    """
+    flag = request.GET.get('flag', '')
+
+    if flag.isdigit():
+        backend = events.get_backend()
+        cursor = backend.cursor(request.user.pk)
+        has_new = Notification.objects.for_user(request.user).filter(
+            id__gt=int(flag)).active().exists()
+        if not has_new:
+            timeout = getattr(settings, 'NOTIFY_LONG_POLL_TIMEOUT', 25)
+            backend.wait(request.user.pk, cursor, int(flag), timeout)
+
+    return notification_update(request)
+
+
+@instrumented('view.notification_stream')
+@login_required
+def notification_stream(request):
+    """
+    Streams new notifications of the user as Server-Sent Events, see
+    ``notify.streaming`` for the events sent.
+
+    The stream starts after the notification ID supplied in the
+    ``Last-Event-ID`` header (sent by browsers when reconnecting) or the
+    ``flag`` URL parameter. Without either, only notifications created
+    after the connection was opened are sent.
+
+    The stream blocks a worker thread for its whole lifetime and is only
+    served under WSGI. Under ASGI it would block the event loop, it is
+    refused with a 404 response and ``notifyX.js`` falls back to polling.
+
+    :param request: HTTP request context.
+
+    :return: ``text/event-stream`` streaming response.
+    """
+    if hasattr(request, 'scope'):
+        raise Http404(_("Streams are not served under ASGI."))
+
+    flag = request.META.get('HTTP_LAST_EVENT_ID') or \
+        request.GET.get('flag', '')
+    target = request.GET.get('target', 'box')
+
+    if flag.isdigit():
+        last_id = int(flag)
+    else:
+        last_id = Notification.objects.for_user(request.user).aggregate(
+            last_id=Max('id'))['last_id'] or 0
+
+    stream = streaming.event_stream(request.user, last_id, target)
+    response = StreamingHttpResponse(stream,
+                                     content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Disables response buffering of nginx.
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@instrumented('view.read_and_redirect')
 @login_required
 def read_and_redirect(request, notification_id):
     """
@@ -287,7 +495,8 @@ def read_and_redirect(request, notification_id):
     else:
         target = notification_page
     try:
-        user_nf = request.user.notifications.get(pk=notification_id)
+        user_nf = Notification.objects.for_user(request.user).get(
+            pk=notification_id)
         if not user_nf.read:
             user_nf.mark_as_read()
     except Notification.DoesNotExist:
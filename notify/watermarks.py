@@ -0,0 +1,178 @@
+"""
+Per-user read watermarks.
+
+When ``NOTIFY_READ_WATERMARK`` is enabled, marking all the notifications
+of a user as read does not update their rows: it stores the ID of the
+user's latest notification in ``ReadWatermark.read_until``. Every
+notification of the user up to that ID is read, whatever its ``read``
+column, the column only matters for the notifications above it.
+
+    - ``unread()``, ``read()`` and the unread counters interpret the
+      watermark, see ``unread_q()`` and ``read_q()``.
+    - Notifications loaded from a ``NotificationQueryset`` get their
+      ``read`` attribute set when they are below the watermark, so
+      templates and ``as_json()`` need no change.
+    - Marking a notification below the watermark as unread moves the
+      watermark below it, after flagging the notifications in between as
+      read.
+    - Marking all notifications as unread removes the watermark and
+      clears the ``read`` column of every read notification of the user.
+
+These two operations are the only ones writing more than a single row.
+Watermarks require django 1.11 or later, ``NOTIFY_READ_WATERMARK`` is
+ignored on older versions.
+"""
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Max, Q
+from django.db.models.functions import Coalesce
+
+try:
+    from django.db.models import OuterRef, Subquery
+except ImportError:
+    # django < 1.11
+    OuterRef = Subquery = None
+
+from . import counters
+
+
+def watermark_enabled():
+    """
+    Whether read watermarks are used.
+    """
+    return Subquery is not None and \
+        getattr(settings, 'NOTIFY_READ_WATERMARK', False)
+
+
+def read_until_expression():
+    """
+    Expression of the watermark of the recipient of a notification row,
+    ``0`` when there is none.
+    """
+    from .models import ReadWatermark
+
+    return Coalesce(Subquery(ReadWatermark.objects.filter(
+        user=OuterRef('recipient')).values('read_until')[:1]), 0)
+
+
+def unread_q():
+    """
+    :return: ``Q`` object matching the unread notifications.
+    """
+    if not watermark_enabled():
+        return Q(read=False)
+    return Q(read=False, id__gt=read_until_expression())
+
+
+def read_q():
+    """
+    :return: ``Q`` object matching the read notifications.
+    """
+    if not watermark_enabled():
+        return Q(read=True)
+    return Q(read=True) | Q(id__lte=read_until_expression())
+
+
+def get(user):
+    """
+    :param user: User instance or ID.
+
+    :return: Watermark of the user, ``0`` when there is none.
+    """
+    from .models import ReadWatermark
+
+    return ReadWatermark.objects.filter(
+        user=getattr(user, 'pk', user)).values_list(
+        'read_until', flat=True).first() or 0
+
+
+def _set(user_id, read_until):
+    from .models import ReadWatermark
+
+    watermark = ReadWatermark.objects.filter(user_id=user_id)
+    if not watermark.update(read_until=read_until):
+        try:
+            with transaction.atomic():
+                ReadWatermark.objects.create(user_id=user_id,
+                                             read_until=read_until)
+        except IntegrityError:
+            # Created concurrently.
+            watermark.update(read_until=read_until)
+
+
+def attach(notifications):
+    """
+    Sets the ``read`` attribute of loaded notifications below the
+    watermark of their recipient, with a single query.
+
+    :param notifications: List of ``Notification`` instances.
+    """
+    from .models import ReadWatermark
+
+    if not notifications:
+        return
+    watermarks = dict(ReadWatermark.objects.filter(
+        user__in=set(nf.recipient_id for nf in notifications)).values_list(
+        'user', 'read_until'))
+    for nf in notifications:
+        if nf.id <= watermarks.get(nf.recipient_id, 0):
+            nf.read = True
+
+
+def mark_all_read(user):
+    """
+    Marks all notifications of a user as read by moving the watermark to
+    the latest one, then sets the unread counter of the user to the number
+    of unread notifications above the watermark.
+
+    :param user: User instance or ID.
+    """
+    from .models import Notification
+
+    user_id = getattr(user, 'pk', user)
+    notifications = Notification.objects.filter(recipient=user_id)
+    read_until = notifications.aggregate(last_id=Max('id'))['last_id']
+    if read_until is None or read_until <= get(user_id):
+        return
+    _set(user_id, read_until)
+    if counters.counter_enabled():
+        counters.store({user_id: notifications.filter(
+            deleted=False, read=False, id__gt=read_until).count()})
+
+
+def mark_all_unread(user):
+    """
+    Marks all notifications of a user as unread: removes the watermark
+    and clears the ``read`` column of the notifications flagged as read.
+
+    :param user: User instance or ID.
+    """
+    from .models import Notification
+
+    user_id = getattr(user, 'pk', user)
+    notifications = Notification.objects.filter(recipient=user_id,
+                                                deleted=False)
+    _set(user_id, 0)
+    notifications.filter(read=True).update(read=False)
+    if counters.counter_enabled():
+        counters.store({user_id: notifications.count()})
+
+
+def lower(notification):
+    """
+    Moves the watermark of the recipient below a notification, when it
+    covers it, so that the notification can be marked as unread. The
+    notifications between it and the previous watermark are flagged as
+    read to keep them read.
+
+    :param notification: Notification about to be marked as unread.
+    """
+    from .models import Notification
+
+    read_until = get(notification.recipient_id)
+    if notification.id > read_until:
+        return
+    Notification.objects.filter(
+        recipient=notification.recipient_id, id__gt=notification.id,
+        id__lte=read_until, read=False).update(read=True)
+    _set(notification.recipient_id, notification.id - 1)
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+"""
+Runs the benchmark suite in ``benchmarks/suite.py`` and prints the results
+as JSON, e.g.::
+
+    python runbenchmarks.py --quick
+    NOTIFY_BENCH_DB=postgresql python runbenchmarks.py --output bench.json
+
+Every result has the number of queries, the wall time (in seconds, the
+best of ``--repeat`` runs) and the peak memory allocated by Python (in
+bytes, measured in a separate run as tracing slows the code down).
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+from timeit import default_timer
+
+import django
+from django.conf import settings
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2, peak memory is not reported.
+    tracemalloc = None
+
+SIZES = [1, 1000, 100000]
+QUICK_SIZES = [1, 100, 1000]
+
+
+def run_once(setup, params, measure_memory=False):
+    from django.db import connection, transaction
+    from django.test.utils import CaptureQueriesContext
+
+    with transaction.atomic():
+        func = setup(**params)
+        if measure_memory:
+            tracemalloc.start()
+            func()
+            result = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        else:
+            with CaptureQueriesContext(connection) as queries:
+                start = default_timer()
+                func()
+                result = default_timer() - start, len(queries)
+        transaction.set_rollback(True)
+    return result
+
+
+def run(names=None, sizes=SIZES, repeat=1, memory=True, stream=sys.stderr):
+    from benchmarks.suite import BENCHMARKS
+
+    results = []
+    for name, setup, params_factory in BENCHMARKS:
+        if names and not any(part in name for part in names):
+            continue
+        for params in params_factory(sizes):
+            runs = [run_once(setup, params) for i in range(repeat)]
+            result = {
+                'name': name,
+                'params': params,
+                'queries': runs[0][1],
+                'wall_time': min(wall_time for wall_time, queries in runs),
+                'peak_memory': None,
+            }
+            if memory and tracemalloc is not None:
+                result['peak_memory'] = run_once(setup, params, True)
+            results.append(result)
+            stream.write('{name} {params}: {wall_time:.4f}s, {queries} '
+                         'queries\n'.format(**result))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('names', nargs='*',
+                        help="Only run the benchmarks whose name contains "
+                             "one of these.")
+    parser.add_argument('--quick', action='store_true',
+                        help="Use sizes of {} instead of {}.".format(
+                            QUICK_SIZES, SIZES))
+    parser.add_argument('--repeat', type=int, default=1,
+                        help="Number of timed runs of every benchmark.")
+    parser.add_argument('--no-memory', action='store_true',
+                        help="Skip the peak memory measurement.")
+    parser.add_argument('--output', help="Write the JSON report to a file.")
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+    django.setup()
+
+    from django.db import connection
+    from django.test.utils import setup_test_environment
+
+    import notify
+
+    setup_test_environment()
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0)
+    try:
+        results = run(args.names, QUICK_SIZES if args.quick else SIZES,
+                      args.repeat, not args.no_memory)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    report = {
+        'meta': {
+            'notify': notify.__version__,
+            'django': django.get_version(),
+            'python': platform.python_version(),
+            'database': connection.vendor,
+            'date': datetime.datetime.utcnow().isoformat(),
+            'settings': dict((name, getattr(settings, name))
+                             for name in dir(settings)
+                             if name.startswith('NOTIFY_')),
+        },
+        'results': results,
+    }
+    output = json.dumps(report, indent=2, sort_keys=True, default=str)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        sys.stdout.write(output + '\n')
+
+
+if __name__ == "__main__":
+    main()
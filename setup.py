@@ -25,7 +25,7 @@ setup(
     author='Vikas Yadav',
     author_email='v1k45x@gmail.com',
     url="https://github.com/v1k45/django-notify-x",
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks', 'benchmarks.*']),
     package_data={'notify': ['static/notify/*js',
                              'templates/*.html',
                              'templates/notifications/*.html',